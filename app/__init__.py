@@ -1,4 +1,3 @@
-from app.face_alignment import FaceAligner
 shape_predictor_path = "data/shape_predictor_68_face_landmarks.dat"
-face_alignment = FaceAligner(shape_predictor_path)
-
+# The predictor is loaded lazily through app.model_registry; importing the
+# package does not load dlib, so the numeric modules can be used without it
@@ -0,0 +1,220 @@
+#!/usr/bin/python3
+"""
+Approximate nearest-neighbour search over face encodings using an
+inverted file (IVF) index with a k-means coarse quantizer
+"""
+
+import numpy as np
+
+
+def squared_distances(queries, vectors, sq_norms=None):
+    """
+    Computes squared euclidean distances between every query and every vector.
+
+    Args:
+        queries (numpy.ndarray): An (M, D) float32 matrix.
+        vectors (numpy.ndarray): An (N, D) float32 matrix.
+        sq_norms (numpy.ndarray, optional): Precomputed squared norms of `vectors`.
+
+    Returns:
+        numpy.ndarray: An (M, N) matrix of squared distances.
+    """
+    if sq_norms is None:
+        sq_norms = np.einsum('ij,ij->i', vectors, vectors)
+    distances = queries @ vectors.T
+    distances *= -2.0
+    distances += sq_norms
+    distances += np.einsum('ij,ij->i', queries, queries)[:, None]
+    np.maximum(distances, 0.0, out=distances)
+    return distances
+
+
+def smallest_k(distances, k):
+    """
+    Selects the k smallest entries of every row, sorted ascending.
+
+    Args:
+        distances (numpy.ndarray): An (M, N) distance matrix.
+        k (int): The number of entries to keep per row.
+
+    Returns:
+        tuple: (distances, columns), both of shape (M, min(k, N)).
+    """
+    k = min(k, distances.shape[1])
+    if k < distances.shape[1]:
+        columns = np.argpartition(distances, k - 1, axis=1)[:, :k]
+    else:
+        columns = np.broadcast_to(np.arange(distances.shape[1]), distances.shape)
+    selected = np.take_along_axis(distances, columns, axis=1)
+    order = np.argsort(selected, axis=1)
+    return (np.take_along_axis(selected, order, axis=1),
+            np.take_along_axis(columns, order, axis=1))
+
+
+def exact_search(vectors, queries, k, sq_norms=None):
+    """
+    Brute-force k nearest neighbours, used as ground truth for recall.
+
+    Args:
+        vectors (numpy.ndarray): The (N, D) gallery matrix.
+        queries (numpy.ndarray): The (M, D) query matrix.
+        k (int): The number of neighbours per query.
+        sq_norms (numpy.ndarray, optional): Precomputed squared norms of `vectors`.
+
+    Returns:
+        tuple: (squared distances, row indices), both of shape (M, min(k, N)).
+    """
+    return smallest_k(squared_distances(queries, vectors, sq_norms), k)
+
+
+def recall_at_k(approximate_indices, exact_indices):
+    """
+    Measures the fraction of the exact k nearest neighbours an index returned.
+
+    Args:
+        approximate_indices (numpy.ndarray): (M, k) row indices from the index, -1 for none.
+        exact_indices (numpy.ndarray): (M, k) row indices from exact_search.
+
+    Returns:
+        float: Recall between 0.0 and 1.0.
+    """
+    hits = 0
+    for found, truth in zip(approximate_indices, exact_indices):
+        hits += np.intersect1d(found[found >= 0], truth).size
+    return hits / float(exact_indices.size) if exact_indices.size else 1.0
+
+
+class IVFIndex:
+    """
+    Class for an inverted file index: vectors are bucketed by their nearest
+    k-means centroid and a query only scans the `nprobe` closest buckets.
+
+    The index stores row numbers only; the vectors themselves stay in the
+    caller's matrix, which is passed to every search.
+    """
+
+    def __init__(self, nlist=None, nprobe=8, iterations=10, max_training_points=65536, seed=0):
+        """
+        Initializes an untrained IVFIndex.
+
+        Args:
+            nlist (int, optional): Number of buckets. Defaults to about 4 * sqrt(N) at build time.
+            nprobe (int): Number of buckets scanned per query; higher is slower but more accurate.
+            iterations (int): Number of k-means iterations.
+            max_training_points (int): Sample size used to train the centroids.
+            seed (int): Random seed for sampling and centroid initialization.
+        """
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.iterations = iterations
+        self.max_training_points = max_training_points
+        self.seed = seed
+        self.centroids = None
+        self._lists = []
+
+    @property
+    def is_trained(self):
+        return self.centroids is not None
+
+    def train(self, vectors):
+        """
+        Trains the coarse quantizer with k-means on (a sample of) the vectors.
+
+        Args:
+            vectors (numpy.ndarray): The (N, D) float32 gallery matrix.
+        """
+        rng = np.random.default_rng(self.seed)
+        nlist = self.nlist or max(1, int(4 * np.sqrt(len(vectors))))
+        nlist = min(nlist, len(vectors))
+        if len(vectors) > self.max_training_points:
+            sample = vectors[rng.choice(len(vectors), self.max_training_points, replace=False)]
+        else:
+            sample = vectors
+        centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+        for _ in range(self.iterations):
+            assignment = squared_distances(sample, centroids).argmin(axis=1)
+            counts = np.bincount(assignment, minlength=nlist)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignment, sample)
+            empty = counts == 0
+            centroids[~empty] = sums[~empty] / counts[~empty, None]
+            if empty.any():
+                centroids[empty] = sample[rng.choice(len(sample), int(empty.sum()))]
+        self.nlist = nlist
+        self.centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+        self._lists = [np.empty(0, dtype=np.int64) for _ in range(nlist)]
+
+    def assign(self, vectors):
+        """Returns the bucket number of every vector"""
+        return squared_distances(vectors, self.centroids).argmin(axis=1)
+
+    def add(self, vectors, first_row=0):
+        """
+        Adds vectors to their buckets.
+
+        Args:
+            vectors (numpy.ndarray): The (M, D) vectors to add.
+            first_row (int): The gallery row number of vectors[0].
+        """
+        if len(vectors) == 0:
+            return
+        assignment = self.assign(vectors)
+        rows = np.arange(first_row, first_row + len(vectors), dtype=np.int64)
+        order = np.argsort(assignment, kind='stable')
+        buckets, starts = np.unique(assignment[order], return_index=True)
+        for bucket, chunk in zip(buckets, np.split(rows[order], starts[1:])):
+            self._lists[bucket] = np.concatenate((self._lists[bucket], chunk))
+
+    def compact(self, keep):
+        """
+        Drops removed rows from the buckets and renumbers the rest to match a compacted matrix.
+
+        Args:
+            keep (numpy.ndarray): Boolean mask over the old rows, True for rows that survive.
+        """
+        new_rows = np.cumsum(keep) - 1
+        self._lists = [new_rows[rows[keep[rows]]] for rows in self._lists]
+
+    def build(self, vectors):
+        """
+        Trains the index and adds every vector to it.
+
+        Args:
+            vectors (numpy.ndarray): The (N, D) float32 gallery matrix.
+        """
+        self.train(vectors)
+        self.add(vectors)
+
+    def search(self, vectors, queries, k, sq_norms=None, nprobe=None, alive=None):
+        """
+        Finds approximate k nearest neighbours by scanning the closest buckets.
+
+        Args:
+            vectors (numpy.ndarray): The (N, D) gallery matrix the index was built over.
+            queries (numpy.ndarray): The (M, D) query matrix.
+            k (int): The number of neighbours per query.
+            sq_norms (numpy.ndarray, optional): Precomputed squared norms of `vectors`.
+            nprobe (int, optional): Overrides the number of buckets scanned.
+            alive (numpy.ndarray, optional): Boolean mask of rows that may be returned.
+
+        Returns:
+            tuple: (squared distances, row indices), both of shape (M, k),
+                padded with inf and -1 when fewer than k candidates were scanned.
+        """
+        nprobe = min(nprobe or self.nprobe, self.nlist)
+        _, probes = smallest_k(squared_distances(queries, self.centroids), nprobe)
+        out_distances = np.full((len(queries), k), np.inf, dtype=np.float32)
+        out_indices = np.full((len(queries), k), -1, dtype=np.int64)
+        for i, query in enumerate(queries):
+            rows = np.concatenate([self._lists[bucket] for bucket in probes[i]])
+            if alive is not None:
+                rows = rows[alive[rows]]
+            if rows.size == 0:
+                continue
+            norms = sq_norms[rows] if sq_norms is not None else None
+            distances, columns = smallest_k(
+                squared_distances(query[None, :], vectors[rows], norms), k)
+            found = distances.shape[1]
+            out_distances[i, :found] = distances[0]
+            out_indices[i, :found] = rows[columns[0]]
+        return out_distances, out_indices
@@ -0,0 +1,150 @@
+#!/usr/bin/python3
+"""
+Compact binary storage for face encodings: raw little-endian float
+blobs with a small dtype/shape header, decoded without copying
+"""
+
+import pickle
+import struct
+
+import numpy as np
+from sqlalchemy.types import LargeBinary, TypeDecorator
+
+from app import metrics
+
+MAGIC = b'FXE1'
+DTYPE_CODES = {'float32': b'f', 'float16': b'e'}
+CODE_DTYPES = {b'f': np.dtype('<f4'), b'e': np.dtype('<f2')}
+_HEADER = struct.Struct('<4scB')
+
+
+def is_encoded(blob):
+    """Returns True if the blob uses the binary encoding format"""
+    return blob is not None and bytes(blob[:len(MAGIC)]) == MAGIC
+
+
+def encode_array(array, dtype='float32'):
+    """
+    Serializes an array as a header followed by its raw little-endian values.
+
+    Args:
+        array (numpy.ndarray): The encoding to store.
+        dtype (str): Storage precision, 'float32' or 'float16'.
+
+    Returns:
+        bytes: The serialized blob.
+    """
+    array = np.ascontiguousarray(array, dtype=CODE_DTYPES[DTYPE_CODES[dtype]])
+    header = _HEADER.pack(MAGIC, DTYPE_CODES[dtype], array.ndim)
+    shape = struct.pack('<%dI' % array.ndim, *array.shape)
+    return header + shape + array.tobytes()
+
+
+def decode_header(blob):
+    """
+    Reads the header of a binary encoding.
+
+    Args:
+        blob (bytes): The serialized blob.
+
+    Returns:
+        tuple: (dtype, shape, offset of the first value).
+    """
+    _, code, ndim = _HEADER.unpack_from(blob)
+    shape = struct.unpack_from('<%dI' % ndim, blob, _HEADER.size)
+    return CODE_DTYPES[code], shape, _HEADER.size + 4 * ndim
+
+
+def decode_array(blob):
+    """
+    Decodes a binary encoding as a read-only view over the blob, without copying.
+
+    Args:
+        blob (bytes): The serialized blob.
+
+    Returns:
+        numpy.ndarray: The stored encoding.
+    """
+    dtype, shape, offset = decode_header(blob)
+    return np.frombuffer(blob, dtype=dtype, offset=offset).reshape(shape)
+
+
+@metrics.timed(metrics.STAGE_SECONDS, stage='decode_matrix')
+def decode_matrix(blobs):
+    """
+    Decodes many binary encodings into one (N, D) float32 matrix.
+
+    The payloads are joined and viewed with a single np.frombuffer call, so
+    loading a whole gallery costs one concatenation plus one dtype conversion.
+
+    Args:
+        blobs (list): Serialized blobs, normally all of the same dtype and shape.
+
+    Returns:
+        numpy.ndarray: An (N, D) float32 matrix.
+    """
+    if not blobs:
+        return np.empty((0, 0), dtype=np.float32)
+    dtype, shape, offset = decode_header(blobs[0])
+    header = bytes(blobs[0][:offset])
+    if any(bytes(blob[:offset]) != header for blob in blobs):
+        return np.stack([decode_array(blob).astype(np.float32).ravel() for blob in blobs])
+    dim = int(np.prod(shape))
+    payload = b''.join(memoryview(blob)[offset:] for blob in blobs)
+    matrix = np.frombuffer(payload, dtype=dtype).reshape(len(blobs), dim)
+    return matrix.astype(np.float32, copy=False)
+
+
+class EncodingType(TypeDecorator):
+    """
+    Column type storing numpy arrays in the binary encoding format.
+
+    Rows written by the former PickleType column are still read through the
+    unpickler until they are converted by DatabaseManager.migrate_encodings().
+    Values that are not numeric arrays are pickled as before.
+
+    Arrays are written as `storage_dtype`, unless the engine writing them sets
+    another precision with set_storage_dtype().
+    """
+
+    impl = LargeBinary
+    cache_ok = True
+    storage_dtype = 'float32'
+
+    @staticmethod
+    def set_storage_dtype(engine, dtype):
+        """
+        Sets the precision of the arrays written through one engine.
+
+        The setting lives on the engine's dialect, which bind processors
+        receive, so engines of the same process can use different precisions.
+
+        Args:
+            engine (sqlalchemy.engine.Engine): The engine.
+            dtype (str): 'float32' or 'float16'.
+        """
+        engine.dialect.encoding_storage_dtype = dtype
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        if isinstance(value, np.ndarray) and value.dtype.kind in 'fiu':
+            dtype = getattr(dialect, 'encoding_storage_dtype', self.storage_dtype)
+            return encode_array(value, dtype)
+        return pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+    def compare_values(self, x, y):
+        # Arrays compare elementwise with ==, so the ORM's change detection
+        # needs a single answer
+        if isinstance(x, np.ndarray) or isinstance(y, np.ndarray):
+            return (isinstance(x, np.ndarray) and isinstance(y, np.ndarray)
+                    and x.shape == y.shape and np.array_equal(x, y))
+        return x == y
+
+    @metrics.timed(metrics.STAGE_SECONDS, stage='decode_encoding')
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        if is_encoded(value):
+            return decode_array(value)
+        return pickle.loads(value)
@@ -4,8 +4,82 @@ Class contains methods to align faces to standard postion
 and orientation
 """
 
+import math
+
 import cv2
 import dlib
+import numpy as np
+
+from app import metrics, model_registry
+
+CHIP_SIZE = 150
+CHIP_PADDING = 0.25
+
+
+def chip_mapping(chip_details):
+    """
+    Computes the affine transform from image coordinates to chip coordinates.
+
+    This mirrors dlib's get_mapping_to_chip, so landmarks predicted on the full
+    image can be moved into the frame of the extracted face chip.
+
+    Args:
+        chip_details (dlib.chip_details): The chip returned by dlib.get_face_chip_details.
+
+    Returns:
+        numpy.ndarray: A 2x3 float32 affine matrix.
+    """
+    rect = chip_details.rect
+    left, top, right, bottom = rect.left(), rect.top(), rect.right(), rect.bottom()
+    cx, cy = (left + right) / 2.0, (top + bottom) / 2.0
+    cos, sin = math.cos(chip_details.angle), math.sin(chip_details.angle)
+    src = np.array([
+        [cx + (x - cx) * cos - (y - cy) * sin, cy + (x - cx) * sin + (y - cy) * cos]
+        for x, y in ((left, top), (right, top), (right, bottom))
+    ], dtype=np.float32)
+    cols, rows = chip_details.cols, chip_details.rows
+    dst = np.array([[0, 0], [cols - 1, 0], [cols - 1, rows - 1]], dtype=np.float32)
+    return cv2.getAffineTransform(src, dst).astype(np.float32)
+
+
+def shapes_to_array(shapes):
+    """
+    Converts landmark detections to one array.
+
+    dlib only exposes the points one attribute at a time, so each shape is
+    read through a single parts() call into np.fromiter instead of building
+    nested Python lists.
+
+    Args:
+        shapes (list): dlib.full_object_detection objects with the same number of points.
+
+    Returns:
+        numpy.ndarray: An (N, P, 2) float32 array of (x, y) landmarks.
+    """
+    if len(shapes) == 0:
+        return np.empty((0, 0, 2), dtype=np.float32)
+    num_parts = shapes[0].num_parts
+    flat = np.fromiter((value for shape in shapes for point in shape.parts()
+                        for value in (point.x, point.y)),
+                       dtype=np.float32, count=2 * num_parts * len(shapes))
+    return flat.reshape(len(shapes), num_parts, 2)
+
+
+def map_to_chips(points, chip_details):
+    """
+    Moves landmarks from image coordinates into the frame of their face chips.
+
+    Args:
+        points (numpy.ndarray): An (N, P, 2) array of landmarks in image coordinates.
+        chip_details (list): The N dlib.chip_details the faces were aligned to.
+
+    Returns:
+        numpy.ndarray: An (N, P, 2) float32 array of landmarks in chip coordinates.
+    """
+    if len(chip_details) == 0:
+        return points.astype(np.float32)
+    mappings = np.stack([chip_mapping(details) for details in chip_details])
+    return np.einsum('npk,njk->npj', points, mappings[:, :, :2]) + mappings[:, None, :, 2]
 
 
 class FaceAligner:
@@ -16,30 +90,114 @@ class FaceAligner:
     def __init__(self, shape_predictor_path):
         """
         Initializes the FaceAligner with the provided shape predictor model path.
+        The predictor is shared through the model registry and loaded on first use.
 
         Args:
             shape_predictor_path (str): Path to the shape predictor model file.
         """
-        self.shape_predictor = dlib.shape_predictor(shape_predictor_path)
+        self.shape_predictor_path = shape_predictor_path
+
+    @property
+    def shape_predictor(self):
+        """Returns the shared shape predictor, loading it on first use"""
+        return model_registry.get_shape_predictor(self.shape_predictor_path)
+
+    @metrics.timed(metrics.STAGE_SECONDS, stage='landmarks')
+    def predict_shape(self, gray, face):
+        """
+        Predicts the facial landmarks of a detected face.
+
+        Args:
+            gray (numpy.ndarray): The grayscale image containing the face.
+            face (tuple): Bounding box coordinates of the detected face (x, y, w, h).
+
+        Returns:
+            dlib.full_object_detection: The landmarks in image coordinates.
+        """
+        (x, y, w, h) = (int(v) for v in face)
+        rect = dlib.rectangle(x, y, x + w, y + h)
+        return self.shape_predictor(gray, rect)
 
-    def align_face(self, image, face):
+    def align_face(self, image, face, gray=None):
         """
         Aligns the detected face to a standardized position and orientation.
 
         Args:
             image (numpy.ndarray): The image containing the face.
             face (tuple): Bounding box coordinates of the detected face (x, y, w, h).
+            gray (numpy.ndarray, optional): The image already converted to grayscale.
 
         Returns:
             numpy.ndarray: The aligned face image.
         """
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-        (x, y, w, h) = face
-        rect = dlib.rectangle(x, y, x + w, y + h)
-        shape = self.shape_predictor(gray, rect)
-
-        aligned_face = dlib.get_face_chip(image, shape)
+        aligned_face, _, _ = self.align_face_with_shape(image, face, gray)
         return aligned_face
+
+    @metrics.timed(metrics.STAGE_SECONDS, stage='align_batch')
+    def align_faces(self, image, boxes, gray=None):
+        """
+        Aligns every detected face of an image with one dlib.get_face_chips call.
+
+        Args:
+            image (numpy.ndarray): The image containing the faces.
+            boxes (list): Bounding boxes of the detected faces (x, y, w, h).
+            gray (numpy.ndarray, optional): The image already converted to grayscale.
+
+        Returns:
+            list: The aligned face images, in the order of `boxes`.
+        """
+        if len(boxes) == 0:
+            return []
+        if gray is None:
+            gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        detections = dlib.full_object_detections()
+        for face in boxes:
+            detections.append(self.predict_shape(gray, face))
+        return list(dlib.get_face_chips(image, detections, CHIP_SIZE, CHIP_PADDING))
+
+    @metrics.timed(metrics.STAGE_SECONDS, stage='align_batch')
+    def align_faces_with_shapes(self, image, boxes, gray=None):
+        """
+        Aligns every detected face of an image and also returns the landmarks.
+
+        Args:
+            image (numpy.ndarray): The image containing the faces.
+            boxes (list): Bounding boxes of the detected faces (x, y, w, h).
+            gray (numpy.ndarray, optional): The image already converted to grayscale.
+
+        Returns:
+            tuple: (aligned face images, dlib.full_object_detections, list of dlib.chip_details).
+        """
+        detections = dlib.full_object_detections()
+        if len(boxes) == 0:
+            return [], detections, []
+        if gray is None:
+            gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        for face in boxes:
+            detections.append(self.predict_shape(gray, face))
+        chip_details = list(dlib.get_face_chip_details(detections, CHIP_SIZE, CHIP_PADDING))
+        aligned_faces = list(dlib.extract_image_chips(image, chip_details))
+        return aligned_faces, detections, chip_details
+
+    @metrics.timed(metrics.STAGE_SECONDS, stage='align')
+    def align_face_with_shape(self, image, face, gray=None):
+        """
+        Aligns a face and also returns the landmarks used to align it.
+
+        Args:
+            image (numpy.ndarray): The image containing the face.
+            face (tuple): Bounding box coordinates of the detected face (x, y, w, h).
+            gray (numpy.ndarray, optional): The image already converted to grayscale.
+
+        Returns:
+            tuple: (aligned face image, dlib.full_object_detection, dlib.chip_details).
+        """
+        if gray is None:
+            gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        shape = self.predict_shape(gray, face)
+        chip_details = dlib.get_face_chip_details(shape, CHIP_SIZE, CHIP_PADDING)
+        aligned_face = dlib.extract_image_chip(image, chip_details)
+        return aligned_face, shape, chip_details
 """
 # Example usage
 image = cv2.imread('image.jpg')
@@ -4,34 +4,366 @@ This is class containing methods to detect faces in a
 photo or video
 """
 
+import abc
+import os
+import queue
+import threading
+from contextlib import contextmanager
+
 import cv2
+import dlib
+import numpy as np
+
+from app import metrics
+
+DEFAULT_SCALE_FACTOR = 1.1
+DEFAULT_MIN_NEIGHBORS = 5
+DEFAULT_MIN_SIZE = (30, 30)
+DEFAULT_REFINE_BELOW = 48
+
+
+def box_iou(a, b):
+    """
+    Computes the intersection over union of two (x, y, w, h) boxes.
+
+    Args:
+        a (tuple): The first box.
+        b (tuple): The second box.
+
+    Returns:
+        float: The overlap between 0.0 and 1.0.
+    """
+    ax, ay, aw, ah = a
+    bx, by, bw, bh = b
+    iw = max(0, min(ax + aw, bx + bw) - max(ax, bx))
+    ih = max(0, min(ay + ah, by + bh) - max(ay, by))
+    intersection = iw * ih
+    union = aw * ah + bw * bh - intersection
+    return intersection / float(union) if union else 0.0
+
+
+class DetectorBackend(abc.ABC):
+    """
+    Base class for face detectors. Subclasses implement _detect; this class
+    handles the grayscale conversion, the optional downscaling to `max_side`
+    and the mapping of boxes back to full-resolution coordinates.
+    """
+
+    name = None
+    # Backends that need the BGR image rather than the grayscale one
+    uses_color = False
+
+    def __init__(self, min_size=DEFAULT_MIN_SIZE, max_side=None):
+        """
+        Initializes the DetectorBackend.
+
+        Args:
+            min_size (tuple): Smallest face size (w, h) in full-resolution pixels
+            max_side (int, optional): Run detection on a copy downscaled so its
+                longest side is at most this many pixels. Defaults to full resolution.
+        """
+        self.min_size = tuple(min_size)
+        self.max_side = max_side
+
+    @metrics.timed(metrics.STAGE_SECONDS, stage='detect')
+    def detect_faces(self, image, gray=None):
+        """
+        Detects faces in the given image.
+
+        Args:
+            image (numpy.ndarray): The image to detect faces from
+            gray (numpy.ndarray, optional): The image already converted to grayscale
+
+        Returns:
+            numpy.ndarray: Bounding boxes (x, y, w, h) of the detected faces, shape (N, 4)
+        """
+        if self.uses_color:
+            source = image
+        else:
+            source = gray if gray is not None else cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        longest = max(source.shape[:2])
+        scale = 1.0
+        small = source
+        if self.max_side and longest > self.max_side:
+            # Detect on a downscaled copy and map the boxes back to full resolution
+            scale = self.max_side / float(longest)
+            small = cv2.resize(source, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+        faces = []
+        for box in self._detect(small, scale):
+            face = tuple(int(round(v / scale)) for v in box)
+            if scale < 1.0:
+                face = self._refine(source, face, box)
+            if face is not None and face[2] >= self.min_size[0] and face[3] >= self.min_size[1]:
+                faces.append(face)
+        metrics.FACES_PER_IMAGE.observe(len(faces))
+        return np.array(faces, dtype=np.int32).reshape(-1, 4)
+
+    @abc.abstractmethod
+    def _detect(self, image, scale):
+        """
+        Detects faces in an image that may have been downscaled.
+
+        Args:
+            image (numpy.ndarray): The grayscale (or BGR if uses_color) image
+            scale (float): Ratio between this image and the full-resolution one
+
+        Returns:
+            list: Boxes (x, y, w, h) in the coordinates of `image`
+        """
+
+    def _refine(self, image, face, box):
+        """
+        Hook for re-checking a detection made on a downscaled copy.
+
+        Args:
+            image (numpy.ndarray): The full-resolution detection input
+            face (tuple): The box mapped to full-resolution coordinates
+            box (tuple): The box in downscaled coordinates
+
+        Returns:
+            tuple: The box to keep, or None to drop the detection
+        """
+        return face
 
 
-class FaceDetector:
+class FaceDetector(DetectorBackend):
     """
-    Class for detecting faces in an image using OpenCV's 
+    Class for detecting faces in an image using OpenCV's
     Haar cascade.
     """
 
-    def __init__(self, cascade_path):
+    name = 'haar'
+
+    def __init__(self, cascade_path, scale_factor=DEFAULT_SCALE_FACTOR,
+                 min_neighbors=DEFAULT_MIN_NEIGHBORS, min_size=DEFAULT_MIN_SIZE,
+                 max_side=None, refine=False, refine_below=DEFAULT_REFINE_BELOW):
         """
         Initializes the FaceDetector with the given Haar cascade xml file
+
+        Args:
+            cascade_path (str): Path to the Haar cascade xml file
+            scale_factor (float): Image size reduction between cascade scales
+            min_neighbors (int): Neighbouring detections needed to keep a face
+            min_size (tuple): Smallest face size (w, h) in pixels
+            max_side (int, optional): Run the cascade on a copy downscaled so its
+                longest side is at most this many pixels. Defaults to full resolution.
+            refine (bool): Re-check small detections from the downscaled copy on a
+                full-resolution crop, dropping those that are not confirmed
+            refine_below (int): Width in downscaled pixels under which a detection is refined
         """
+        super().__init__(min_size=min_size, max_side=max_side)
         self.face_cascade = cv2.CascadeClassifier(cascade_path)
+        self.scale_factor = scale_factor
+        self.min_neighbors = min_neighbors
+        self.refine = refine
+        self.refine_below = refine_below
 
-    def detect_faces(self, image):
+    def _detect(self, gray, scale):
+        min_size = tuple(max(1, int(round(side * scale))) for side in self.min_size)
+        return self.face_cascade.detectMultiScale(
+            gray, scaleFactor=self.scale_factor, minNeighbors=self.min_neighbors, minSize=min_size)
+
+    def _refine(self, gray, face, box):
         """
-        Detects faces in the given image.
+        Re-detects a small face on a full-resolution crop around its coarse box.
+
+        Args:
+            gray (numpy.ndarray): The full-resolution grayscale image
+            face (tuple): The coarse box (x, y, w, h) in full-resolution coordinates
+            box (tuple): The box in downscaled coordinates
+
+        Returns:
+            tuple: The refined box, or None if the crop contains no face
+        """
+        if not self.refine or box[2] >= self.refine_below:
+            return face
+        x, y, w, h = face
+        x0, y0 = max(0, x - w // 2), max(0, y - h // 2)
+        x1, y1 = min(gray.shape[1], x + w + w // 2), min(gray.shape[0], y + h + h // 2)
+        found = self.face_cascade.detectMultiScale(
+            gray[y0:y1, x0:x1], scaleFactor=self.scale_factor, minNeighbors=self.min_neighbors,
+            minSize=(max(self.min_size[0], w // 2), max(self.min_size[1], h // 2)),
+            maxSize=(2 * w, 2 * h))
+        if len(found) == 0:
+            return None
+        fx, fy, fw, fh = max(found, key=lambda found_box: found_box[2] * found_box[3])
+        return (int(x0 + fx), int(y0 + fy), int(fw), int(fh))
+
+
+HaarDetector = FaceDetector
+
+
+class HogDetector(DetectorBackend):
+    """
+    Class for detecting faces with dlib's HOG + linear SVM frontal face detector.
+    """
+
+    name = 'hog'
+
+    def __init__(self, upsample=0, min_size=DEFAULT_MIN_SIZE, max_side=None):
+        """
+        Initializes the HogDetector. The dlib detector is created on first use;
+        dlib detectors must not be shared between threads, so every instance
+        owns its own.
+
+        Args:
+            upsample (int): Times the image is upsampled to find smaller faces
+            min_size (tuple): Smallest face size (w, h) in pixels
+            max_side (int, optional): Longest side detection runs at
+        """
+        super().__init__(min_size=min_size, max_side=max_side)
+        self.upsample = upsample
+        self._detector = None
+
+    def _detect(self, gray, scale):
+        if self._detector is None:
+            self._detector = dlib.get_frontal_face_detector()
+        height, width = gray.shape[:2]
+        boxes = []
+        for rect in self._detector(gray, self.upsample):
+            left, top = max(0, rect.left()), max(0, rect.top())
+            right, bottom = min(width, rect.right()), min(height, rect.bottom())
+            boxes.append((left, top, right - left, bottom - top))
+        return boxes
+
+
+class DnnDetector(DetectorBackend):
+    """
+    Class for detecting faces with an OpenCV DNN single-shot detector (such
+    as the res10 Caffe model or an ONNX export of it) on the CPU.
+
+    The network must produce the SSD detection output layout
+    (1, 1, N, 7) of [image id, class, confidence, x1, y1, x2, y2].
+    """
+
+    name = 'dnn'
+    uses_color = True
+
+    def __init__(self, model_path, config_path=None, confidence=0.5, input_size=(300, 300),
+                 mean=(104.0, 177.0, 123.0), min_size=DEFAULT_MIN_SIZE, max_side=None):
+        """
+        Initializes the DnnDetector.
+
+        Args:
+            model_path (str): Path to the .caffemodel or .onnx weights
+            config_path (str, optional): Path to the .prototxt for Caffe models
+            confidence (float): Minimum detection confidence
+            input_size (tuple): Network input size (w, h)
+            mean (tuple): BGR mean subtracted from the input
+            min_size (tuple): Smallest face size (w, h) in pixels
+            max_side (int, optional): Longest side detection runs at
+        """
+        super().__init__(min_size=min_size, max_side=max_side)
+        self.net = cv2.dnn.readNet(model_path, config_path or '')
+        self.net.setPreferableBackend(cv2.dnn.DNN_BACKEND_OPENCV)
+        self.net.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU)
+        self.confidence = confidence
+        self.input_size = tuple(input_size)
+        self.mean = tuple(mean)
+
+    def _detect(self, image, scale):
+        height, width = image.shape[:2]
+        blob = cv2.dnn.blobFromImage(image, 1.0, self.input_size, self.mean)
+        self.net.setInput(blob)
+        detections = self.net.forward().reshape(-1, 7)
+        detections = detections[detections[:, 2] >= self.confidence]
+        corners = np.clip(detections[:, 3:7], 0.0, 1.0) * [width, height, width, height]
+        return [(int(x1), int(y1), int(x2 - x1), int(y2 - y1)) for x1, y1, x2, y2 in corners]
+
+
+DETECTOR_BACKENDS = {
+    FaceDetector.name: FaceDetector,
+    HogDetector.name: HogDetector,
+    DnnDetector.name: DnnDetector,
+}
+
+
+def create_detector(backend='haar', **options):
+    """
+    Creates a detector backend by name.
+
+    Args:
+        backend (str): One of 'haar', 'hog' or 'dnn'
+        **options: Constructor arguments of the backend class
+
+    Returns:
+        DetectorBackend: The new detector
+    """
+    if backend not in DETECTOR_BACKENDS:
+        raise ValueError(f"Unknown detector backend {backend!r}, expected one of "
+                         f"{', '.join(DETECTOR_BACKENDS)}")
+    return DETECTOR_BACKENDS[backend](**options)
+
+
+class DetectorPool:
+    """
+    Class sharing a bounded set of long-lived detectors between threads, so
+    the model is loaded at most `size` times instead of once per request.
+
+    Each detection borrows an idle detector and returns it afterwards; a
+    detector is never used by two threads at once. When every detector is
+    busy, new ones are created up to `size`, after which callers wait.
+    """
+
+    def __init__(self, backend='haar', size=None, **detector_options):
+        """
+        Initializes the DetectorPool. Detectors are created on demand.
+
+        Args:
+            backend (str): The detector backend, see create_detector
+            size (int, optional): Maximum number of detectors. Defaults to the number of CPUs
+            **detector_options: Constructor arguments passed to every detector
+        """
+        self.backend = backend
+        self.size = size or os.cpu_count() or 1
+        self.detector_options = detector_options
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def borrow(self):
+        """
+        Lends a detector to the calling thread for the duration of a with block.
+
+        Yields:
+            DetectorBackend: A detector no other thread uses until the block ends
+        """
+        try:
+            detector = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                create = self._created < self.size
+                if create:
+                    self._created += 1
+            if create:
+                try:
+                    detector = create_detector(self.backend, **self.detector_options)
+                except Exception:
+                    with self._lock:
+                        self._created -= 1
+                    raise
+            else:
+                detector = self._idle.get()
+        try:
+            yield detector
+        finally:
+            self._idle.put(detector)
+
+    def detect_faces(self, image, gray=None):
+        """
+        Detects faces with a borrowed detector.
 
         Args:
             image (numpy.ndarray): The image to detect faces from
+            gray (numpy.ndarray, optional): The image already converted to grayscale
 
         Returns:
-            List of tuples: Bounding box coordinates of the detected faces
+            numpy.ndarray: Bounding boxes (x, y, w, h) of the detected faces
         """
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-        faces = self.face_cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5, minSize=(30, 30))
-        return faces
+        with self.borrow() as detector:
+            return detector.detect_faces(image, gray)
 """
 # Usage
 image = cv2.imread('image.jpg')
@@ -39,6 +371,9 @@ image = cv2.imread('image.jpg')
 # Initialize the FaceDetector with the Haar cascade XML file path
 detector = FaceDetector('haarcascade_frontalface_default.xml')
 
+# Or pick another backend by name
+detector = create_detector('hog', upsample=1)
+
 # Detect faces in the image
 detected_faces = detector.detect_faces(image)
 
@@ -50,4 +385,3 @@ cv2.imshow('Face Detection', image)
 cv2.waitKey(0)
 cv2.destroyAllWindows()
 """
-
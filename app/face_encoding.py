@@ -29,6 +29,23 @@ class FaceEncoder:
         features = self.feature_extractor.extract_features(aligned_face)
         return features
 
+    def encode_faces(self, aligned_faces):
+        """
+        Encodes many aligned faces at once.
+
+        Args:
+            aligned_faces (list): The aligned face images.
+
+        Returns:
+            numpy.ndarray: An (N, D) float32 array with one flattened encoding per face.
+        """
+        if len(aligned_faces) == 0:
+            # Two coordinates per landmark of the shape predictor
+            dim = 2 * self.feature_extractor.shape_predictor.num_parts
+            return np.empty((0, dim), dtype=np.float32)
+        features = self.feature_extractor.extract_features_batch(aligned_faces)
+        return np.ascontiguousarray(features.reshape(len(features), -1), dtype=np.float32)
+
 """
 # Example usage
 aligned_face = ...  # Aligned face image
@@ -42,5 +59,8 @@ face_encoder = FaceEncoder(feature_extractor)
 # Encode the face
 encoded_face = face_encoder.encode_face(aligned_face)
 
+# Or encode every face of a group photo at once
+encodings = face_encoder.encode_faces(aligner.align_faces(image, boxes))  # (N, D)
+
 # Use the encoded face for further processing or comparison
 """
@@ -0,0 +1,755 @@
+#!/usr/bin/python3
+"""
+Class containing an in-memory gallery of enrolled face encodings
+that answers match queries with vectorized distance computations
+"""
+
+import threading
+
+import numpy as np
+
+from app import metrics
+from app.ann_index import IVFIndex, recall_at_k, smallest_k, squared_distances
+from app.gallery_snapshot import GallerySnapshot
+from app.quantization import DecodedRows, ScalarQuantizer
+from app.sharded_search import DEFAULT_MIN_ROWS, ShardedSearcher
+
+DEFAULT_MATCH_THRESHOLD = 25.0
+# An index requested on a smaller gallery is trained once it reaches this
+# many rows; below it k-means has too little data and exact scans are cheap
+DEFAULT_INDEX_MIN_ROWS = 1000
+
+
+def template_row_id(identity_id, slot):
+    """Returns the gallery key of one template row of an identity"""
+    return '%s/%d' % (identity_id, slot)
+
+
+def template_row_ids(identity_id, count):
+    """Returns the gallery keys of the first `count` template rows of an identity"""
+    return [template_row_id(identity_id, slot) for slot in range(count)]
+
+
+class FaceGallery:
+    """
+    Class holding every enrolled face encoding as one contiguous float32
+    matrix with a parallel array of face IDs.
+
+    Removed faces are tombstoned rather than deleted, and the matrix is
+    compacted once the share of tombstoned rows exceeds `compaction_ratio`,
+    so changes never require reloading the whole table.
+
+    After quantize() the encodings are held as float16 or 8-bit codes
+    instead, optionally keeping the float32 rows to re-rank the best
+    candidates exactly.
+
+    A gallery built by from_identities() holds the templates of every
+    identity instead of raw encodings: one row for the centroid and one per
+    exemplar, keyed '<identity_id>/<slot>'.
+
+    After shard() the numeric arrays live in shared memory and exact scans
+    of large galleries are split across worker processes.
+    """
+
+    def __init__(self, threshold=DEFAULT_MATCH_THRESHOLD, top_k=1, index=None,
+                 compaction_ratio=0.25):
+        """
+        Initializes an empty FaceGallery.
+
+        Args:
+            threshold (float): Maximum euclidean distance for a match.
+            top_k (int): Number of candidates returned per query by default.
+            index (IVFIndex, optional): Approximate index used instead of the exact scan.
+                Built over the current rows by build_index(). Defaults to None.
+            compaction_ratio (float): Share of tombstoned rows that triggers compaction.
+        """
+        self.threshold = threshold
+        self.top_k = top_k
+        self.index = index
+        self.index_min_rows = DEFAULT_INDEX_MIN_ROWS
+        self.compaction_ratio = compaction_ratio
+        self.quantizer = None
+        self.rerank = 0
+        self.shards = None
+        self.identities = False
+        self.dim = None
+        self._vectors = np.empty((0, 0), dtype=np.float32)
+        self._codes = None
+        self._sq_norms = np.empty(0, dtype=np.float32)
+        self._ids = np.empty(0, dtype=object)
+        self._info = np.empty(0, dtype=object)
+        self._alive = np.empty(0, dtype=bool)
+        self._row_of = {}
+        self._size = 0
+        self._deleted = 0
+        self._lock = threading.RLock()
+
+    @classmethod
+    def from_database_manager(cls, database_manager, attach=False, **kwargs):
+        """
+        Builds a gallery from every face stored by a DatabaseManager.
+
+        Args:
+            database_manager (DatabaseManager): The source of enrolled faces.
+            attach (bool): Keep the gallery in sync with later database writes.
+            **kwargs: Passed through to the FaceGallery constructor.
+
+        Returns:
+            FaceGallery: The populated gallery.
+        """
+        gallery = cls(**kwargs)
+        if attach:
+            # Listen before loading so no write between the two is missed;
+            # a face seen twice simply replaces its earlier row.
+            gallery.attach(database_manager)
+        face_ids, encodings, infos = database_manager.get_all_encodings()
+        gallery.add_matrix(face_ids, encodings, infos)
+        return gallery
+
+    @classmethod
+    def from_snapshot(cls, path, database_manager=None, attach=False, **kwargs):
+        """
+        Builds a gallery from a snapshot written by export_snapshot, then
+        applies the database changes made since it was written.
+
+        The encodings are memory-mapped copy-on-write rather than read, so
+        processes loading the same snapshot share one copy in the page cache.
+        Faces added or removed since the snapshot are caught up; info edits
+        are not, until the next snapshot.
+
+        Args:
+            path (str): The snapshot file.
+            database_manager (DatabaseManager, optional): Source of the changes made
+                since the snapshot. Without it the snapshot is used as is.
+            attach (bool): Keep the gallery in sync with later database writes.
+            **kwargs: Passed through to the FaceGallery constructor.
+
+        Returns:
+            FaceGallery: The populated gallery.
+        """
+        gallery = cls(**kwargs)
+        snapshot = GallerySnapshot(path)
+        if attach:
+            gallery.attach(database_manager)
+        face_ids = snapshot.face_ids()
+        gallery._load_snapshot(snapshot, face_ids)
+        if database_manager is not None:
+            gallery._catch_up(database_manager, snapshot, face_ids)
+        return gallery
+
+    @classmethod
+    def from_identities(cls, database_manager, attach=False, **kwargs):
+        """
+        Builds a gallery from the identity templates stored by a DatabaseManager.
+
+        Args:
+            database_manager (DatabaseManager): The source of identities.
+            attach (bool): Keep the gallery in sync with later template updates.
+            **kwargs: Passed through to the FaceGallery constructor.
+
+        Returns:
+            FaceGallery: The populated gallery.
+        """
+        gallery = cls(**kwargs)
+        gallery.identities = True
+        if attach:
+            gallery.attach(database_manager)
+        face_ids, encodings, infos = [], [], []
+        for template in database_manager.get_identities():
+            rows = template.rows()
+            face_ids.extend(template_row_ids(template.identity_id, len(rows)))
+            encodings.append(rows)
+            infos.extend([template.gallery_info()] * len(rows))
+        if encodings:
+            gallery.add_matrix(face_ids, np.concatenate(encodings), infos)
+        return gallery
+
+    def _load_snapshot(self, snapshot, face_ids):
+        """Adopts the mapped arrays of a snapshot as the rows of this empty gallery"""
+        if not snapshot.size:
+            return
+        with self._lock:
+            size, capacity = snapshot.size, snapshot.capacity
+            self.dim = snapshot.dim
+            self._vectors = snapshot.vectors(writable=True)
+            self._sq_norms = snapshot.sq_norms(writable=True)
+            self._ids = np.empty(capacity, dtype=object)
+            self._ids[:size] = face_ids
+            self._info = np.empty(capacity, dtype=object)
+            for row, info in enumerate(snapshot.infos()):
+                self._info[row] = info
+            self._alive = np.zeros(capacity, dtype=bool)
+            self._alive[:size] = True
+            self._row_of = dict(zip(face_ids, range(size)))
+            self._size = size
+
+    def _catch_up(self, database_manager, snapshot, face_ids):
+        """Applies the faces added and removed since a snapshot was written"""
+        if database_manager.count_faces(up_to_id=snapshot.last_row_id) != snapshot.size:
+            # Some rows of the snapshot were deleted since
+            live = database_manager.get_face_ids(up_to_id=snapshot.last_row_id)
+            self.remove_faces(face_id for face_id in face_ids if face_id not in live)
+        new_ids, encodings, infos, _ = database_manager.get_encodings_since(snapshot.last_row_id)
+        self.add_matrix(new_ids, encodings, infos)
+
+    def attach(self, database_manager):
+        """
+        Subscribes the gallery to the change notifications of a DatabaseManager.
+
+        Args:
+            database_manager (DatabaseManager): The manager whose writes are mirrored.
+        """
+        database_manager.add_listener(self.on_database_change)
+
+    def on_database_change(self, event, faces):
+        """
+        Applies a committed database change to the gallery.
+
+        Args:
+            event (str): One of 'add', 'remove' or 'update' for the faces table,
+                or 'identity' for template updates.
+            faces (list): Tuples of (face_id, face_image, info), or of
+                (identity_id, template rows, info) for 'identity'.
+        """
+        if self.identities:
+            # Raw faces rows are not part of a template gallery
+            if event == 'identity':
+                for identity_id, rows, info in faces:
+                    self.set_identity(identity_id, rows, info)
+        elif event == 'add':
+            self.add_faces(faces)
+        elif event == 'remove':
+            self.remove_faces(face_id for face_id, _, _ in faces)
+        elif event == 'update':
+            for face_id, _, info in faces:
+                self.update_face(face_id, info)
+
+    def __len__(self):
+        return self._size - self._deleted
+
+    def __contains__(self, face_id):
+        return face_id in self._row_of
+
+    @property
+    def vectors(self):
+        """
+        Returns the stored encodings, including tombstoned rows, as an (N, D) matrix:
+        a view of the float32 rows, or a decoded copy if only codes are kept.
+        """
+        if self._vectors is None:
+            return self.quantizer.decode(self._codes[:self._size])
+        return self._vectors[:self._size]
+
+    def _scan_vectors(self):
+        """Returns the rows the distance scans run over, decoded lazily when quantized"""
+        if self._codes is not None:
+            return DecodedRows(self._codes[:self._size], self.quantizer)
+        return self._vectors[:self._size]
+
+    def encoding_bytes(self):
+        """Returns the memory used by the stored encodings and their norms"""
+        arrays = [self._vectors, self._codes, self._sq_norms]
+        return sum(array[:self._size].nbytes for array in arrays if array is not None)
+
+    @property
+    def ids(self):
+        """Returns a view of the stored face IDs, including tombstoned rows"""
+        return self._ids[:self._size]
+
+    def _as_matrix(self, encodings):
+        """
+        Flattens one encoding or a batch of encodings into a 2-D float32 matrix.
+
+        Args:
+            encodings (numpy.ndarray or list): One encoding or a sequence of them.
+
+        Returns:
+            numpy.ndarray: An (M, D) float32 matrix.
+        """
+        if isinstance(encodings, np.ndarray) and encodings.dtype != object:
+            matrix = encodings.reshape(-1, self.dim) if self.dim else encodings.reshape(1, -1)
+        else:
+            matrix = np.stack([np.asarray(e, dtype=np.float32).ravel() for e in encodings])
+        matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+        if self.dim is not None and matrix.shape[1] != self.dim:
+            raise ValueError(
+                "Encoding has %d values, gallery expects %d" % (matrix.shape[1], self.dim))
+        return matrix
+
+    def _reserve(self, rows):
+        """
+        Grows the backing arrays so that `rows` more encodings fit without reallocating.
+
+        Args:
+            rows (int): The number of rows about to be appended.
+        """
+        needed = self._size + rows
+        capacity = self._alive.shape[0]
+        if needed <= capacity:
+            return
+        capacity = max(needed, 2 * capacity, 64)
+        for name in self._row_arrays():
+            old = getattr(self, name)
+            new = self._allocate((capacity,) + old.shape[1:], old.dtype)
+            new[:self._size] = old[:self._size]
+            setattr(self, name, new)
+            self._release(old)
+
+    def _allocate(self, shape, dtype):
+        """Allocates a row array, in shared memory if the gallery is sharded"""
+        if self.shards is not None and dtype != object:
+            return self.shards.arrays.empty(shape, dtype)
+        # np.empty leaves object arrays filled with None
+        return (np.zeros if dtype == bool else np.empty)(shape, dtype=dtype)
+
+    def _release(self, array):
+        """Frees the shared memory of a replaced row array"""
+        if self.shards is not None:
+            self.shards.arrays.release(array)
+
+    def _row_arrays(self):
+        """Returns the names of the arrays holding one entry per row"""
+        names = ['_sq_norms', '_ids', '_info', '_alive']
+        if self._vectors is not None:
+            names.append('_vectors')
+        if self._codes is not None:
+            names.append('_codes')
+        return names
+
+    def add_face(self, face_id, encoding, info=None):
+        """
+        Adds a single encoding to the gallery.
+
+        Args:
+            face_id (str): The ID of the face.
+            encoding (numpy.ndarray): The face encoding.
+            info (dict, optional): Additional information about the face. Defaults to None.
+        """
+        self.add_faces([(face_id, encoding, info)])
+
+    def add_faces(self, faces):
+        """
+        Appends many encodings to the gallery in one copy. A face ID that is
+        already present replaces its earlier row.
+
+        Args:
+            faces (iterable): Tuples of (face_id, encoding, info).
+        """
+        faces = list(faces)
+        if not faces:
+            return
+        face_ids, encodings, infos = zip(*faces)
+        self.add_matrix(face_ids, encodings, infos)
+
+    def add_matrix(self, face_ids, encodings, infos=None):
+        """
+        Appends a ready-made block of encodings, such as the matrix returned by
+        DatabaseManager.get_all_encodings(). A face ID that is already present
+        replaces its earlier row.
+
+        Args:
+            face_ids (list): The IDs of the faces.
+            encodings (numpy.ndarray or list): An (N, D) matrix or N encodings.
+            infos (list, optional): Additional information for every face.
+        """
+        if len(face_ids) == 0:
+            return
+        if infos is None:
+            infos = [None] * len(face_ids)
+        with self._lock:
+            if self.dim is None:
+                self.dim = int(np.asarray(encodings[0]).size)
+                self._vectors = np.empty((0, self.dim), dtype=np.float32)
+            matrix = self._as_matrix(encodings)
+            if self.quantizer is not None and not self.quantizer.is_trained:
+                # quantize() was called on an empty gallery
+                self._quantize_rows(matrix)
+            self._reserve(len(matrix))
+            start, end = self._size, self._size + len(matrix)
+            stored = matrix
+            if self._vectors is not None:
+                self._vectors[start:end] = matrix
+            if self._codes is not None:
+                self._codes[start:end] = self.quantizer.encode(matrix)
+                stored = self.quantizer.decode(self._codes[start:end])
+            self._sq_norms[start:end] = np.einsum('ij,ij->i', stored, stored)
+            self._ids[start:end] = face_ids
+            for row, info in enumerate(infos, start):
+                self._info[row] = info
+            self._alive[start:end] = True
+            for row, face_id in enumerate(face_ids, start):
+                previous = self._row_of.get(face_id)
+                if previous is not None:
+                    self._alive[previous] = False
+                    self._deleted += 1
+                self._row_of[face_id] = row
+            self._size = end
+            if self.index is not None and self.index.is_trained:
+                self.index.add(matrix, first_row=start)
+            self._maybe_compact()
+            self._maybe_train_index()
+
+    def set_identity(self, identity_id, rows, info):
+        """
+        Replaces the template rows of an identity.
+
+        Args:
+            identity_id (str): The ID of the identity.
+            rows (numpy.ndarray): Its centroid followed by its exemplars.
+            info (dict): Info stored with every row, see IdentityTemplate.gallery_info.
+        """
+        with self._lock:
+            self.add_matrix(template_row_ids(identity_id, len(rows)), rows, [info] * len(rows))
+            # Slots beyond the new row count are left over from a larger template
+            slot = len(rows)
+            while template_row_id(identity_id, slot) in self._row_of:
+                self.remove_face(template_row_id(identity_id, slot))
+                slot += 1
+
+    def remove_face(self, face_id):
+        """
+        Tombstones the row of a face so it no longer matches.
+
+        Args:
+            face_id (str): The ID of the face to remove.
+        """
+        self.remove_faces([face_id])
+
+    def remove_faces(self, face_ids):
+        """
+        Tombstones the rows of many faces, compacting afterwards if needed.
+
+        Args:
+            face_ids (iterable): The IDs of the faces to remove.
+        """
+        with self._lock:
+            for face_id in face_ids:
+                row = self._row_of.pop(face_id, None)
+                if row is not None:
+                    self._alive[row] = False
+                    self._deleted += 1
+            self._maybe_compact()
+
+    def update_face(self, face_id, info):
+        """
+        Replaces the stored information of a face.
+
+        Args:
+            face_id (str): The ID of the face to update.
+            info (dict): The new information.
+        """
+        with self._lock:
+            row = self._row_of.get(face_id)
+            if row is not None:
+                self._info[row] = info
+
+    def _maybe_compact(self):
+        """Compacts the gallery once enough rows are tombstoned"""
+        if self._deleted and self._deleted >= self.compaction_ratio * self._size:
+            self.compact()
+
+    def compact(self):
+        """
+        Drops tombstoned rows from the matrix and renumbers the remaining rows.
+        """
+        with self._lock:
+            if not self._deleted:
+                return
+            keep = self._alive[:self._size]
+            size = int(keep.sum())
+            for name in self._row_arrays():
+                if name != '_alive':
+                    array = getattr(self, name)
+                    array[:size] = array[:self._size][keep]
+            self._ids[size:self._size] = None
+            self._info[size:self._size] = None
+            if self.index is not None and self.index.is_trained:
+                self.index.compact(keep)
+            self._alive[:size] = True
+            self._alive[size:] = False
+            self._size = size
+            self._deleted = 0
+            self._row_of = {face_id: row for row, face_id in enumerate(self._ids[:size])}
+
+    def quantize(self, kind='int8', rerank=0):
+        """
+        Replaces the float32 rows by float16 or 8-bit codes, trained on the
+        current rows (or on the first rows added if the gallery is empty).
+
+        Args:
+            kind (str): 'float16' (2x smaller) or 'int8' (4x smaller).
+            rerank (int): Candidates per query re-scored with exact float32
+                distances. Non-zero keeps the float32 rows next to the codes,
+                trading the memory saving for accuracy.
+        """
+        with self._lock:
+            if rerank and self._vectors is None:
+                raise ValueError("The float32 encodings were already discarded; "
+                                 "reload the gallery to quantize it with re-ranking")
+            self.compact()
+            # Read before the quantizer changes, in case the rows are already codes
+            current = self.vectors if self._size else None
+            self.quantizer = ScalarQuantizer(kind)
+            self.rerank = rerank
+            if current is not None:
+                self._quantize_rows(current)
+
+    def _quantize_rows(self, training):
+        """
+        Trains the quantizer and converts the stored rows to codes.
+
+        Args:
+            training (numpy.ndarray): Float32 rows to train on; its first
+                self._size rows must be the rows currently stored.
+        """
+        self.quantizer.train(training)
+        codes = self._allocate((self._alive.shape[0], self.dim), self.quantizer.code_dtype)
+        if self._size:
+            codes[:self._size] = self.quantizer.encode(training[:self._size])
+            decoded = self.quantizer.decode(codes[:self._size])
+            self._sq_norms[:self._size] = np.einsum('ij,ij->i', decoded, decoded)
+        if self._codes is not None:
+            self._release(self._codes)
+        self._codes = codes
+        if not self.rerank and self._vectors is not None:
+            self._release(self._vectors)
+            self._vectors = None
+
+    def shard(self, workers=None, min_rows=DEFAULT_MIN_ROWS, mp_context=None):
+        """
+        Moves the gallery into shared memory and splits exact scans of at
+        least `min_rows` rows across worker processes, one slice each.
+
+        Args:
+            workers (int, optional): Number of shards and worker processes.
+                Defaults to the number of CPUs.
+            min_rows (int): Smaller galleries are still scanned in process.
+            mp_context (multiprocessing.context.BaseContext, optional): How the
+                workers are started, see ShardedSearcher.
+
+        Returns:
+            ShardedSearcher: The searcher, also stored on self.shards.
+        """
+        with self._lock:
+            if self.shards is not None:
+                self.shards.close()
+            self.shards = ShardedSearcher(workers, min_rows, mp_context)
+            if self._alive.shape[0]:
+                # Empty galleries move on their first _reserve
+                for name in self._row_arrays():
+                    array = getattr(self, name)
+                    if array.dtype != object:
+                        shared = self._allocate(array.shape, array.dtype)
+                        shared[:] = array
+                        setattr(self, name, shared)
+            self.shards.start()
+            return self.shards
+
+    def close(self):
+        """Stops the shard workers, moving the rows back to private memory"""
+        with self._lock:
+            if self.shards is None:
+                return
+            shards, self.shards = self.shards, None
+            for name in self._row_arrays():
+                array = getattr(self, name)
+                if shards.arrays.owns(array):
+                    setattr(self, name, array.copy())
+            shards.close()
+
+    def build_index(self, nlist=None, nprobe=8, min_rows=DEFAULT_INDEX_MIN_ROWS, **kwargs):
+        """
+        Builds an approximate IVF index over the current rows.
+
+        A gallery with fewer than `min_rows` live rows keeps using exact scans;
+        the index is trained by the add that brings it to `min_rows`.
+
+        Args:
+            nlist (int, optional): Number of k-means buckets. Defaults to about 4 * sqrt(N).
+            nprobe (int): Number of buckets scanned per query.
+            min_rows (int): Live rows needed to train the index.
+            **kwargs: Passed through to the IVFIndex constructor.
+
+        Returns:
+            IVFIndex: The index, also stored on self.index; not yet trained
+                if the gallery is smaller than `min_rows`.
+        """
+        with self._lock:
+            self.index = IVFIndex(nlist=nlist, nprobe=nprobe, **kwargs)
+            self.index_min_rows = max(1, min_rows)
+            self._maybe_train_index()
+            return self.index
+
+    def _maybe_train_index(self):
+        """Trains a pending index once the gallery has index_min_rows live rows"""
+        if (self.index is not None and not self.index.is_trained
+                and len(self) >= self.index_min_rows):
+            self.compact()
+            self.index.build(self.vectors)
+
+    def _exact_search(self, queries, k):
+        """Scans every live row and returns squared distances and row indices"""
+        if self.shards is not None and self._size >= self.shards.min_rows:
+            quantized = self._codes is not None
+            found = self.shards.search(
+                queries, k, self._codes if quantized else self._vectors, self._sq_norms,
+                self._size, alive=self._alive if self._deleted else None,
+                quantizer=self.quantizer if quantized else None)
+            if found is not None:
+                return found
+        if self._codes is not None:
+            distances = self.quantizer.squared_distances(
+                queries, self._codes[:self._size], self._sq_norms[:self._size])
+        else:
+            distances = squared_distances(queries, self.vectors, self._sq_norms[:self._size])
+        if self._deleted:
+            distances[:, ~self._alive[:self._size]] = np.inf
+        return smallest_k(distances, k)
+
+    def _rerank(self, queries, indices, k):
+        """Re-scores candidate rows with exact float32 distances and keeps the best k"""
+        valid = indices >= 0
+        candidates = self._vectors[np.where(valid, indices, 0)]
+        difference = candidates - queries[:, None, :]
+        distances = np.einsum('mkd,mkd->mk', difference, difference)
+        distances[~valid] = np.inf
+        order = np.argsort(distances, axis=1)[:, :k]
+        return (np.take_along_axis(distances, order, axis=1),
+                np.take_along_axis(indices, order, axis=1))
+
+    def index_recall(self, queries=None, k=10, sample_size=200, nprobe=None, seed=0):
+        """
+        Measures how many of the exact k nearest neighbours the index returns.
+
+        Args:
+            queries (numpy.ndarray, optional): Query encodings. Defaults to a
+                random sample of gallery rows.
+            k (int): The number of neighbours compared per query.
+            sample_size (int): Number of rows sampled when no queries are given.
+            nprobe (int, optional): Overrides the index nprobe for this measurement.
+            seed (int): Random seed for sampling queries.
+
+        Returns:
+            float: Recall at k between 0.0 and 1.0.
+
+        Raises:
+            ValueError: If no index has been trained yet.
+        """
+        with self._lock:
+            if self.index is None or not self.index.is_trained:
+                raise ValueError("The gallery has no trained index, see build_index()")
+            if queries is None:
+                rng = np.random.default_rng(seed)
+                live = np.flatnonzero(self._alive[:self._size])
+                queries = self._scan_vectors()[
+                    rng.choice(live, min(sample_size, live.size), replace=False)]
+            queries = self._as_matrix(queries)
+            _, approximate = self.index.search(
+                self._scan_vectors(), queries, k, self._sq_norms[:self._size], nprobe=nprobe,
+                alive=self._alive[:self._size] if self._deleted else None)
+            _, exact = self._exact_search(queries, k)
+            return recall_at_k(approximate, exact)
+
+    def search(self, encodings, k=None, threshold=None, exact=False, nprobe=None):
+        """
+        Finds the nearest gallery rows for one or more query encodings.
+
+        Args:
+            encodings (numpy.ndarray or list): One encoding or a batch of encodings.
+            k (int, optional): Number of candidates per query. Defaults to self.top_k.
+            threshold (float, optional): Maximum distance for a match. Defaults to self.threshold.
+            exact (bool): Scan every row even when an index has been built.
+            nprobe (int, optional): Overrides the index nprobe for this search.
+
+        Returns:
+            tuple: (distances, indices), both of shape (M, k) and sorted by distance.
+                Candidates farther than the threshold have index -1 and distance inf.
+        """
+        k = self.top_k if k is None else k
+        threshold = self.threshold if threshold is None else threshold
+        with self._lock:
+            if len(self) == 0:
+                if isinstance(encodings, (list, tuple)):
+                    queries = len(encodings)
+                elif self.dim:
+                    queries = np.asarray(encodings).size // self.dim
+                else:
+                    # Before the first row the dimension is unknown: a matrix is a batch
+                    queries = len(encodings) if np.ndim(encodings) > 1 else 1
+                return (np.full((queries, k), np.inf, dtype=np.float32),
+                        np.full((queries, k), -1, dtype=np.int64))
+
+            queries = self._as_matrix(encodings)
+            rerank = self.rerank if self._codes is not None and self._vectors is not None else 0
+            candidates = max(k, rerank)
+            if self.index is not None and self.index.is_trained and not exact:
+                found, indices = self.index.search(
+                    self._scan_vectors(), queries, candidates, self._sq_norms[:self._size],
+                    nprobe=nprobe, alive=self._alive[:self._size] if self._deleted else None)
+            else:
+                found, indices = self._exact_search(queries, candidates)
+            if rerank:
+                found, indices = self._rerank(queries, indices, k)
+        out_distances = np.full((len(queries), k), np.inf, dtype=np.float32)
+        out_indices = np.full((len(queries), k), -1, dtype=np.int64)
+        out_distances[:, :found.shape[1]] = np.sqrt(found)
+        out_indices[:, :found.shape[1]] = indices
+        rejected = ~(out_distances <= threshold)
+        out_distances[rejected] = np.inf
+        out_indices[rejected] = -1
+        return out_distances, out_indices
+
+    def find_match(self, encoding):
+        """
+        Finds the closest gallery row for a single encoding.
+
+        Args:
+            encoding (numpy.ndarray): The face encoding to match.
+
+        Returns:
+            int: The index of the matching row, or None if nothing is within the threshold.
+        """
+        _, indices = self.search(encoding, k=1)
+        index = int(indices[0, 0])
+        return index if index >= 0 else None
+
+    def get_face_id(self, index):
+        """Returns the face ID stored at the given row index"""
+        return self._ids[index]
+
+    def get_info(self, index):
+        """Returns the info stored at the given row index"""
+        return self._info[index]
+
+    def get_name(self, index):
+        """
+        Returns a display name for the given row index.
+
+        Args:
+            index (int): The row index returned by find_match or search.
+
+        Returns:
+            str: The 'name' entry of the face info if present, otherwise the face ID.
+        """
+        info = self._info[index]
+        if isinstance(info, dict) and info.get('name'):
+            return info['name']
+        return self._ids[index]
+
+    @metrics.timed(metrics.STAGE_SECONDS, stage='match')
+    def recognize(self, encodings, unknown="Unknown"):
+        """
+        Matches a batch of encodings with a single distance computation.
+
+        Args:
+            encodings (list): The face encodings to recognize.
+            unknown (str): Name returned for encodings without a match.
+
+        Returns:
+            List[str]: A name for every encoding.
+        """
+        if len(encodings) == 0:
+            return []
+        with self._lock:
+            _, indices = self.search(encodings, k=1)
+            return [self.get_name(i) if i >= 0 else unknown for i in indices[:, 0]]
@@ -1,11 +1,12 @@
 #!/usr/bin/python3
 
 import cv2
-import dlib
-import numpy as np
+from app import model_registry
 from app.face_alignment import FaceAligner
+from app.face_detection import HogDetector
 from app.face_encoding import FaceEncoder
 from app.feature_extraction import FeatureExtractor
+from app.image_io import decode_image
 from flask import request
 
 class FacialRecognizer:
@@ -13,21 +14,28 @@ class FacialRecognizer:
     Class for performing facial recognition using face detection, alignment, and encoding.
     """
 
-    def __init__(self, shape_predictor_path, database):
+    def __init__(self, shape_predictor_path, database, face_detector=None):
         """
         Initializes the FacialRecognizer with the provided shape predictor path and Database.
 
         Args:
             shape_predictor_path (str): The path to the shape predictor file.
-            database (Database): The Database instance containing face encodings.
+            database (FaceGallery): The gallery of enrolled face encodings.
+            face_detector (DetectorBackend, optional): Finds the faces to recognize.
+                Defaults to the dlib HOG detector.
         """
-        self.face_detector = dlib.get_frontal_face_detector()
-        self.shape_predictor = dlib.shape_predictor(shape_predictor_path)
+        self.shape_predictor_path = shape_predictor_path
         self.database = database
+        self.face_detector = face_detector or HogDetector()
         self.face_alignment = FaceAligner(shape_predictor_path)
         self.feature_extractor = FeatureExtractor(shape_predictor_path)
         self.face_encoder = FaceEncoder(self.feature_extractor)
 
+    @property
+    def shape_predictor(self):
+        """Returns the shared shape predictor, loading it on first use"""
+        return model_registry.get_shape_predictor(self.shape_predictor_path)
+
     def recognize_faces(self, image):
         """
         Performs face recognition on the given image.
@@ -42,15 +50,22 @@ class FacialRecognizer:
             return 'No file uploaded.', 400
 
         image_file = request.files['image']
-        image = cv2.imdecode(np.frombuffer(image_file.read(), np.uint8), cv2.IMREAD_COLOR)
+        image = decode_image(image_file.read())
 
-        aligned_faces = self.face_alignment.align_face(image)
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        faces = self.face_detector.detect_faces(image, gray)
+        aligned_faces = self.face_alignment.align_faces(image, faces, gray)
         encodings = self.face_encoder.encode_faces(aligned_faces)
-        recognized_names = []
-        for encoding in encodings:
-            match_index = self.database.find_match(encoding)
-            if match_index is not None:
-                recognized_names.append(self.database.get_name(match_index))
-            else:
-                recognized_names.append("Unknown")
-        return recognized_names
+        return self.match_encodings(encodings)
+
+    def match_encodings(self, encodings):
+        """
+        Matches face encodings against the gallery in a single batched search.
+
+        Args:
+            encodings (list): The face encodings to match.
+
+        Returns:
+            List[str]: A recognized name, or "Unknown", for every encoding.
+        """
+        return self.database.recognize(encodings)
@@ -2,7 +2,9 @@
 
 import cv2
 import dlib
-import numpy as np
+
+from app import metrics, model_registry
+from app.face_alignment import chip_mapping, map_to_chips, shapes_to_array
 
 
 class FeatureExtractor:
@@ -13,12 +15,19 @@ class FeatureExtractor:
     def __init__(self, shape_predictor_path):
         """
         Initializes the FeatureExtractor with the provided shape predictor model path.
+        The predictor is shared through the model registry and loaded on first use.
 
         Args:
             shape_predictor_path (str): Path to the shape predictor model file.
         """
-        self.shape_predictor = dlib.shape_predictor(shape_predictor_path)
+        self.shape_predictor_path = shape_predictor_path
+
+    @property
+    def shape_predictor(self):
+        """Returns the shared shape predictor, loading it on first use"""
+        return model_registry.get_shape_predictor(self.shape_predictor_path)
 
+    @metrics.timed(metrics.STAGE_SECONDS, stage='extract_features')
     def extract_features(self, aligned_face):
         """
         Extracts facial features from the aligned face image.
@@ -31,9 +40,60 @@ class FeatureExtractor:
         """
         gray = cv2.cvtColor(aligned_face, cv2.COLOR_BGR2GRAY)
         shape = self.shape_predictor(gray, dlib.rectangle(0, 0, aligned_face.shape[0], aligned_face.shape[1]))
-        landmarks = np.array([[shape.part(i).x, shape.part(i).y] for i in range(shape.num_parts)], dtype=np.float32)
+        landmarks = shapes_to_array([shape])[0]
         return landmarks
 
+    @metrics.timed(metrics.STAGE_SECONDS, stage='extract_features_batch')
+    def extract_features_batch(self, aligned_faces):
+        """
+        Extracts facial features from many aligned face images.
+
+        Args:
+            aligned_faces (list): The aligned face images.
+
+        Returns:
+            numpy.ndarray: An (N, P, 2) float32 array with the features of every face.
+        """
+        predictor = self.shape_predictor
+        shapes = []
+        for aligned_face in aligned_faces:
+            gray = cv2.cvtColor(aligned_face, cv2.COLOR_BGR2GRAY)
+            shapes.append(predictor(gray, dlib.rectangle(0, 0, aligned_face.shape[0], aligned_face.shape[1])))
+        return shapes_to_array(shapes)
+
+    @metrics.timed(metrics.STAGE_SECONDS, stage='features_from_shape')
+    def features_from_shape(self, shape, chip_details):
+        """
+        Extracts facial features from the landmarks predicted during alignment,
+        moved into the coordinate frame of the aligned face chip. Unlike
+        extract_features this does not run the shape predictor again.
+
+        Args:
+            shape (dlib.full_object_detection): Landmarks in image coordinates.
+            chip_details (dlib.chip_details): The chip the face was aligned to.
+
+        Returns:
+            numpy.ndarray: The extracted facial features.
+        """
+        points = shapes_to_array([shape])[0]
+        mapping = chip_mapping(chip_details)
+        return points @ mapping[:, :2].T + mapping[:, 2]
+
+    @metrics.timed(metrics.STAGE_SECONDS, stage='features_from_shapes')
+    def features_from_shapes(self, shapes, chip_details):
+        """
+        Batch version of features_from_shape: every face's landmarks are moved
+        into its chip's frame with a single vectorized transform.
+
+        Args:
+            shapes (list): Landmarks in image coordinates, one per face.
+            chip_details (list): The chips the faces were aligned to.
+
+        Returns:
+            numpy.ndarray: An (N, P, 2) float32 array with the features of every face.
+        """
+        return map_to_chips(shapes_to_array(shapes), chip_details)
+
 """
 # Example usage
 aligned_face = ...  # Aligned face image
@@ -0,0 +1,218 @@
+#!/usr/bin/python3
+"""
+Versioned on-disk snapshots of the face gallery: encodings and norms are
+stored as raw arrays that every process memory-maps from the shared page
+cache, next to the face IDs and per-row metadata offsets
+"""
+
+import json
+import os
+import pickle
+import struct
+import tempfile
+import time
+
+import numpy as np
+
+MAGIC = b'FXGS'
+FORMAT_VERSION = 1
+_PREAMBLE = struct.Struct('<4sHI')
+# Sections start on page boundaries so they can be mapped directly
+_ALIGNMENT = 4096
+# Share of extra rows reserved after the encodings, so rows added since the
+# snapshot fit without copying the mapped matrix into private memory
+DEFAULT_HEADROOM = 0.1
+
+
+def _align(offset):
+    return -(-offset // _ALIGNMENT) * _ALIGNMENT
+
+
+def write_snapshot(path, face_ids, encodings, infos, last_row_id, headroom=DEFAULT_HEADROOM):
+    """
+    Writes a gallery snapshot, replacing any earlier file at `path` atomically.
+
+    Processes that still map the earlier file keep reading it until they reload.
+
+    Args:
+        path (str): Where to write the snapshot.
+        face_ids (list): The IDs of the faces.
+        encodings (numpy.ndarray): An (N, D) float32 matrix.
+        infos (list): Additional information of every face.
+        last_row_id (int): The largest Face.id included, where catch-up queries resume.
+        headroom (float): Share of empty rows reserved for faces added later. The
+            reserved rows are left as a hole in the file and take no disk space
+            on most file systems.
+    """
+    encodings = np.ascontiguousarray(encodings, dtype='<f4')
+    size = len(face_ids)
+    dim = encodings.shape[1] if size else 0
+    capacity = size + (int(size * headroom) if size else 0)
+    if any('\0' in face_id for face_id in face_ids):
+        raise ValueError("Face IDs cannot contain NUL characters")
+
+    ids = '\0'.join(face_ids).encode('utf-8')
+    # Rows without info are stored as an empty slice
+    info_blobs = [b'' if info is None else pickle.dumps(info) for info in infos]
+    info_offsets = np.zeros(size + 1, dtype='<i8')
+    np.cumsum([len(blob) for blob in info_blobs], out=info_offsets[1:])
+
+    sections = {}
+    offset = 0
+    for name, nbytes in (('vectors', capacity * dim * 4), ('sq_norms', capacity * 4),
+                         ('ids', len(ids)), ('info_offsets', info_offsets.nbytes),
+                         ('infos', int(info_offsets[-1]))):
+        sections[name] = [offset, nbytes]
+        offset = _align(offset + nbytes)
+    header = json.dumps({
+        'format_version': FORMAT_VERSION,
+        'last_row_id': last_row_id,
+        'created': time.time(),
+        'size': size,
+        'capacity': capacity,
+        'dim': dim,
+        'sections': sections,
+    }).encode('utf-8')
+    data_start = _align(_PREAMBLE.size + len(header))
+
+    directory = os.path.dirname(os.path.abspath(path))
+    handle, temporary = tempfile.mkstemp(prefix='.snapshot-', dir=directory)
+    try:
+        with os.fdopen(handle, 'wb') as file:
+            file.write(_PREAMBLE.pack(MAGIC, FORMAT_VERSION, len(header)) + header)
+
+            def write_section(name, data):
+                file.seek(data_start + sections[name][0])
+                file.write(data)
+
+            if size:
+                write_section('vectors', encodings.tobytes())
+                write_section('sq_norms', np.einsum('ij,ij->i', encodings, encodings)
+                              .astype('<f4').tobytes())
+            write_section('ids', ids)
+            write_section('info_offsets', info_offsets.tobytes())
+            write_section('infos', b''.join(info_blobs))
+            file.truncate(data_start + offset)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary, path)
+    except BaseException:
+        os.unlink(temporary)
+        raise
+
+
+def export_snapshot(database_manager, path, headroom=DEFAULT_HEADROOM):
+    """
+    Writes a snapshot of every face stored by a DatabaseManager.
+
+    Args:
+        database_manager (DatabaseManager): The source of enrolled faces.
+        path (str): Where to write the snapshot.
+        headroom (float): Share of empty rows reserved for faces added later.
+
+    Returns:
+        GallerySnapshot: The snapshot that was written.
+    """
+    face_ids, encodings, infos, last_row_id = database_manager.get_encodings_since(0)
+    write_snapshot(path, face_ids, encodings, infos, last_row_id, headroom)
+    return GallerySnapshot(path)
+
+
+class GallerySnapshot:
+    """
+    Class reading a snapshot written by write_snapshot.
+
+    Only the header is read when the snapshot is opened; the arrays are
+    memory-mapped on request, so processes loading the same file share its
+    pages instead of each holding a copy.
+    """
+
+    def __init__(self, path):
+        """
+        Opens a snapshot and reads its header.
+
+        Args:
+            path (str): The snapshot file.
+
+        Raises:
+            ValueError: If the file is not a snapshot or uses another format version.
+        """
+        self.path = path
+        with open(path, 'rb') as file:
+            preamble = file.read(_PREAMBLE.size)
+            if len(preamble) < _PREAMBLE.size:
+                raise ValueError("%s is not a gallery snapshot" % path)
+            magic, version, header_length = _PREAMBLE.unpack(preamble)
+            if magic != MAGIC:
+                raise ValueError("%s is not a gallery snapshot" % path)
+            if version != FORMAT_VERSION:
+                raise ValueError("%s uses snapshot format %d, expected %d"
+                                 % (path, version, FORMAT_VERSION))
+            header = json.loads(file.read(header_length).decode('utf-8'))
+        self.last_row_id = header['last_row_id']
+        self.created = header['created']
+        self.size = header['size']
+        self.capacity = header['capacity']
+        self.dim = header['dim']
+        self._sections = header['sections']
+        self._data_start = _align(_PREAMBLE.size + header_length)
+
+    def _map(self, name, dtype, shape, writable):
+        offset, nbytes = self._sections[name]
+        if not nbytes:
+            return np.zeros(shape, dtype=dtype)
+        # Copy-on-write: rows written by the gallery become private pages,
+        # the rest stay shared with every other process mapping the file
+        return np.memmap(self.path, dtype=dtype, mode='c' if writable else 'r',
+                         offset=self._data_start + offset, shape=shape)
+
+    def vectors(self, writable=False):
+        """
+        Maps the encodings, including the reserved rows after the first `size`.
+
+        Args:
+            writable (bool): Map copy-on-write instead of read-only.
+
+        Returns:
+            numpy.memmap: A (capacity, dim) float32 matrix.
+        """
+        return self._map('vectors', '<f4', (self.capacity, self.dim), writable)
+
+    def sq_norms(self, writable=False):
+        """Maps the squared norms of the encodings, as a (capacity,) float32 array"""
+        return self._map('sq_norms', '<f4', (self.capacity,), writable)
+
+    def face_ids(self):
+        """Returns the face IDs, in row order"""
+        if not self.size:
+            return []
+        return bytes(self._map('ids', np.uint8, (self._sections['ids'][1],), False)) \
+            .decode('utf-8').split('\0')
+
+    def _info_offsets(self):
+        return self._map('info_offsets', '<i8', (self.size + 1,), False)
+
+    def info(self, row):
+        """Returns the additional information of one row without reading the others"""
+        start, end = self._info_offsets()[row:row + 2]
+        if start == end:
+            return None
+        offset = self._data_start + self._sections['infos'][0]
+        with open(self.path, 'rb') as file:
+            file.seek(offset + int(start))
+            return pickle.loads(file.read(int(end - start)))
+
+    def infos(self):
+        """Returns the additional information of every row, None where there is none"""
+        offsets = self._info_offsets().tolist()
+        nbytes = self._sections['infos'][1]
+        blob = bytes(self._map('infos', np.uint8, (nbytes,), False)) if nbytes else b''
+        return [pickle.loads(blob[start:end]) if end > start else None
+                for start, end in zip(offsets, offsets[1:])]
+"""
+# Example usage
+export_snapshot(database_manager, 'data/gallery.snapshot')
+
+# In every worker process
+gallery = FaceGallery.from_snapshot('data/gallery.snapshot', database_manager, attach=True)
+"""
@@ -0,0 +1,183 @@
+#!/usr/bin/python3
+"""
+Per-identity templates: the encodings of one person are folded into a
+running centroid plus a capped set of diverse exemplars, so the gallery
+grows with the number of people instead of with traffic
+"""
+
+import threading
+import uuid
+
+import numpy as np
+
+DEFAULT_MAX_EXEMPLARS = 8
+# Encodings closer than this to an exemplar add nothing new
+DEFAULT_MIN_EXEMPLAR_DISTANCE = 5.0
+
+
+def add_exemplar(exemplars, encoding, max_exemplars=DEFAULT_MAX_EXEMPLARS,
+                 min_distance=DEFAULT_MIN_EXEMPLAR_DISTANCE):
+    """
+    Adds an encoding to a set of exemplars if it makes the set more diverse.
+
+    Below the cap the encoding is appended unless an exemplar lies within
+    `min_distance`. At the cap it replaces a member of the closest pair of
+    exemplars, when it is farther from the set than that pair is apart.
+
+    Args:
+        exemplars (numpy.ndarray): A (K, D) float32 matrix.
+        encoding (numpy.ndarray): The new (D,) encoding.
+        max_exemplars (int): The cap on K.
+        min_distance (float): Minimum distance to every exemplar for the encoding to be kept.
+
+    Returns:
+        numpy.ndarray: The updated exemplars, a new matrix if anything changed.
+    """
+    distances = np.sqrt(np.einsum('kd,kd->k', exemplars - encoding, exemplars - encoding))
+    if distances.min() <= min_distance:
+        return exemplars
+    if len(exemplars) < max_exemplars:
+        return np.vstack([exemplars, encoding[None]])
+    if len(exemplars) < 2:
+        return exemplars
+    difference = exemplars[:, None, :] - exemplars[None, :, :]
+    pairwise = np.sqrt(np.einsum('ijd,ijd->ij', difference, difference))
+    np.fill_diagonal(pairwise, np.inf)
+    first, second = np.unravel_index(np.argmin(pairwise), pairwise.shape)
+    if distances.min() <= pairwise[first, second]:
+        return exemplars
+    exemplars = exemplars.copy()
+    # The encoding now covers the region of the pair member it is closer to
+    exemplars[first if distances[first] < distances[second] else second] = encoding
+    return exemplars
+
+
+class IdentityTemplate:
+    """
+    Class holding the aggregated encodings of one person.
+    """
+
+    def __init__(self, identity_id, name=None, centroid=None, exemplars=None, count=0, info=None):
+        """
+        Initializes the IdentityTemplate.
+
+        Args:
+            identity_id (str): The ID of the identity.
+            name (str, optional): The display name, if known.
+            centroid (numpy.ndarray, optional): Mean of every folded encoding.
+            exemplars (numpy.ndarray, optional): A (K, D) matrix of diverse encodings.
+            count (int): Number of encodings folded in so far.
+            info (dict, optional): Additional information about the person.
+        """
+        self.identity_id = identity_id
+        self.name = name
+        self.centroid = None if centroid is None else np.asarray(centroid, dtype=np.float32).ravel()
+        self.exemplars = None if exemplars is None else np.asarray(exemplars, dtype=np.float32)
+        self.count = count
+        self.info = info
+
+    def add(self, encoding, max_exemplars=DEFAULT_MAX_EXEMPLARS,
+            min_distance=DEFAULT_MIN_EXEMPLAR_DISTANCE):
+        """
+        Folds one encoding into the centroid and exemplars.
+
+        Args:
+            encoding (numpy.ndarray): The face encoding.
+            max_exemplars (int): Exemplars kept at most.
+            min_distance (float): See add_exemplar.
+        """
+        encoding = np.asarray(encoding, dtype=np.float32).ravel()
+        if self.centroid is None:
+            self.centroid = encoding.copy()
+            self.exemplars = encoding[None].copy()
+            self.count = 1
+            return
+        self.count += 1
+        self.centroid = self.centroid + (encoding - self.centroid) / self.count
+        self.exemplars = add_exemplar(self.exemplars, encoding, max_exemplars, min_distance)
+
+    def rows(self):
+        """Returns the gallery rows of the identity: the centroid, then the exemplars"""
+        return np.vstack([self.centroid[None], self.exemplars])
+
+    def gallery_info(self):
+        """Returns the info stored with each gallery row of the identity"""
+        return {'name': self.name or self.identity_id, 'identity_id': self.identity_id}
+
+
+class IdentityEnroller:
+    """
+    Class assigning new encodings to identities and folding them into their templates.
+
+    Encodings that match a template of the gallery join that identity.
+    Unmatched encodings start new identities, grouped first among
+    themselves so one batch does not create the same person twice.
+    """
+
+    def __init__(self, face_gallery, database_manager, max_exemplars=DEFAULT_MAX_EXEMPLARS,
+                 min_distance=DEFAULT_MIN_EXEMPLAR_DISTANCE, id_factory=None):
+        """
+        Initializes the IdentityEnroller.
+
+        Args:
+            face_gallery (FaceGallery): A gallery built by FaceGallery.from_identities
+                and attached to the database manager.
+            database_manager (DatabaseManager): Where the identities are stored.
+            max_exemplars (int): Exemplars kept per identity.
+            min_distance (float): See add_exemplar.
+            id_factory (callable, optional): Returns the ID of each new identity.
+        """
+        self.face_gallery = face_gallery
+        self.database_manager = database_manager
+        self.max_exemplars = max_exemplars
+        self.min_distance = min_distance
+        self.id_factory = id_factory or (lambda: str(uuid.uuid4()))
+        # Two uploads of a new person must not both create an identity
+        self._lock = threading.Lock()
+
+    def enroll(self, encodings, names=None, consumed_face_ids=()):
+        """
+        Folds encodings into the templates of their identities.
+
+        Args:
+            encodings (list): The face encodings.
+            names (list, optional): A known name per encoding, or None. Named
+                encodings join the identity of that name instead of being matched.
+            consumed_face_ids (iterable): Rows of the faces table deleted in the
+                same transaction, see DatabaseManager.fold_encodings.
+
+        Returns:
+            List[str]: The identity ID of every encoding.
+        """
+        if len(encodings) == 0:
+            return []
+        matrix = np.stack([np.asarray(encoding, dtype=np.float32).ravel() for encoding in encodings])
+        names = list(names) if names is not None else [None] * len(matrix)
+        with self._lock:
+            identity_ids = [None] * len(matrix)
+            unnamed = [row for row, name in enumerate(names) if not name]
+            if unnamed:
+                _, indices = self.face_gallery.search(matrix[unnamed], k=1)
+                created = []
+                for row, index in zip(unnamed, indices[:, 0]):
+                    if index >= 0:
+                        identity_ids[row] = self.face_gallery.get_info(index)['identity_id']
+                        continue
+                    for identity_id, first in created:
+                        if np.linalg.norm(matrix[row] - first) <= self.face_gallery.threshold:
+                            identity_ids[row] = identity_id
+                            break
+                    else:
+                        identity_ids[row] = self.id_factory()
+                        created.append((identity_ids[row], matrix[row]))
+            return self.database_manager.fold_encodings(
+                list(zip(identity_ids, names, matrix)), self.max_exemplars, self.min_distance,
+                consumed_face_ids=consumed_face_ids)
+"""
+# Example usage
+gallery = FaceGallery.from_identities(database_manager, attach=True)
+enroller = IdentityEnroller(gallery, database_manager, max_exemplars=8)
+
+identity_ids = enroller.enroll(face_encodings)
+names = gallery.recognize(face_encodings)
+"""
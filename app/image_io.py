@@ -0,0 +1,105 @@
+#!/usr/bin/python3
+"""
+Helpers for decoding uploaded images in memory and persisting the
+originals off the request path
+"""
+
+import logging
+import os
+import queue
+import threading
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def decode_image(data, flags=cv2.IMREAD_COLOR):
+    """
+    Decodes encoded image bytes without touching the filesystem.
+
+    Args:
+        data (bytes): The encoded image, e.g. the body of an uploaded file.
+        flags (int): cv2.imread flags.
+
+    Returns:
+        numpy.ndarray: The decoded image, or None if the bytes are not an image.
+    """
+    if not data:
+        return None
+    return cv2.imdecode(np.frombuffer(data, dtype=np.uint8), flags)
+
+
+class BackgroundWriter:
+    """
+    Class writing files from a background thread through a bounded queue.
+
+    When the queue is full new writes are dropped instead of blocking the
+    caller, so request latency never depends on disk speed. Callers that
+    must not lose files, such as background jobs, can wait for room instead.
+    """
+
+    def __init__(self, max_queue_size=64):
+        """
+        Initializes the BackgroundWriter and starts its thread.
+
+        Args:
+            max_queue_size (int): Maximum number of pending writes.
+        """
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self.dropped = 0
+        self.failed = 0
+        self._thread = threading.Thread(target=self._run, name='background-writer', daemon=True)
+        self._thread.start()
+
+    def submit(self, path, data, timeout=0):
+        """
+        Queues bytes to be written to a path.
+
+        Args:
+            path (str): Destination file path.
+            data (bytes): The file contents.
+            timeout (float, optional): Seconds to wait for room in a full queue,
+                None to wait as long as it takes. Defaults to not waiting.
+
+        Returns:
+            bool: True if the write was queued, False if it was dropped.
+        """
+        try:
+            if timeout == 0:
+                self._queue.put_nowait((path, data))
+            else:
+                self._queue.put((path, data), timeout=timeout)
+            return True
+        except queue.Full:
+            self.dropped += 1
+            logger.warning("Write queue full, not persisting %s", path)
+            return False
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                path, data = item
+                directory = os.path.dirname(path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                with open(path, 'wb') as file:
+                    file.write(data)
+            except OSError:
+                self.failed += 1
+                logger.exception("Could not persist %s", item[0])
+            finally:
+                self._queue.task_done()
+
+    def flush(self):
+        """Blocks until every queued write has been performed"""
+        self._queue.join()
+
+    def close(self):
+        """Writes the remaining queue and stops the thread"""
+        self._queue.put(None)
+        self._thread.join()
@@ -0,0 +1,197 @@
+#!/usr/bin/python3
+"""
+Parallel ingestion of training images: files are fanned out to a pool
+of worker processes that each keep their own preloaded models
+"""
+
+import os
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+
+from app import model_registry
+from app.face_alignment import FaceAligner
+from app.face_detection import create_detector
+from app.feature_extraction import FeatureExtractor
+from app.image_io import decode_image
+from app.pipeline import FacePipeline
+
+FileReport = namedtuple(
+    'FileReport', ['name', 'faces', 'encodings', 'error', 'decode_seconds', 'process_seconds'])
+
+# Pipeline of the current worker process, built once by _init_worker
+_pipeline = None
+
+
+def build_pipeline(shape_predictor_path, detector_backend='haar', detector_options=None,
+                   reuse_landmarks=False):
+    """
+    Builds a FacePipeline with its models loaded.
+
+    Args:
+        shape_predictor_path (str): Path to the shape predictor model file.
+        detector_backend (str): The detector backend, see create_detector.
+        detector_options (dict, optional): Constructor arguments of the detector,
+            e.g. the cascade_path of the Haar backend.
+        reuse_landmarks (bool): See FacePipeline.
+
+    Returns:
+        FacePipeline: The ready-to-use pipeline.
+    """
+    model_registry.warm_up(shape_predictor_path)
+    return FacePipeline(create_detector(detector_backend, **(detector_options or {})),
+                        FaceAligner(shape_predictor_path),
+                        FeatureExtractor(shape_predictor_path),
+                        reuse_landmarks=reuse_landmarks)
+
+
+def _init_worker(shape_predictor_path, detector_backend, detector_options, reuse_landmarks):
+    """Loads the models once when a worker process starts"""
+    global _pipeline
+    _pipeline = build_pipeline(shape_predictor_path, detector_backend, detector_options,
+                               reuse_landmarks)
+
+
+def _load_image(source):
+    """Reads or decodes the image of a source, returning (name, image)"""
+    if isinstance(source, tuple):
+        name, data = source
+        return name, decode_image(data)
+    return os.path.basename(source), cv2.imread(source)
+
+
+def _process_source(source, pipeline=None):
+    """
+    Runs the pipeline over one file and reports what happened.
+
+    Args:
+        source (str or tuple): Path of the image file, or (name, encoded bytes).
+        pipeline (FacePipeline, optional): Defaults to the worker's pipeline.
+
+    Returns:
+        FileReport: The outcome for this file.
+    """
+    pipeline = pipeline or _pipeline
+    name = source[0] if isinstance(source, tuple) else str(source)
+    started = time.perf_counter()
+    try:
+        name, image = _load_image(source)
+        decoded = time.perf_counter()
+        if image is None:
+            return FileReport(name, 0, [], 'Could not read image', decoded - started, 0.0)
+        encodings = pipeline.encode(image)
+        finished = time.perf_counter()
+    except Exception as error:
+        return FileReport(name, 0, [], str(error), time.perf_counter() - started, 0.0)
+    error = None if encodings else 'No faces detected'
+    return FileReport(name, len(encodings), encodings, error, decoded - started, finished - decoded)
+
+
+def summarize(reports, seconds=None):
+    """
+    Aggregates per-file reports.
+
+    Args:
+        reports (list): FileReports returned by IngestionEngine.ingest.
+        seconds (float, optional): Wall-clock time of the run, for throughput.
+
+    Returns:
+        dict: Counts of files, failures and faces, plus images per second.
+    """
+    summary = {
+        'files': len(reports),
+        'failed': sum(1 for report in reports if report.error),
+        'faces': sum(report.faces for report in reports),
+    }
+    if seconds:
+        summary['seconds'] = seconds
+        summary['images_per_second'] = len(reports) / seconds
+    return summary
+
+
+class IngestionEngine:
+    """
+    Class for detecting, aligning and encoding many training images across CPU cores.
+    """
+
+    def __init__(self, shape_predictor_path, detector_backend='haar', detector_options=None,
+                 workers=None, mp_context=None, reuse_landmarks=False):
+        """
+        Initializes the IngestionEngine. The worker pool starts on first use.
+
+        Args:
+            shape_predictor_path (str): Path to the shape predictor model file.
+            detector_backend (str): The detector backend, see create_detector.
+            detector_options (dict, optional): Constructor arguments of the detector.
+            workers (int, optional): Number of worker processes. Defaults to the
+                number of CPUs; 1 processes files in the calling process.
+            mp_context (multiprocessing.context.BaseContext, optional): How the
+                workers are started. The platform default forks, which is only
+                safe before the application starts threads of its own, see start().
+            reuse_landmarks (bool): See FacePipeline; must match the encodings
+                already stored.
+        """
+        self.shape_predictor_path = shape_predictor_path
+        self.detector_backend = detector_backend
+        self.detector_options = detector_options or {}
+        self.workers = workers or os.cpu_count() or 1
+        self.mp_context = mp_context
+        self.reuse_landmarks = reuse_landmarks
+        self._executor = None
+        # Pipelines of the threads ingesting in process. Detectors must not be
+        # shared between threads; the shape predictor of model_registry is
+        self._local = threading.local()
+
+    def _get_executor(self):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=self.mp_context,
+                initializer=_init_worker,
+                initargs=(self.shape_predictor_path, self.detector_backend, self.detector_options,
+                          self.reuse_landmarks))
+        return self._executor
+
+    def start(self):
+        """Starts the worker processes now instead of on the first multi-file ingest"""
+        if self.workers == 1:
+            return
+        executor = self._get_executor()
+        for future in [executor.submit(os.getpid) for _ in range(self.workers)]:
+            future.result()
+
+    def _get_pipeline(self):
+        """Returns the in-process pipeline of the calling thread, built on first use"""
+        pipeline = getattr(self._local, 'pipeline', None)
+        if pipeline is None:
+            pipeline = build_pipeline(self.shape_predictor_path, self.detector_backend,
+                                      self.detector_options, self.reuse_landmarks)
+            self._local.pipeline = pipeline
+        return pipeline
+
+    def ingest(self, sources):
+        """
+        Processes every source and reports per file instead of stopping at the first failure.
+
+        Args:
+            sources (iterable): Paths of the image files, or (name, encoded bytes)
+                tuples for images that are already in memory.
+
+        Returns:
+            List[FileReport]: One report per source, in input order.
+        """
+        sources = list(sources)
+        if self.workers == 1 or len(sources) <= 1:
+            pipeline = self._get_pipeline()
+            return [_process_source(source, pipeline) for source in sources]
+        chunksize = max(1, len(sources) // (4 * self.workers))
+        return list(self._get_executor().map(_process_source, sources, chunksize=chunksize))
+
+    def close(self):
+        """Shuts the worker pool down"""
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
@@ -0,0 +1,151 @@
+#!/usr/bin/python3
+"""
+Micro-batching of gallery lookups: encodings submitted by concurrent
+requests are matched together in one distance computation
+"""
+
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+from app import metrics
+
+# Queued by close() to stop the batching thread
+_STOP = object()
+# Seconds recognize() waits for its batch by default
+DEFAULT_TIMEOUT = 10.0
+
+
+class MatchBatcher:
+    """
+    Class grouping the encodings of concurrent callers into batches.
+
+    A background thread takes the first pending submission, then keeps
+    collecting submissions until the batch holds `max_batch_size` encodings
+    or `max_wait` seconds have passed, and matches the whole batch with a
+    single FaceGallery.recognize call.
+    """
+
+    def __init__(self, face_gallery, max_batch_size=64, max_wait=0.005):
+        """
+        Initializes the MatchBatcher. The batching thread starts on first use.
+
+        Args:
+            face_gallery (FaceGallery): The gallery encodings are matched against.
+            max_batch_size (int): Encodings matched together at most. A single
+                submission larger than this is matched on its own.
+            max_wait (float): Seconds the first submission of a batch waits for others.
+        """
+        self.face_gallery = face_gallery
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                # Also replaces a batching thread that died; it resumes the queue
+                self._thread = threading.Thread(target=self._run, name='match-batcher', daemon=True)
+                self._thread.start()
+
+    def submit(self, encodings):
+        """
+        Queues encodings for matching.
+
+        Args:
+            encodings (list): The face encodings of one caller.
+
+        Returns:
+            concurrent.futures.Future: Resolves to a name, or "Unknown", per encoding.
+        """
+        future = Future()
+        if len(encodings) == 0:
+            future.set_result([])
+            return future
+        if self._thread is None or not self._thread.is_alive():
+            self._start()
+        matrix = np.stack([np.asarray(encoding, dtype=np.float32).ravel() for encoding in encodings])
+        self._queue.put((matrix, future))
+        return future
+
+    def recognize(self, encodings, timeout=DEFAULT_TIMEOUT):
+        """
+        Matches encodings as part of the next batch and waits for the result.
+
+        Args:
+            encodings (list): The face encodings to recognize.
+            timeout (float, optional): Seconds to wait for the batch, None to wait
+                indefinitely.
+
+        Returns:
+            List[str]: A name for every encoding.
+
+        Raises:
+            concurrent.futures.TimeoutError: If the batch was not matched in time.
+        """
+        return self.submit(encodings).result(timeout)
+
+    def _run(self):
+        carry = None
+        while True:
+            first = carry if carry is not None else self._queue.get()
+            carry = None
+            if first is _STOP:
+                return
+            batch, rows = [first], len(first[0])
+            deadline = time.perf_counter() + self.max_wait
+            while rows < self.max_batch_size:
+                remaining = deadline - time.perf_counter()
+                try:
+                    item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP or rows + len(item[0]) > self.max_batch_size:
+                    # Starts the next batch instead of exceeding the limit
+                    carry = item
+                    break
+                batch.append(item)
+                rows += len(item[0])
+            try:
+                self._match(batch)
+            except Exception as error:
+                # Keeps the thread alive; the callers of this batch get the error
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(error)
+
+    def _match(self, batch):
+        """Matches a batch and hands every caller its slice of the names"""
+        matrices = [matrix for matrix, _ in batch]
+        try:
+            names = self.face_gallery.recognize(np.concatenate(matrices) if len(matrices) > 1
+                                                else matrices[0])
+        except Exception as error:
+            for _, future in batch:
+                future.set_exception(error)
+            return
+        metrics.MATCH_BATCH_SIZE.observe(len(names))
+        start = 0
+        for matrix, future in batch:
+            future.set_result(names[start:start + len(matrix)])
+            start += len(matrix)
+
+    def close(self):
+        """Stops the batching thread after the pending batches are matched"""
+        with self._lock:
+            if self._thread is not None:
+                self._queue.put(_STOP)
+                self._thread.join()
+                self._thread = None
+"""
+# Example usage
+batcher = MatchBatcher(face_gallery, max_batch_size=64, max_wait=0.005)
+
+# Called from many request threads at once
+names = batcher.recognize(encodings)
+"""
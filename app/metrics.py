@@ -0,0 +1,232 @@
+#!/usr/bin/python3
+"""
+Low-overhead counters and latency histograms for the recognition hot path,
+rendered in the Prometheus text exposition format.
+
+Collection is off by default and can be switched at runtime with
+set_enabled(); while it is off every instrumented call costs one attribute
+check.
+"""
+
+import bisect
+import functools
+import threading
+import time
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join('%s="%s"' % (name, str(value).replace('"', '\\"'))
+                          for name, value in pairs) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, registry, name, documentation, labelnames=()):
+        self.registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError("%s expects labels %s, got %s"
+                             % (self.name, self.labelnames, tuple(labels)))
+        return tuple(labels[name] for name in self.labelnames)
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+    def render(self):
+        lines = ['# HELP %s %s' % (self.name, self.documentation),
+                 '# TYPE %s %s' % (self.name, self.kind)]
+        with self._lock:
+            items = sorted(self._values.items())
+            lines.extend(self._render_samples(items))
+        return lines
+
+
+class Counter(_Metric):
+    """A monotonically increasing count, e.g. of cache hits"""
+
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        """Adds `amount` to the count of the given label values, if metrics are enabled"""
+        if not self.registry.enabled:
+            return
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _render_samples(self, items):
+        return ['%s%s %s' % (self.name, _format_labels(self.labelnames, key), _format_value(value))
+                for key, value in items]
+
+
+class Histogram(_Metric):
+    """A distribution of observed values, e.g. latencies in seconds"""
+
+    kind = 'histogram'
+
+    def __init__(self, registry, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(registry, name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        """Records one value for the given label values, if metrics are enabled"""
+        if not self.registry.enabled:
+            return
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # Per-bucket counts (the last one is +Inf) and the running sum
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][index] += 1
+            state[1] += value
+
+    def _render_samples(self, items):
+        lines = []
+        bounds = self.buckets + (float('inf'),)
+        for key, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(bounds, counts):
+                cumulative += count
+                lines.append('%s_bucket%s %d' % (
+                    self.name, _format_labels(self.labelnames, key, [('le', _format_value(bound))]),
+                    cumulative))
+            labels = _format_labels(self.labelnames, key)
+            lines.append('%s_sum%s %s' % (self.name, labels, repr(total)))
+            lines.append('%s_count%s %d' % (self.name, labels, cumulative))
+        return lines
+
+
+class MetricsRegistry:
+    """
+    Class holding every metric of the process and the switch that turns
+    collection on and off.
+    """
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self._metrics = []
+
+    def counter(self, name, documentation, labelnames=()):
+        """Creates and registers a Counter"""
+        metric = Counter(self, name, documentation, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        """Creates and registers a Histogram"""
+        metric = Histogram(self, name, documentation, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def clear(self):
+        """Resets every metric"""
+        for metric in self._metrics:
+            metric.clear()
+
+    def render(self):
+        """
+        Renders every metric.
+
+        Returns:
+            str: The metrics in the Prometheus text exposition format.
+        """
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = MetricsRegistry()
+
+STAGE_SECONDS = REGISTRY.histogram(
+    'facex_stage_seconds', 'Latency of the face detection, alignment and encoding stages.',
+    ['stage'])
+FACES_PER_IMAGE = REGISTRY.histogram(
+    'facex_faces_per_image', 'Number of faces found per detector call.',
+    buckets=(0, 1, 2, 3, 4, 6, 8, 12, 16, 32))
+DATABASE_SECONDS = REGISTRY.histogram(
+    'facex_database_seconds', 'Latency of DatabaseManager operations.', ['operation'])
+DATABASE_ROUND_TRIPS = REGISTRY.counter(
+    'facex_database_round_trips_total', 'SQL statements sent to the database.', ['statement'])
+CACHE_REQUESTS = REGISTRY.counter(
+    'facex_result_cache_requests_total', 'Result cache lookups.', ['result'])
+MATCH_BATCH_SIZE = REGISTRY.histogram(
+    'facex_match_batch_size', 'Encodings matched together by the micro-batcher.',
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256))
+REQUEST_SECONDS = REGISTRY.histogram(
+    'facex_request_seconds', 'Latency of HTTP endpoints.', ['endpoint'])
+
+
+def enabled():
+    """Returns True if metrics are being collected"""
+    return REGISTRY.enabled
+
+
+def set_enabled(flag):
+    """Turns metric collection on or off for the whole process"""
+    REGISTRY.enabled = bool(flag)
+
+
+def timed(histogram, **labels):
+    """
+    Decorator recording the duration of every call in `histogram`.
+
+    Args:
+        histogram (Histogram): Where the durations go.
+        **labels: Label values of the recorded durations.
+
+    Returns:
+        callable: The decorator.
+    """
+    def decorator(func):
+        registry = histogram.registry
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not registry.enabled:
+                return func(*args, **kwargs)
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - started, **labels)
+        return wrapper
+    return decorator
+
+
+def count_statement(conn, cursor, statement, parameters, context, executemany):
+    """SQLAlchemy before_cursor_execute listener counting database round trips"""
+    if REGISTRY.enabled:
+        DATABASE_ROUND_TRIPS.inc(statement=statement.lstrip().split(None, 1)[0].upper())
+"""
+# Example usage
+metrics.set_enabled(True)
+
+@metrics.timed(metrics.STAGE_SECONDS, stage='detect')
+def detect(image):
+    ...
+
+print(metrics.REGISTRY.render())
+"""
@@ -0,0 +1,64 @@
+#!/usr/bin/python3
+"""
+Process-wide registry that loads each model file once, on first use,
+and shares it between every component that needs it
+"""
+
+import threading
+
+import dlib
+
+_models = {}
+_lock = threading.Lock()
+
+
+def get_model(key, loader):
+    """
+    Returns the model stored under `key`, loading it with `loader` the first time.
+
+    Args:
+        key (tuple): Identifies the model, e.g. ('shape_predictor', path).
+        loader (callable): Called without arguments to load the model.
+
+    Returns:
+        object: The shared model instance.
+    """
+    model = _models.get(key)
+    if model is None:
+        with _lock:
+            model = _models.get(key)
+            if model is None:
+                model = loader()
+                _models[key] = model
+    return model
+
+
+def get_shape_predictor(shape_predictor_path):
+    """
+    Returns the shared dlib shape predictor for a model file.
+
+    Args:
+        shape_predictor_path (str): Path to the shape predictor model file.
+
+    Returns:
+        dlib.shape_predictor: The loaded predictor.
+    """
+    return get_model(('shape_predictor', shape_predictor_path),
+                     lambda: dlib.shape_predictor(shape_predictor_path))
+
+
+def warm_up(shape_predictor_path=None):
+    """
+    Loads models ahead of the first request, e.g. at worker start.
+
+    Args:
+        shape_predictor_path (str, optional): Shape predictor model file to load.
+    """
+    if shape_predictor_path:
+        get_shape_predictor(shape_predictor_path)
+
+
+def clear():
+    """Drops every loaded model so the next use reloads it"""
+    with _lock:
+        _models.clear()
@@ -0,0 +1,121 @@
+#!/usr/bin/python3
+"""
+Class running detection, alignment and encoding for every face of an
+image in one pass, sharing the work the stages have in common
+"""
+
+from collections import namedtuple
+
+import cv2
+
+FaceResult = namedtuple('FaceResult', ['box', 'aligned_face', 'encoding'])
+
+
+class FacePipeline:
+    """
+    Class for running detect -> align -> encode over all faces of an image.
+
+    The image is converted to grayscale once and that copy is shared by the
+    detector and the aligner. With `reuse_landmarks` the landmarks predicted
+    during alignment are also reused for the encoding, so the shape predictor
+    runs once per face. Such encodings differ from the ones predicted again on
+    the chip, so a gallery must not mix the two.
+    """
+
+    def __init__(self, face_detector, face_aligner, feature_extractor, reuse_landmarks=False):
+        """
+        Initializes the FacePipeline.
+
+        Args:
+            face_detector (FaceDetector or DetectorPool): Finds the face boxes.
+            face_aligner (FaceAligner): Aligns each face to a chip.
+            feature_extractor (FeatureExtractor): Encodes each aligned face.
+            reuse_landmarks (bool): Encode from the alignment landmarks instead of
+                predicting landmarks again on the chip. Faster, but incompatible
+                with encodings stored without it.
+        """
+        self.face_detector = face_detector
+        self.face_aligner = face_aligner
+        self.feature_extractor = feature_extractor
+        self.reuse_landmarks = reuse_landmarks
+
+    def process(self, image):
+        """
+        Detects, aligns and encodes every face in the image.
+
+        Args:
+            image (numpy.ndarray): The BGR image to process.
+
+        Returns:
+            List[FaceResult]: The box, aligned face and encoding of every face.
+        """
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        faces = self.face_detector.detect_faces(image, gray)
+        return self.process_boxes(image, faces, gray)
+
+    def process_boxes(self, image, faces, gray):
+        """
+        Aligns and encodes every face of an image in one batch: all chips are
+        extracted together and all landmarks are mapped with one transform.
+
+        Args:
+            image (numpy.ndarray): The BGR image containing the faces.
+            faces (list): Bounding boxes of the faces (x, y, w, h).
+            gray (numpy.ndarray): The image converted to grayscale.
+
+        Returns:
+            List[FaceResult]: The box, aligned face and encoding of every face.
+        """
+        if len(faces) == 0:
+            return []
+        aligned_faces, shapes, chip_details = self.face_aligner.align_faces_with_shapes(
+            image, faces, gray)
+        if self.reuse_landmarks:
+            encodings = self.feature_extractor.features_from_shapes(shapes, chip_details)
+        else:
+            encodings = self.feature_extractor.extract_features_batch(aligned_faces)
+        return [FaceResult(tuple(int(v) for v in face), aligned_face, encoding)
+                for face, aligned_face, encoding in zip(faces, aligned_faces, encodings)]
+
+    def process_box(self, image, face, gray):
+        """
+        Aligns and encodes one face whose box is already known.
+
+        Args:
+            image (numpy.ndarray): The BGR image containing the face.
+            face (tuple): Bounding box of the face (x, y, w, h).
+            gray (numpy.ndarray): The image converted to grayscale.
+
+        Returns:
+            FaceResult: The box, aligned face and encoding of the face.
+        """
+        aligned_face, shape, chip_details = self.face_aligner.align_face_with_shape(
+            image, face, gray)
+        if self.reuse_landmarks:
+            encoding = self.feature_extractor.features_from_shape(shape, chip_details)
+        else:
+            encoding = self.feature_extractor.extract_features(aligned_face)
+        return FaceResult(tuple(int(v) for v in face), aligned_face, encoding)
+
+    def encode(self, image):
+        """
+        Returns only the encodings of every face in the image.
+
+        Args:
+            image (numpy.ndarray): The BGR image to process.
+
+        Returns:
+            list: One encoding per detected face.
+        """
+        return [result.encoding for result in self.process(image)]
+"""
+# Example usage
+image = cv2.imread('image.jpg')
+
+pipeline = FacePipeline(FaceDetector('haarcascade_frontalface_default.xml'),
+                        FaceAligner('shape_predictor_68_face_landmarks.dat'),
+                        FeatureExtractor('shape_predictor_68_face_landmarks.dat'))
+
+for box, aligned_face, encoding in pipeline.process(image):
+    print(box, encoding.shape)
+"""
@@ -0,0 +1,149 @@
+#!/usr/bin/python3
+"""
+Scalar quantization of face encodings: every dimension is shifted and
+scaled, then stored as float16 or as an 8-bit code, cutting the memory of a
+gallery by 2x or 4x. int8 scans also read 4x fewer bytes and are at least as
+fast as float32 ones; float16 only saves memory, since numpy converts half
+floats slowly and its scans take about twice as long as float32 ones
+"""
+
+import numpy as np
+
+QUANTIZATION_TYPES = ('float16', 'int8')
+# Rows of codes converted to float32 at a time during a scan, small enough
+# for the converted block to stay in L2 cache until the matmul reads it
+DEFAULT_BLOCK_ROWS = 256
+
+
+class ScalarQuantizer:
+    """
+    Class mapping float32 encodings to compact codes with a per-dimension
+    offset and scale.
+
+    'int8' spreads the trained range of each dimension (widened by `margin`)
+    over 256 levels stored as uint8; values outside it are clipped. 'float16'
+    standardizes each dimension before storing it in half precision.
+    """
+
+    def __init__(self, kind='int8', margin=0.1):
+        """
+        Initializes an untrained ScalarQuantizer.
+
+        Args:
+            kind (str): 'int8' or 'float16'.
+            margin (float): Share of each dimension's range added on both sides
+                for int8, leaving room for encodings added after training.
+        """
+        if kind not in QUANTIZATION_TYPES:
+            raise ValueError("Unknown quantization %r, expected one of %s"
+                             % (kind, ', '.join(QUANTIZATION_TYPES)))
+        self.kind = kind
+        self.margin = margin
+        self.code_dtype = np.dtype(np.uint8 if kind == 'int8' else np.float16)
+        self.offset = None
+        self.scale = None
+
+    @property
+    def is_trained(self):
+        return self.offset is not None
+
+    def train(self, vectors):
+        """
+        Learns the offset and scale of every dimension.
+
+        Args:
+            vectors (numpy.ndarray): An (N, D) float32 matrix of encodings.
+        """
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if self.kind == 'int8':
+            low, high = vectors.min(axis=0), vectors.max(axis=0)
+            padding = (high - low) * self.margin
+            offset, scale = low - padding, (high - low + 2 * padding) / 255.0
+        else:
+            offset, scale = vectors.mean(axis=0), vectors.std(axis=0)
+        scale[scale == 0] = 1.0
+        self.offset = offset.astype(np.float32)
+        self.scale = scale.astype(np.float32)
+
+    def encode(self, vectors):
+        """
+        Quantizes encodings.
+
+        Args:
+            vectors (numpy.ndarray): An (N, D) float32 matrix.
+
+        Returns:
+            numpy.ndarray: The (N, D) codes.
+        """
+        normalized = (np.asarray(vectors, dtype=np.float32) - self.offset) / self.scale
+        if self.kind == 'int8':
+            return np.clip(np.rint(normalized), 0, 255).astype(np.uint8)
+        return normalized.astype(np.float16)
+
+    def decode(self, codes):
+        """
+        Reconstructs approximate float32 encodings from codes.
+
+        Args:
+            codes (numpy.ndarray): Codes returned by encode, of any leading shape.
+
+        Returns:
+            numpy.ndarray: The float32 encodings.
+        """
+        return codes.astype(np.float32) * self.scale + self.offset
+
+    def squared_distances(self, queries, codes, sq_norms, block_rows=DEFAULT_BLOCK_ROWS):
+        """
+        Computes squared distances between float32 queries and the decoded codes,
+        without decoding the whole matrix.
+
+        With x = offset + scale * c, |q - x|^2 = |q|^2 - 2 q.offset - 2 (q * scale).c + |x|^2,
+        so only the codes are read, one cache-sized block at a time.
+
+        Args:
+            queries (numpy.ndarray): An (M, D) float32 matrix.
+            codes (numpy.ndarray): The (N, D) codes.
+            sq_norms (numpy.ndarray): Squared norms of the decoded rows.
+            block_rows (int): Rows converted to float32 at a time.
+
+        Returns:
+            numpy.ndarray: An (M, N) matrix of squared distances.
+        """
+        scaled = queries * self.scale
+        distances = np.empty((len(queries), len(codes)), dtype=np.float32)
+        for start in range(0, len(codes), block_rows):
+            block = codes[start:start + block_rows].astype(np.float32)
+            np.matmul(scaled, block.T, out=distances[:, start:start + len(block)])
+        distances *= -2.0
+        distances += sq_norms
+        distances += (np.einsum('ij,ij->i', queries, queries) - 2.0 * (queries @ self.offset))[:, None]
+        np.maximum(distances, 0.0, out=distances)
+        return distances
+
+
+class DecodedRows:
+    """
+    Read-only (N, D) view over quantized codes that decodes only the rows
+    it is indexed with, so IVFIndex.search can scan a quantized gallery.
+    """
+
+    def __init__(self, codes, quantizer):
+        self.codes = codes
+        self.quantizer = quantizer
+
+    @property
+    def shape(self):
+        return self.codes.shape
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, rows):
+        return self.quantizer.decode(self.codes[rows])
+"""
+# Example usage
+quantizer = ScalarQuantizer('int8')
+quantizer.train(encodings)               # (N, 136) float32
+codes = quantizer.encode(encodings)      # (N, 136) uint8, 4x smaller
+approximate = quantizer.decode(codes)
+"""
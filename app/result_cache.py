@@ -0,0 +1,124 @@
+#!/usr/bin/python3
+"""
+Content-addressed cache of recognition results, keyed by a hash of the
+uploaded image bytes
+"""
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from app import metrics
+
+CachedResult = namedtuple('CachedResult', ['boxes', 'encodings', 'recognized_faces', 'enrolled'])
+
+
+class ResultCache:
+    """
+    Class for an LRU cache with a size and time-to-live limit.
+
+    Boxes and encodings only depend on the image and stay valid until they
+    expire. Recognition results also depend on the gallery, so every gallery
+    change starts a new generation and older recognition results are
+    returned as None, to be recomputed from the cached encodings.
+    """
+
+    def __init__(self, max_entries=1024, ttl=600, clock=time.monotonic):
+        """
+        Initializes the ResultCache.
+
+        Args:
+            max_entries (int): Maximum number of cached images.
+            ttl (float): Seconds an entry stays valid.
+            clock (callable): Returns the current time in seconds.
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.clock = clock
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(data):
+        """
+        Computes the cache key of an encoded image.
+
+        Args:
+            data (bytes): The encoded image bytes.
+
+        Returns:
+            str: The hex digest of the bytes.
+        """
+        return hashlib.blake2b(data, digest_size=20).hexdigest()
+
+    def attach(self, database_manager):
+        """
+        Starts a new generation whenever the faces table changes.
+
+        Args:
+            database_manager (DatabaseManager): The manager whose writes invalidate results.
+        """
+        database_manager.add_listener(lambda event, faces: self.invalidate())
+
+    def invalidate(self):
+        """Marks every cached recognition result as stale"""
+        with self._lock:
+            self.generation += 1
+
+    def get(self, key):
+        """
+        Looks up a cached result.
+
+        Args:
+            key (str): The key returned by ResultCache.key.
+
+        Returns:
+            CachedResult: The cached result, with recognized_faces set to None when
+                the gallery changed since it was stored, or None on a miss.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or self.clock() - entry[0] > self.ttl:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                metrics.CACHE_REQUESTS.inc(result='miss')
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            metrics.CACHE_REQUESTS.inc(result='hit')
+            _, generation, result = entry
+            if generation != self.generation:
+                result = result._replace(recognized_faces=None)
+            return result
+
+    def put(self, key, boxes, encodings, recognized_faces, enrolled=False):
+        """
+        Stores the result for an image, evicting the least recently used entries.
+
+        Args:
+            key (str): The key returned by ResultCache.key.
+            boxes (list): The detected face boxes.
+            encodings (list): The face encodings.
+            recognized_faces (list): The recognized names for the current gallery.
+            enrolled (bool): Whether the faces were added to the gallery, which
+                recognition-only callers do not do.
+        """
+        with self._lock:
+            self._entries[key] = (self.clock(), self.generation,
+                                  CachedResult(boxes, encodings, recognized_faces, enrolled))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """Drops every entry"""
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
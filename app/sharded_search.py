@@ -0,0 +1,259 @@
+#!/usr/bin/python3
+"""
+Multi-core gallery scans: the gallery matrix lives in shared memory, every
+worker process scans its own slice of rows and the per-shard top-k results
+are merged
+"""
+
+import logging
+import os
+import weakref
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from app.ann_index import smallest_k, squared_distances
+
+logger = logging.getLogger(__name__)
+
+# Galleries smaller than this are scanned in the calling process, where a
+# scan is cheaper than the round trip to the workers
+DEFAULT_MIN_ROWS = 50000
+
+# Segments attached by the current worker process, by name
+_attached = {}
+
+
+def merge_top_k(distances, indices, k):
+    """
+    Merges the candidates of several shards into the overall k best.
+
+    Args:
+        distances (list): (M, k_i) sorted squared distances of every shard.
+        indices (list): The matching (M, k_i) gallery row indices.
+        k (int): Candidates kept per query.
+
+    Returns:
+        tuple: (distances, indices), both of shape (M, min(k, sum of k_i)).
+    """
+    selected, columns = smallest_k(np.concatenate(distances, axis=1), k)
+    return selected, np.take_along_axis(np.concatenate(indices, axis=1), columns, axis=1)
+
+
+class SharedArrays:
+    """
+    Class allocating numpy arrays in named shared memory segments, so worker
+    processes can map the same rows instead of receiving copies.
+
+    Segments are unlinked when released, and at the latest when the
+    SharedArrays is garbage collected or the interpreter exits.
+    """
+
+    def __init__(self):
+        self._segments = {}
+        # Released segments still mapped by a live view, closed once it is gone
+        self._retired = []
+        self._finalizer = weakref.finalize(self, SharedArrays._unlink_all, self._segments)
+
+    def empty(self, shape, dtype):
+        """
+        Allocates a zero-filled array in a new segment.
+
+        Args:
+            shape (tuple): Shape of the array.
+            dtype (numpy.dtype): Its element type; object arrays cannot be shared.
+
+        Returns:
+            numpy.ndarray: The array, backed by shared memory.
+        """
+        dtype = np.dtype(dtype)
+        segment = shared_memory.SharedMemory(
+            create=True, size=max(1, int(np.prod(shape)) * dtype.itemsize))
+        array = np.ndarray(shape, dtype=dtype, buffer=segment.buf)
+        self._segments[id(array)] = (array, segment)
+        return array
+
+    def describe(self, array):
+        """
+        Returns what a worker needs to map an array: (segment name, shape, dtype).
+
+        Args:
+            array (numpy.ndarray): An array returned by empty(), not a view of it.
+        """
+        _, segment = self._segments[id(array)]
+        return segment.name, array.shape, array.dtype.str
+
+    def owns(self, array):
+        """Returns True if the array was allocated by this SharedArrays"""
+        entry = self._segments.get(id(array))
+        return entry is not None and entry[0] is array
+
+    def release(self, array):
+        """
+        Unlinks the segment of an array that is no longer used.
+
+        Args:
+            array (numpy.ndarray): An array returned by empty().
+        """
+        if not self.owns(array):
+            return
+        _, segment = self._segments.pop(id(array))
+        segment.unlink()
+        self._retired.append(segment)
+        self._close_retired()
+
+    def _close_retired(self):
+        still_mapped = []
+        for segment in self._retired:
+            try:
+                segment.close()
+            except BufferError:
+                still_mapped.append(segment)
+        self._retired = still_mapped
+
+    @staticmethod
+    def _unlink_all(segments):
+        for _, segment in segments.values():
+            try:
+                segment.unlink()
+            except FileNotFoundError:
+                pass
+        segments.clear()
+
+    def close(self):
+        """Unlinks every segment"""
+        self._finalizer()
+        self._close_retired()
+
+
+def _view(description):
+    """Maps an array described by SharedArrays.describe in a worker process"""
+    name, shape, dtype = description
+    segment = _attached.get(name)
+    if segment is None:
+        segment = _attached[name] = shared_memory.SharedMemory(name=name)
+    return np.ndarray(shape, dtype=np.dtype(dtype), buffer=segment.buf)
+
+
+def _forget_segments(keep):
+    """Closes the segments of arrays the gallery has since replaced"""
+    for name in list(_attached):
+        if name not in keep:
+            _attached.pop(name).close()
+
+
+def _search_shard(rows, sq_norms, alive, start, end, queries, k, quantizer):
+    """
+    Scans rows [start, end) of the shared gallery in a worker process.
+
+    Returns:
+        tuple: (squared distances, gallery row indices) of the k best rows of the shard.
+    """
+    descriptions = [description for description in (rows, sq_norms, alive) if description]
+    _forget_segments({name for name, _, _ in descriptions})
+    vectors = _view(rows)[start:end]
+    norms = _view(sq_norms)[start:end]
+    if quantizer is not None:
+        distances = quantizer.squared_distances(queries, vectors, norms)
+    else:
+        distances = squared_distances(queries, vectors, norms)
+    del vectors, norms
+    if alive is not None:
+        distances[:, ~_view(alive)[start:end]] = np.inf
+    found, columns = smallest_k(distances, k)
+    return found, columns + start
+
+
+def _ping():
+    return os.getpid()
+
+
+class ShardedSearcher:
+    """
+    Class splitting exact gallery scans across worker processes.
+
+    The rows are not sent to the workers: FaceGallery.shard() moves its
+    matrix into SharedArrays allocated here, and each query only ships the
+    segment names, the query encodings and the shard boundaries.
+    """
+
+    def __init__(self, workers=None, min_rows=DEFAULT_MIN_ROWS, mp_context=None):
+        """
+        Initializes the ShardedSearcher. The worker pool starts on first use.
+
+        Args:
+            workers (int, optional): Number of shards and worker processes.
+                Defaults to the number of CPUs.
+            min_rows (int): Galleries with fewer rows are scanned in process.
+            mp_context (multiprocessing.context.BaseContext, optional): How the
+                workers are started. The platform default forks, which is only
+                safe before the application starts threads of its own.
+        """
+        self.workers = workers or os.cpu_count() or 1
+        self.min_rows = min_rows
+        self.mp_context = mp_context
+        self.arrays = SharedArrays()
+        self._executor = None
+
+    def _get_executor(self):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=self.mp_context)
+        return self._executor
+
+    def _discard_executor(self):
+        """Drops a broken worker pool, the next query starts a new one"""
+        executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def start(self):
+        """Starts the worker processes ahead of the first query"""
+        executor = self._get_executor()
+        for future in [executor.submit(_ping) for _ in range(self.workers)]:
+            future.result()
+
+    def search(self, queries, k, rows, sq_norms, size, alive=None, quantizer=None):
+        """
+        Scans the first `size` rows of a shared matrix, one slice per worker.
+
+        Args:
+            queries (numpy.ndarray): An (M, D) float32 matrix.
+            k (int): Candidates returned per query.
+            rows (numpy.ndarray): The shared float32 matrix or quantized codes.
+            sq_norms (numpy.ndarray): The shared squared norms of the rows.
+            size (int): Number of rows in use.
+            alive (numpy.ndarray, optional): Shared mask of rows that are not tombstoned.
+            quantizer (ScalarQuantizer, optional): Set when `rows` holds codes.
+
+        Returns:
+            tuple: (squared distances, row indices), both of shape (M, min(k, size)),
+                or None if a worker died and the caller has to scan in process.
+        """
+        descriptions = (self.arrays.describe(rows), self.arrays.describe(sq_norms),
+                        self.arrays.describe(alive) if alive is not None else None)
+        bounds = np.linspace(0, size, self.workers + 1).astype(int)
+        try:
+            executor = self._get_executor()
+            futures = [executor.submit(_search_shard, *descriptions, start, end, queries, k, quantizer)
+                       for start, end in zip(bounds[:-1], bounds[1:]) if end > start]
+            results = [future.result() for future in futures]
+        except BrokenProcessPool:
+            logger.exception("A shard worker died, restarting the worker pool")
+            self._discard_executor()
+            return None
+        return merge_top_k([found for found, _ in results], [indices for _, indices in results], k)
+
+    def close(self):
+        """Shuts the worker pool down and unlinks the shared segments"""
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+        self.arrays.close()
+"""
+# Example usage
+gallery = FaceGallery.from_database_manager(database_manager)
+gallery.shard(workers=8)
+distances, indices = gallery.search(encodings, k=5)  # fans out to 8 processes
+"""
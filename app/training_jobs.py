@@ -0,0 +1,218 @@
+#!/usr/bin/python3
+"""
+Background training jobs: uploaded training images are queued in process
+and enrolled by worker threads while clients poll for progress
+"""
+
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from app.database_operations import DEFAULT_CHUNK_SIZE
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+
+class TrainingJob:
+    """
+    Class holding the progress of one training upload.
+    """
+
+    def __init__(self, job_id, sources):
+        """
+        Initializes the TrainingJob.
+
+        Args:
+            job_id (str): The ID returned to the client.
+            sources (list): (name, encoded bytes) tuples of the uploaded files.
+        """
+        self.job_id = job_id
+        self.sources = sources
+        self.status = QUEUED
+        self.total = len(sources)
+        self.processed = 0
+        self.failed = 0
+        self.faces = 0
+        self.unsaved = 0
+        self.errors = []
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+
+    def to_dict(self):
+        """
+        Describes the job for the status endpoint.
+
+        Returns:
+            dict: Status, counts, per-file errors and throughput of the job.
+                `unsaved` counts originals that could not be queued for writing.
+        """
+        elapsed = None
+        if self.started is not None:
+            elapsed = (self.finished or time.time()) - self.started
+        return {
+            'job_id': self.job_id,
+            'status': self.status,
+            'total': self.total,
+            'processed': self.processed,
+            'failed': self.failed,
+            'faces': self.faces,
+            'unsaved': self.unsaved,
+            'progress': self.processed / self.total if self.total else 1.0,
+            'errors': [{'file': name, 'error': error} for name, error in self.errors],
+            'error': self.error,
+            'seconds': elapsed,
+            'images_per_second': self.processed / elapsed if elapsed else None,
+        }
+
+
+class TrainingJobManager:
+    """
+    Class running training jobs on background threads.
+
+    Jobs wait in an in-process queue, so no broker is needed; queued and
+    running jobs are lost if the process exits. Each job is enrolled in
+    batches through the IngestionEngine, committing every batch, so its
+    progress advances while it runs.
+    """
+
+    def __init__(self, ingestion_engine, database_manager, workers=1, batch_size=32,
+                 chunk_size=DEFAULT_CHUNK_SIZE, max_jobs=100, id_factory=None, enroll=None,
+                 persist=None):
+        """
+        Initializes the TrainingJobManager. The worker threads start on first use.
+
+        Args:
+            ingestion_engine (IngestionEngine): Detects and encodes the images.
+            database_manager (DatabaseManager): Where the faces are stored.
+            workers (int): Jobs processed at the same time.
+            batch_size (int): Files encoded and committed together.
+            chunk_size (int): Rows written per transaction.
+            max_jobs (int): Finished jobs remembered for the status endpoint.
+            id_factory (callable, optional): Returns the ID of each enrolled face.
+            enroll (callable, optional): Stores a list of encodings instead of
+                inserting one faces row each, e.g. IdentityEnroller.enroll.
+            persist (callable, optional): Saves the original of a file given its
+                name and bytes, returning False if it was not saved. Called from
+                the job thread, so it may block without slowing requests down.
+        """
+        self.ingestion_engine = ingestion_engine
+        self.database_manager = database_manager
+        self.workers = workers
+        self.batch_size = batch_size
+        self.chunk_size = chunk_size
+        self.max_jobs = max_jobs
+        self.id_factory = id_factory or (lambda: str(uuid.uuid4()))
+        self.enroll = enroll
+        self.persist = persist
+        self._jobs = OrderedDict()
+        self._queue = queue.Queue()
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def _start(self):
+        with self._lock:
+            if self._threads:
+                return
+            for index in range(self.workers):
+                thread = threading.Thread(target=self._run, name=f'training-job-{index}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def submit(self, sources):
+        """
+        Queues files for enrollment.
+
+        Args:
+            sources (list): (name, encoded bytes) tuples.
+
+        Returns:
+            str: The ID of the new job.
+        """
+        job = TrainingJob(uuid.uuid4().hex, list(sources))
+        with self._lock:
+            self._jobs[job.job_id] = job
+            self._forget_old_jobs()
+        self._start()
+        self._queue.put(job)
+        return job.job_id
+
+    def _forget_old_jobs(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.status in (DONE, FAILED)]
+        for job_id in finished[:max(0, len(finished) - self.max_jobs)]:
+            del self._jobs[job_id]
+
+    def get(self, job_id):
+        """
+        Looks up a job.
+
+        Args:
+            job_id (str): The ID returned by submit.
+
+        Returns:
+            dict: The job's status as returned by TrainingJob.to_dict, or None if unknown.
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return job.to_dict() if job is not None else None
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            try:
+                self._process(job)
+            finally:
+                self._queue.task_done()
+
+    def _process(self, job):
+        with self._lock:
+            job.status = RUNNING
+            job.started = time.time()
+        try:
+            for start in range(0, job.total, self.batch_size):
+                batch = job.sources[start:start + self.batch_size]
+                unsaved = 0
+                if self.persist is not None:
+                    unsaved = sum(not self.persist(name, data) for name, data in batch)
+                reports = self.ingestion_engine.ingest(batch)
+                encodings = [encoding for report in reports for encoding in report.encodings]
+                if self.enroll is not None:
+                    self.enroll(encodings)
+                else:
+                    self.database_manager.add_faces(
+                        ((self.id_factory(), encoding) for encoding in encodings),
+                        chunk_size=self.chunk_size)
+                with self._lock:
+                    job.processed += len(reports)
+                    job.unsaved += unsaved
+                    job.faces += sum(report.faces for report in reports)
+                    for report in reports:
+                        if report.error:
+                            job.failed += 1
+                            job.errors.append((report.name, report.error))
+            status, error = DONE, None
+        except Exception as exc:
+            status, error = FAILED, str(exc)
+        with self._lock:
+            job.status = status
+            job.error = error
+            job.finished = time.time()
+            # The uploaded bytes are no longer needed
+            job.sources = []
+
+    def join(self):
+        """Blocks until every queued job has finished"""
+        self._queue.join()
+"""
+# Example usage
+jobs = TrainingJobManager(ingestion_engine, database_manager, batch_size=32)
+
+job_id = jobs.submit([('alice.jpg', open('alice.jpg', 'rb').read())])
+print(jobs.get(job_id))  # {'status': 'running', 'processed': 0, 'total': 1, ...}
+"""
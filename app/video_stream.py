@@ -0,0 +1,236 @@
+#!/usr/bin/python3
+"""
+Class for recognizing faces in a video file or capture device in real
+time, detecting only on keyframes and tracking faces in between
+"""
+
+from collections import namedtuple
+
+import cv2
+
+from app.face_detection import box_iou
+
+TrackedFace = namedtuple('TrackedFace', ['track_id', 'box', 'name', 'confidence'])
+
+
+class TemplateTracker:
+    """
+    Class for a cheap single-face tracker: the face patch from the last
+    detection is located again in a window around its previous position
+    with normalized cross-correlation.
+    """
+
+    def __init__(self, gray, box, search_margin=0.5):
+        """
+        Initializes the tracker from a detected face.
+
+        Args:
+            gray (numpy.ndarray): The grayscale frame the face was detected in.
+            box (tuple): The face box (x, y, w, h).
+            search_margin (float): Size of the search window around the box,
+                as a fraction of the box size.
+        """
+        self.search_margin = search_margin
+        self.reset(gray, box)
+
+    def reset(self, gray, box):
+        """
+        Restarts tracking from a new detection of the face.
+
+        Args:
+            gray (numpy.ndarray): The grayscale frame.
+            box (tuple): The face box (x, y, w, h).
+        """
+        x, y, w, h = (int(v) for v in box)
+        self.box = (x, y, w, h)
+        self.template = gray[y:y + h, x:x + w].copy()
+
+    def update(self, gray):
+        """
+        Finds the face in a new frame.
+
+        Args:
+            gray (numpy.ndarray): The grayscale frame.
+
+        Returns:
+            tuple: (box, confidence) where confidence is the correlation score
+                between -1.0 and 1.0, or 0.0 if the face left the frame.
+        """
+        x, y, w, h = self.box
+        th, tw = self.template.shape[:2]
+        mx, my = int(w * self.search_margin), int(h * self.search_margin)
+        x0, y0 = max(0, x - mx), max(0, y - my)
+        x1, y1 = min(gray.shape[1], x + w + mx), min(gray.shape[0], y + h + my)
+        window = gray[y0:y1, x0:x1]
+        if tw == 0 or th == 0 or window.shape[0] < th or window.shape[1] < tw:
+            return self.box, 0.0
+        scores = cv2.matchTemplate(window, self.template, cv2.TM_CCOEFF_NORMED)
+        _, confidence, _, (dx, dy) = cv2.minMaxLoc(scores)
+        self.box = (x0 + dx, y0 + dy, w, h)
+        return self.box, float(confidence)
+
+
+class _Track:
+    def __init__(self, track_id, tracker):
+        self.track_id = track_id
+        self.tracker = tracker
+        self.name = None
+        self.confidence = 1.0
+        self.needs_encoding = True
+
+
+class StreamRecognizer:
+    """
+    Class for recognizing faces across the frames of a video stream.
+
+    The detector runs every `keyframe_interval` frames, or as soon as a track
+    is lost. Between keyframes faces are followed with TemplateTracker. A
+    track is encoded and matched against the gallery only when it is new or
+    its tracking confidence falls below `reencode_confidence`.
+    """
+
+    def __init__(self, face_pipeline, face_gallery, keyframe_interval=10,
+                 reencode_confidence=0.6, lost_confidence=0.3, iou_threshold=0.3):
+        """
+        Initializes the StreamRecognizer.
+
+        Args:
+            face_pipeline (FacePipeline): Supplies the detector, aligner and extractor.
+            face_gallery (FaceGallery): The gallery faces are matched against.
+            keyframe_interval (int): Frames between two detector runs.
+            reencode_confidence (float): Tracking score below which a face is re-encoded.
+            lost_confidence (float): Tracking score below which a track is dropped.
+            iou_threshold (float): Overlap needed to tie a detection to an existing track.
+        """
+        self.face_pipeline = face_pipeline
+        self.face_gallery = face_gallery
+        self.keyframe_interval = keyframe_interval
+        self.reencode_confidence = reencode_confidence
+        self.lost_confidence = lost_confidence
+        self.iou_threshold = iou_threshold
+        self.reset()
+
+    def reset(self):
+        """Forgets every track, e.g. before starting a new stream"""
+        self._tracks = []
+        self._next_track_id = 0
+        self._frame_index = 0
+        self._track_lost = False
+
+    def _detect(self, frame, gray):
+        """Runs the detector and ties detections to existing tracks"""
+        boxes = [tuple(int(v) for v in box)
+                 for box in self.face_pipeline.face_detector.detect_faces(frame, gray)]
+        tracks = []
+        unmatched = list(self._tracks)
+        for box in boxes:
+            best = max(unmatched, key=lambda track: box_iou(track.tracker.box, box), default=None)
+            if best is not None and box_iou(best.tracker.box, box) >= self.iou_threshold:
+                unmatched.remove(best)
+                best.tracker.reset(gray, box)
+                best.confidence = 1.0
+                track = best
+            else:
+                track = _Track(self._next_track_id, TemplateTracker(gray, box))
+                self._next_track_id += 1
+            tracks.append(track)
+        self._tracks = tracks
+
+    def _track(self, gray):
+        """Moves every track to the current frame, dropping the lost ones"""
+        tracks = []
+        for track in self._tracks:
+            _, confidence = track.tracker.update(gray)
+            track.confidence = confidence
+            if confidence < self.lost_confidence:
+                self._track_lost = True
+                continue
+            if confidence < self.reencode_confidence:
+                track.needs_encoding = True
+            tracks.append(track)
+        self._tracks = tracks
+
+    def process_frame(self, frame):
+        """
+        Updates the tracks with the next frame of the stream.
+
+        Args:
+            frame (numpy.ndarray): The BGR frame.
+
+        Returns:
+            List[TrackedFace]: The faces visible in the frame.
+        """
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        keyframe = (self._frame_index % self.keyframe_interval == 0
+                    or not self._tracks or self._track_lost)
+        if keyframe:
+            self._track_lost = False
+            self._detect(frame, gray)
+        else:
+            self._track(gray)
+        self._frame_index += 1
+
+        pending = [track for track in self._tracks if track.needs_encoding]
+        if pending:
+            results = self.face_pipeline.process_boxes(
+                frame, [track.tracker.box for track in pending], gray)
+            encodings = [result.encoding for result in results]
+            for track, name in zip(pending, self.face_gallery.recognize(encodings)):
+                track.name = name
+                track.needs_encoding = False
+                track.tracker.reset(gray, track.tracker.box)
+                track.confidence = 1.0
+
+        return [TrackedFace(track.track_id, track.tracker.box, track.name, track.confidence)
+                for track in self._tracks]
+
+    def frames(self, source):
+        """
+        Reads frames from a video file or capture device.
+
+        Args:
+            source (str or int): A video file path, stream URL or device index.
+
+        Yields:
+            numpy.ndarray: Every frame of the stream.
+        """
+        capture = cv2.VideoCapture(source)
+        if not capture.isOpened():
+            raise IOError(f"Could not open video source {source!r}")
+        try:
+            while True:
+                ok, frame = capture.read()
+                if not ok:
+                    return
+                yield frame
+        finally:
+            capture.release()
+
+    def recognize_stream(self, source, max_frames=None):
+        """
+        Recognizes faces frame by frame.
+
+        Args:
+            source (str or int): A video file path, stream URL or device index.
+            max_frames (int, optional): Stop after this many frames.
+
+        Yields:
+            tuple: (frame, List[TrackedFace]) for every frame.
+        """
+        self.reset()
+        for count, frame in enumerate(self.frames(source)):
+            if max_frames is not None and count >= max_frames:
+                return
+            yield frame, self.process_frame(frame)
+"""
+# Example usage
+recognizer = StreamRecognizer(face_pipeline, face_gallery, keyframe_interval=10)
+
+for frame, faces in recognizer.recognize_stream(0):  # webcam 0
+    for track_id, (x, y, w, h), name, confidence in faces:
+        cv2.rectangle(frame, (x, y), (x + w, y + h), (255, 0, 0), 2)
+        cv2.putText(frame, name, (x, y - 5), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 0, 0), 1)
+    cv2.imshow('Face Recognition', frame)
+    if cv2.waitKey(1) & 0xFF == ord('q'):
+        break
+"""
@@ -0,0 +1,210 @@
+#!/usr/bin/python3
+"""
+Compares the face detector backends on a local image set: throughput and
+how often each backend agrees with a reference backend, then recommends
+the fastest backend meeting the agreement threshold
+
+Usage:
+    python3 -m benchmarks.detector_benchmark [image dirs] [--backends haar hog dnn] [--json out.json]
+"""
+
+import argparse
+import json
+import os
+import time
+
+import cv2
+
+from app.face_detection import DETECTOR_BACKENDS, box_iou, create_detector
+
+ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg'}
+DEFAULT_IMAGE_DIRS = ['images/uploads', 'images/training_dataset']
+
+
+def load_images(paths):
+    """
+    Reads every image of the given files and directories.
+
+    Args:
+        paths (list): Image files or directories containing them.
+
+    Returns:
+        list: (name, image) tuples for the images that could be decoded.
+    """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(os.path.join(path, name) for name in sorted(os.listdir(path))
+                         if name.rsplit('.', 1)[-1].lower() in ALLOWED_EXTENSIONS)
+        else:
+            files.append(path)
+    images = []
+    for path in files:
+        image = cv2.imread(path)
+        if image is not None:
+            images.append((path, image))
+    return images
+
+
+def match_boxes(boxes, reference, iou_threshold=0.5):
+    """
+    Greedily pairs detected boxes with reference boxes.
+
+    Args:
+        boxes (list): The boxes found by the backend under test.
+        reference (list): The boxes found by the reference backend.
+        iou_threshold (float): Overlap needed for two boxes to count as the same face.
+
+    Returns:
+        int: The number of matched pairs.
+    """
+    unmatched = [tuple(box) for box in reference]
+    matched = 0
+    for box in boxes:
+        best = max(unmatched, key=lambda ref: box_iou(box, ref), default=None)
+        if best is not None and box_iou(box, best) >= iou_threshold:
+            unmatched.remove(best)
+            matched += 1
+    return matched
+
+
+def run_backend(detector, images, repeat=3):
+    """
+    Times a detector over the image set.
+
+    Args:
+        detector (DetectorBackend): The detector to time.
+        images (list): (name, image) tuples.
+        repeat (int): Passes over the images; the fastest pass is kept.
+
+    Returns:
+        tuple: (seconds of the fastest pass, list of boxes per image)
+    """
+    detections = [detector.detect_faces(image) for _, image in images]  # warm-up pass
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for _, image in images:
+            detector.detect_faces(image)
+        best = min(best, time.perf_counter() - started)
+    return best, [[tuple(int(v) for v in box) for box in boxes] for boxes in detections]
+
+
+def benchmark(images, backends, reference, repeat=3, iou_threshold=0.5):
+    """
+    Benchmarks every backend and scores it against the reference backend.
+
+    Args:
+        images (list): (name, image) tuples.
+        backends (dict): Backend name -> constructor options.
+        reference (str): Name of the backend whose detections count as ground truth.
+        repeat (int): Timed passes per backend.
+        iou_threshold (float): Overlap needed for two boxes to count as the same face.
+
+    Returns:
+        list: One dict per backend with its speed, face count, precision, recall and F1.
+    """
+    detections = {}
+    results = []
+    for name, options in backends.items():
+        try:
+            detector = create_detector(name, **options)
+            seconds, detections[name] = run_backend(detector, images, repeat)
+        except Exception as error:
+            results.append({'backend': name, 'error': str(error).strip()})
+            continue
+        results.append({
+            'backend': name,
+            'seconds': seconds,
+            'images_per_second': len(images) / seconds if seconds else float('inf'),
+            'ms_per_image': 1000.0 * seconds / len(images),
+            'faces': sum(len(boxes) for boxes in detections[name]),
+        })
+
+    truth = detections.get(reference)
+    for result in results:
+        if 'error' in result or truth is None:
+            continue
+        found = detections[result['backend']]
+        matched = sum(match_boxes(boxes, ref, iou_threshold) for boxes, ref in zip(found, truth))
+        expected = sum(len(ref) for ref in truth)
+        precision = matched / result['faces'] if result['faces'] else 1.0
+        recall = matched / expected if expected else 1.0
+        f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+        result.update(precision=precision, recall=recall, agreement=f1)
+    return results
+
+
+def recommend(results, min_agreement):
+    """
+    Picks the fastest backend whose agreement with the reference is high enough.
+
+    Args:
+        results (list): The output of benchmark.
+        min_agreement (float): Minimum F1 agreement with the reference.
+
+    Returns:
+        str: The recommended backend name, or None if none qualifies.
+    """
+    candidates = [result for result in results
+                  if result.get('agreement', 0.0) >= min_agreement]
+    if not candidates:
+        return None
+    return max(candidates, key=lambda result: result['images_per_second'])['backend']
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare face detector backends.')
+    parser.add_argument('paths', nargs='*', default=DEFAULT_IMAGE_DIRS,
+                        help='image files or directories')
+    parser.add_argument('--backends', nargs='+', default=list(DETECTOR_BACKENDS),
+                        choices=list(DETECTOR_BACKENDS))
+    parser.add_argument('--reference', default='dnn', choices=list(DETECTOR_BACKENDS),
+                        help='backend whose detections count as ground truth')
+    parser.add_argument('--cascade-path', default='data/haarcascade_frontalface_default.xml')
+    parser.add_argument('--hog-upsample', type=int, default=0)
+    parser.add_argument('--dnn-model', default='data/res10_300x300_ssd_iter_140000.caffemodel')
+    parser.add_argument('--dnn-config', default='data/deploy.prototxt')
+    parser.add_argument('--max-side', type=int, default=None,
+                        help='longest side detection runs at (default: full resolution)')
+    parser.add_argument('--repeat', type=int, default=3, help='timed passes per backend')
+    parser.add_argument('--min-agreement', type=float, default=0.9,
+                        help='minimum F1 agreement with the reference to be recommended')
+    parser.add_argument('--json', help='also write the results to this file')
+    args = parser.parse_args()
+
+    images = load_images(args.paths)
+    if not images:
+        parser.error('no readable images found')
+
+    options = {
+        'haar': {'cascade_path': args.cascade_path},
+        'hog': {'upsample': args.hog_upsample},
+        'dnn': {'model_path': args.dnn_model, 'config_path': args.dnn_config},
+    }
+    backends = {name: dict(options[name], max_side=args.max_side)
+                for name in dict.fromkeys(args.backends + [args.reference])}
+    results = benchmark(images, backends, args.reference, repeat=args.repeat)
+
+    print(f"{len(images)} images, reference backend: {args.reference}")
+    for result in results:
+        if 'error' in result:
+            print(f"{result['backend']:>5}: failed ({result['error']})")
+            continue
+        line = (f"{result['backend']:>5}: {result['images_per_second']:8.1f} images/s "
+                f"{result['ms_per_image']:8.2f} ms/image {result['faces']:5d} faces")
+        if 'agreement' in result:
+            line += (f"  precision {result['precision']:.3f} recall {result['recall']:.3f} "
+                     f"agreement {result['agreement']:.3f}")
+        print(line)
+    choice = recommend(results, args.min_agreement)
+    print(f"Recommended backend: {choice or 'none meets the agreement threshold'}")
+
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump({'reference': args.reference, 'min_agreement': args.min_agreement,
+                       'recommended': choice, 'results': results}, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,334 @@
+#!/usr/bin/python3
+"""
+Measures where time goes in detect -> align -> encode -> match -> store for
+several image resolutions. Faces are matched against the local face database
+when it has any, otherwise against synthetic galleries of several sizes, and
+every case stores into its own throwaway SQLite database
+
+Usage:
+    python3 -m benchmarks.pipeline_benchmark [image dirs] [--database-url URL]
+        [--gallery-sizes 1000 100000] [--resolutions 640 1280] [--json results.json]
+        [--baseline old.json --max-regression 0.2]
+"""
+
+import argparse
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+import uuid
+
+import cv2
+import numpy as np
+from sqlalchemy.exc import SQLAlchemyError
+
+from app.database_operations import DatabaseManager, database_url
+from app.face_alignment import FaceAligner
+from app.face_detection import DETECTOR_BACKENDS, create_detector
+from app.face_gallery import FaceGallery
+from app.feature_extraction import FeatureExtractor
+from app.quantization import QUANTIZATION_TYPES
+from benchmarks.detector_benchmark import DEFAULT_IMAGE_DIRS, load_images
+
+STAGES = ('detect', 'align', 'encode', 'match', 'store', 'total')
+DEFAULT_GALLERY_SIZES = [1000, 10000, 100000]
+# 68 landmarks x (x, y)
+ENCODING_DIM = 136
+
+
+def resize_longest(image, side):
+    """Scales an image so that its longest side is `side` pixels"""
+    scale = side / float(max(image.shape[:2]))
+    interpolation = cv2.INTER_AREA if scale < 1.0 else cv2.INTER_LINEAR
+    return cv2.resize(image, None, fx=scale, fy=scale, interpolation=interpolation)
+
+
+def synthetic_images(samples, side, count, seed=0):
+    """
+    Builds 4:3 images of the given size: a sample image pasted at a random
+    position on a noisy background, or pure noise when there are no samples.
+
+    Args:
+        samples (list): (name, image) tuples to paste.
+        side (int): Width of the generated images.
+        count (int): Number of images.
+        seed (int): Seed of the random generator.
+
+    Returns:
+        list: (name, image) tuples.
+    """
+    rng = np.random.default_rng(seed)
+    height = side * 3 // 4
+    images = []
+    for index in range(count):
+        canvas = rng.integers(0, 256, (height, side, 3), dtype=np.uint8)
+        canvas = cv2.GaussianBlur(canvas, (0, 0), 3)
+        if samples:
+            _, sample = samples[index % len(samples)]
+            sample = resize_longest(sample, int(min(side, height) * rng.uniform(0.4, 0.9)))
+            y = int(rng.integers(0, height - sample.shape[0] + 1))
+            x = int(rng.integers(0, side - sample.shape[1] + 1))
+            canvas[y:y + sample.shape[0], x:x + sample.shape[1]] = sample
+        images.append((f"synthetic-{side}-{index}", canvas))
+    return images
+
+
+def build_gallery(size, dim=ENCODING_DIM, seed=0, **options):
+    """Returns a FaceGallery holding `size` random encodings"""
+    rng = np.random.default_rng(seed)
+    gallery = FaceGallery(**options)
+    if size:
+        encodings = rng.normal(0.0, 40.0, (size, dim)).astype(np.float32)
+        gallery.add_matrix([f"synthetic-{i}" for i in range(size)], encodings,
+                           [{'name': f"person-{i}"} for i in range(size)])
+    return gallery
+
+
+def load_gallery(url, **options):
+    """
+    Returns a FaceGallery of the faces stored at `url`, or None when that
+    database cannot be reached or holds no faces
+    """
+    try:
+        database_manager = DatabaseManager(url)
+    except (ImportError, SQLAlchemyError) as error:
+        print(f"Cannot open {url} ({error}), using synthetic galleries")
+        return None
+    try:
+        if not database_manager.count_faces():
+            print(f"{url} holds no faces, using synthetic galleries")
+            return None
+        return FaceGallery.from_database_manager(database_manager, **options)
+    except SQLAlchemyError as error:
+        print(f"Cannot read {url} ({error}), using synthetic galleries")
+        return None
+    finally:
+        database_manager.engine.dispose()
+
+
+def galleries(args):
+    """
+    Yields (source, gallery) pairs to benchmark, the local gallery unless
+    --gallery-sizes asks for synthetic ones
+    """
+    local = None if args.gallery_sizes else load_gallery(args.database_url)
+    if local is not None:
+        yield 'local', local
+        return
+    for size in args.gallery_sizes or DEFAULT_GALLERY_SIZES:
+        yield 'synthetic', build_gallery(size)
+
+
+def percentiles(samples):
+    """Summarizes latencies in seconds as milliseconds"""
+    if not samples:
+        return {'count': 0}
+    values = np.asarray(samples) * 1000.0
+    p50, p90, p99 = np.percentile(values, [50, 90, 99])
+    return {'count': len(values), 'mean': float(values.mean()), 'p50': float(p50),
+            'p90': float(p90), 'p99': float(p99), 'max': float(values.max())}
+
+
+def process_image(image, detector, aligner, extractor, gallery, database_manager, timings,
+                  reuse_landmarks=False):
+    """
+    Runs every stage on one image, appending the stage latencies to `timings`.
+
+    Images without faces still time a gallery lookup with a random probe, so the
+    match stage reflects the gallery size on every image. `reuse_landmarks`
+    encodes like FacePipeline(reuse_landmarks=True).
+
+    Returns:
+        int: The number of faces found.
+    """
+    started = time.perf_counter()
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    faces = detector.detect_faces(image, gray)
+    detected = time.perf_counter()
+    aligned = [aligner.align_face_with_shape(image, face, gray) for face in faces]
+    aligned_at = time.perf_counter()
+    if reuse_landmarks:
+        encodings = [extractor.features_from_shape(shape, chip_details)
+                     for _, shape, chip_details in aligned]
+    else:
+        encodings = [extractor.extract_features(aligned_face) for aligned_face, _, _ in aligned]
+    encoded = time.perf_counter()
+    probes = encodings or [np.random.default_rng(len(timings['match'])).normal(
+        0.0, 40.0, gallery.dim or ENCODING_DIM).astype(np.float32)]
+    gallery.recognize(probes)
+    matched = time.perf_counter()
+    if encodings:
+        database_manager.add_faces((str(uuid.uuid4()), encoding) for encoding in encodings)
+    stored = time.perf_counter()
+
+    for stage, start, end in (('detect', started, detected), ('align', detected, aligned_at),
+                              ('encode', aligned_at, encoded), ('match', encoded, matched),
+                              ('store', matched, stored), ('total', started, stored)):
+        timings[stage].append(end - start)
+    return len(faces)
+
+
+def run_case(images, detector, aligner, extractor, gallery, database_manager, repeat=3,
+             reuse_landmarks=False):
+    """
+    Benchmarks one gallery size and resolution.
+
+    Returns:
+        dict: Per-stage percentiles, throughput, face count and peak traced memory.
+    """
+    timings = {stage: [] for stage in STAGES}
+    faces = 0
+    tracemalloc.start()
+    for _, image in images:  # warm-up pass, also used for the memory peak
+        faces += process_image(image, detector, aligner, extractor, gallery, database_manager,
+                               {stage: [] for stage in STAGES}, reuse_landmarks)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for _, image in images:
+            process_image(image, detector, aligner, extractor, gallery, database_manager, timings,
+                          reuse_landmarks)
+    elapsed = time.perf_counter() - started
+    return {
+        'images': len(images),
+        'faces': faces,
+        'images_per_second': len(images) * repeat / elapsed if elapsed else float('inf'),
+        'peak_traced_mb': peak / 2 ** 20,
+        'stages': {stage: percentiles(samples) for stage, samples in timings.items()},
+    }
+
+
+def find_regressions(results, baseline, max_regression, min_ms=0.05):
+    """
+    Compares results with an earlier run.
+
+    Args:
+        results (list): Cases of the current run.
+        baseline (list): Cases of the earlier run.
+        max_regression (float): Allowed relative slowdown, e.g. 0.2 for 20%.
+        min_ms (float): Stages whose baseline p50 is below this are too noisy to compare.
+
+    Returns:
+        list: A description of every metric that got slower than allowed.
+    """
+    def key(case):
+        return (case['source'], case.get('gallery', 'synthetic'), case['gallery_size'],
+                case['resolution'])
+
+    previous = {key(case): case for case in baseline}
+    regressions = []
+    for case in results:
+        old = previous.get(key(case))
+        if old is None:
+            continue
+        label = (f"{case['source']} {case.get('gallery', 'synthetic')} "
+                 f"gallery={case['gallery_size']} resolution={case['resolution']}")
+        if case['images_per_second'] < old['images_per_second'] / (1.0 + max_regression):
+            regressions.append(f"{label}: {case['images_per_second']:.1f} images/s, "
+                               f"was {old['images_per_second']:.1f}")
+        for stage, stats in case['stages'].items():
+            before = old['stages'].get(stage, {}).get('p50')
+            if before is None or 'p50' not in stats or before < min_ms:
+                continue
+            if stats['p50'] > before * (1.0 + max_regression):
+                regressions.append(f"{label}: {stage} p50 {stats['p50']:.2f} ms, was {before:.2f} ms")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Per-stage benchmark of the recognition pipeline.')
+    parser.add_argument('paths', nargs='*', default=DEFAULT_IMAGE_DIRS,
+                        help='sample image files or directories')
+    parser.add_argument('--database-url', default=database_url,
+                        help='database whose faces are the match gallery')
+    parser.add_argument('--gallery-sizes', type=int, nargs='+',
+                        help='match against synthetic galleries of these sizes instead '
+                             f'(default when the database has no faces: {DEFAULT_GALLERY_SIZES})')
+    parser.add_argument('--resolutions', type=int, nargs='+', default=[640, 1280, 1920],
+                        help='longest image sides to test')
+    parser.add_argument('--synthetic', type=int, default=8,
+                        help='synthetic images per resolution (0 to skip)')
+    parser.add_argument('--repeat', type=int, default=3, help='timed passes per case')
+    parser.add_argument('--backend', default='haar', choices=list(DETECTOR_BACKENDS))
+    parser.add_argument('--cascade-path', default='data/haarcascade_frontalface_default.xml')
+    parser.add_argument('--shape-predictor', default='data/shape_predictor_68_face_landmarks.dat')
+    parser.add_argument('--max-side', type=int, default=1280,
+                        help='longest side detection runs at')
+    parser.add_argument('--reuse-landmarks', action='store_true',
+                        help='encode from the alignment landmarks, see REUSE_LANDMARKS')
+    parser.add_argument('--ann', action='store_true', help='search the gallery with the IVF index')
+    parser.add_argument('--quantization', choices=list(QUANTIZATION_TYPES),
+                        help='store the gallery as float16 or int8 codes')
+    parser.add_argument('--shards', type=int,
+                        help='split exact gallery scans across this many worker processes')
+    parser.add_argument('--json', help='write the results to this file')
+    parser.add_argument('--baseline', help='results of an earlier run to compare against')
+    parser.add_argument('--max-regression', type=float, default=0.2,
+                        help='fail when a metric is this much slower than the baseline')
+    args = parser.parse_args()
+
+    samples = load_images(args.paths)
+    options = {'haar': {'cascade_path': args.cascade_path}}.get(args.backend, {})
+    detector = create_detector(args.backend, max_side=args.max_side, **options)
+    aligner = FaceAligner(args.shape_predictor)
+    extractor = FeatureExtractor(args.shape_predictor)
+    # Every case stores into a new SQLite database, removed after the run
+    with tempfile.TemporaryDirectory(prefix='face-x-bench-') as workdir:
+        results = []
+        for gallery_source, gallery in galleries(args):
+            gallery_size = len(gallery)
+            if args.quantization and gallery_size:
+                gallery.quantize(args.quantization)
+            if args.shards and gallery_size:
+                gallery.shard(workers=args.shards, min_rows=0)
+            if args.ann and gallery_size:
+                gallery.build_index(min_rows=1)
+            for resolution in args.resolutions:
+                sets = [('samples', [(name, resize_longest(image, resolution))
+                                     for name, image in samples])]
+                if args.synthetic:
+                    sets.append(('synthetic',
+                                 synthetic_images(samples, resolution, args.synthetic)))
+                for source, images in sets:
+                    if not images:
+                        continue
+                    database_manager = DatabaseManager(
+                        'sqlite:///' + os.path.join(workdir, f"faces-{len(results)}.db"))
+                    case = run_case(images, detector, aligner, extractor, gallery,
+                                    database_manager, args.repeat, args.reuse_landmarks)
+                    database_manager.engine.dispose()
+                    case.update(source=source, gallery=gallery_source,
+                                gallery_size=gallery_size, resolution=resolution)
+                    results.append(case)
+                    stages = '  '.join(f"{stage} {case['stages'][stage].get('p50', 0.0):.2f}"
+                                       for stage in STAGES)
+                    print(f"{source:>9} {gallery_source} gallery={gallery_size:<7} "
+                          f"{resolution:>5}px {case['images_per_second']:7.1f} images/s "
+                          f"peak {case['peak_traced_mb']:7.1f} MB  p50 ms: {stages}")
+            gallery.close()
+
+    max_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+    print(f"Peak resident memory: {max_rss_mb:.1f} MB")
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump({'backend': args.backend, 'max_side': args.max_side, 'repeat': args.repeat,
+                       'max_rss_mb': max_rss_mb, 'results': results}, file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)['results']
+        regressions = find_regressions(results, baseline, args.max_regression)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+        print(f"No regression above {args.max_regression:.0%} against {args.baseline}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+#!/usr/bin/python3
+"""
+Compares float32, float16 and int8 gallery storage: memory per face, query
+latency, and the accuracy lost against the exact float32 search
+
+Usage:
+    python3 -m benchmarks.quantization_benchmark [--gallery-size 100000] [--queries 500]
+        [--database-url URL] [--rerank 32] [--json results.json]
+"""
+
+import argparse
+import json
+import time
+
+import numpy as np
+
+from app.face_gallery import FaceGallery
+from app.quantization import QUANTIZATION_TYPES
+
+# Values of a 68-landmark encoding
+ENCODING_DIM = 136
+
+
+def synthetic_encodings(size, queries, dim=ENCODING_DIM, noise=3.0, seed=0):
+    """
+    Builds landmark-like encodings and noisy queries of known identities.
+
+    Args:
+        size (int): Number of enrolled encodings.
+        queries (int): Number of queries, each a perturbed copy of a gallery row.
+        dim (int): Values per encoding.
+        noise (float): Standard deviation of the query perturbation, in chip pixels.
+        seed (int): Seed of the random generator.
+
+    Returns:
+        tuple: (gallery encodings, query encodings)
+    """
+    rng = np.random.default_rng(seed)
+    gallery = rng.uniform(0.0, 150.0, (size, dim)).astype(np.float32)
+    picks = rng.choice(size, queries, replace=False)
+    probes = gallery[picks] + rng.normal(0.0, noise, (queries, dim)).astype(np.float32)
+    return gallery, probes
+
+
+def measure(encodings, queries, reference, k, threshold, kind=None, rerank=0, repeat=3):
+    """
+    Builds a gallery with the given storage and scores it against the float32 results.
+
+    Returns:
+        dict: Memory per face, query latency, recall at k, top-1 agreement and
+            agreement of the match/no-match decision at the threshold.
+    """
+    gallery = FaceGallery(threshold=float('inf'), top_k=k)
+    gallery.add_matrix([str(i) for i in range(len(encodings))], encodings)
+    if kind:
+        gallery.quantize(kind, rerank)
+    gallery.search(queries[:1], k=k)
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for query in queries:
+            distances, indices = gallery.search(query, k=k)
+        best = min(best, time.perf_counter() - started)
+    distances, indices = gallery.search(queries, k=k)
+    ref_distances, ref_indices = reference
+    recall = np.mean([np.intersect1d(found, truth).size / float(k)
+                      for found, truth in zip(indices, ref_indices)])
+    return {
+        'storage': kind or 'float32',
+        'rerank': rerank,
+        'bytes_per_face': gallery.encoding_bytes() / len(gallery),
+        'ms_per_query': 1000.0 * best / len(queries),
+        'recall_at_k': float(recall),
+        'top1_agreement': float(np.mean(indices[:, 0] == ref_indices[:, 0])),
+        'decision_agreement': float(np.mean(
+            (distances[:, 0] <= threshold) == (ref_distances[:, 0] <= threshold))),
+        'max_distance_error': float(np.max(np.abs(distances[:, 0] - ref_distances[:, 0]))),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Accuracy and memory of quantized galleries.')
+    parser.add_argument('--gallery-size', type=int, default=100000)
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--database-url',
+                        help='use the encodings of this database instead of synthetic ones')
+    parser.add_argument('--k', type=int, default=10, help='neighbours compared per query')
+    parser.add_argument('--threshold', type=float, default=25.0,
+                        help='match threshold whose decisions are compared')
+    parser.add_argument('--rerank', type=int, nargs='*', default=[0, 32],
+                        help='re-rank depths to test for every quantization')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--json', help='write the results to this file')
+    args = parser.parse_args()
+
+    if args.database_url:
+        from app.database_operations import DatabaseManager
+        _, encodings, _ = DatabaseManager(args.database_url).get_all_encodings()
+        rng = np.random.default_rng(0)
+        picks = rng.choice(len(encodings), min(args.queries, len(encodings)), replace=False)
+        queries = encodings[picks] + rng.normal(0.0, 3.0, (len(picks), encodings.shape[1]))
+        queries = queries.astype(np.float32)
+    else:
+        encodings, queries = synthetic_encodings(args.gallery_size, args.queries)
+
+    exact = FaceGallery(threshold=float('inf'), top_k=args.k)
+    exact.add_matrix([str(i) for i in range(len(encodings))], encodings)
+    reference = exact.search(queries, k=args.k)
+
+    results = [measure(encodings, queries, reference, args.k, args.threshold, repeat=args.repeat)]
+    for kind in QUANTIZATION_TYPES:
+        for rerank in args.rerank:
+            results.append(measure(encodings, queries, reference, args.k, args.threshold,
+                                   kind, rerank, args.repeat))
+
+    print(f"{len(encodings)} encodings, {len(queries)} queries, k={args.k}")
+    for result in results:
+        print(f"{result['storage']:>8} rerank={result['rerank']:<3} "
+              f"{result['bytes_per_face']:7.1f} B/face {result['ms_per_query']:7.3f} ms/query "
+              f"recall@{args.k} {result['recall_at_k']:.4f} top-1 {result['top1_agreement']:.4f} "
+              f"decisions {result['decision_agreement']:.4f} "
+              f"max error {result['max_distance_error']:.3f}")
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump({'gallery_size': len(encodings), 'queries': len(queries), 'k': args.k,
+                       'results': results}, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
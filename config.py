@@ -2,3 +2,123 @@
 
 UPLOAD_FOLDER = 'images/uploads'
 
+
+# Maximum euclidean distance between landmark encodings for a match
+MATCH_THRESHOLD = 25.0
+MATCH_TOP_K = 1
+
+# Approximate nearest-neighbour index for large galleries; ANN_NLIST of None
+# picks about 4 * sqrt(gallery size) buckets, ANN_NPROBE trades speed for recall.
+# Smaller galleries are scanned exactly until they reach ANN_MIN_ROWS faces
+ANN_INDEX = False
+ANN_NLIST = None
+ANN_NPROBE = 8
+ANN_MIN_ROWS = 1000
+
+# In-memory storage of the gallery: None keeps float32, 'float16' halves and
+# 'int8' quarters its memory; GALLERY_RERANK > 0 keeps the float32 rows too and
+# re-ranks that many candidates exactly. int8 scans are about as fast as
+# float32 ones (faster for small query batches); float16 only saves memory and
+# makes scans about 2x slower
+GALLERY_QUANTIZATION = None
+GALLERY_RERANK = 0
+
+# Match against per-identity templates (a centroid plus at most
+# IDENTITY_MAX_EXEMPLARS diverse encodings) and fold uploads into them instead
+# of storing a faces row per upload; run consolidate.py to fold existing rows
+IDENTITY_TEMPLATES = False
+IDENTITY_MAX_EXEMPLARS = 8
+IDENTITY_MIN_EXEMPLAR_DISTANCE = 5.0
+
+# Snapshot written by snapshot.py; when the file exists, workers map it and
+# only read the faces changed since the export from the database
+GALLERY_SNAPSHOT_PATH = 'data/gallery.snapshot'
+
+# Worker processes sharing exact gallery scans through shared memory (None
+# scans in the request thread); galleries under GALLERY_SHARD_MIN_ROWS rows
+# are still scanned in process
+GALLERY_SHARDS = None
+GALLERY_SHARD_MIN_ROWS = 50000
+
+# Number of face rows written per INSERT/COMMIT when enrolling in bulk
+DB_INSERT_CHUNK_SIZE = 500
+
+# Precision of encodings written to the faces table: 'float32' or 'float16'
+ENCODING_DTYPE = 'float32'
+
+# Connection pool shared by the per-thread database sessions
+DB_POOL_SIZE = 5
+DB_MAX_OVERFLOW = 10
+DB_POOL_PRE_PING = True
+DB_POOL_RECYCLE = 3600
+
+# Load the shape predictor when the app starts instead of on the first request
+WARM_UP_MODELS = True
+
+# Encode faces from the landmarks predicted during alignment instead of
+# predicting them again on the aligned chip: one shape prediction per face
+# instead of two. The encodings differ from those stored without it, so only
+# enable it for a new database, or after re-enrolling every face with it
+REUSE_LANDMARKS = False
+
+# Face detector backend: 'haar' (OpenCV cascade), 'hog' (dlib) or 'dnn'
+# (OpenCV DNN SSD on the CPU); benchmarks/detector_benchmark.py compares them
+DETECTOR_BACKEND = 'haar'
+# Detectors shared by the request threads, each loading the model once; None
+# uses one per CPU. Requests wait for a free detector beyond that
+DETECTOR_POOL_SIZE = None
+
+# Haar cascade face detection
+CASCADE_PATH = 'data/haarcascade_frontalface_default.xml'
+DETECTION_SCALE_FACTOR = 1.1
+DETECTION_MIN_NEIGHBORS = 5
+DETECTION_MIN_SIZE = (30, 30)
+# Longest image side the cascade runs at (None for full resolution); boxes are
+# mapped back to full resolution, and small ones optionally re-checked there
+DETECTION_MAX_SIDE = 1280
+DETECTION_REFINE = False
+
+# dlib HOG detection; each upsample finds smaller faces at about 4x the cost
+HOG_UPSAMPLE = 0
+
+# OpenCV DNN detection with the res10 SSD Caffe model (or an .onnx export,
+# leaving DNN_CONFIG_PATH as None)
+DNN_MODEL_PATH = 'data/res10_300x300_ssd_iter_140000.caffemodel'
+DNN_CONFIG_PATH = 'data/deploy.prototxt'
+DNN_CONFIDENCE = 0.5
+
+# Worker processes used to ingest training uploads; None uses every CPU
+INGESTION_WORKERS = None
+
+# Training uploads are enrolled by background jobs polled on
+# /training_jobs/<job_id>; files are encoded and committed in batches
+TRAINING_JOB_WORKERS = 1
+TRAINING_JOB_BATCH_SIZE = 32
+TRAINING_JOBS_KEPT = 100
+
+# Keep a copy of uploaded images on disk; written by a background thread and
+# skipped when more than PERSIST_QUEUE_SIZE writes are pending. Training jobs
+# instead wait up to PERSIST_TRAINING_TIMEOUT seconds for room in the queue
+PERSIST_UPLOADS = True
+PERSIST_QUEUE_SIZE = 64
+PERSIST_TRAINING_TIMEOUT = 30
+
+# JSON recognition API (/api/recognize): images accepted per request, and the
+# micro-batching of concurrent requests into one gallery search of at most
+# MATCH_BATCH_SIZE encodings, waiting up to MATCH_BATCH_WAIT seconds
+API_MAX_IMAGES = 32
+MATCH_BATCH_SIZE = 64
+MATCH_BATCH_WAIT = 0.005
+# Seconds a request waits for its batch before failing with 503
+MATCH_BATCH_TIMEOUT = 10.0
+
+# Stage timers and counters served on /metrics. Setting METRICS_TOGGLE_TOKEN
+# lets them be switched at runtime by POSTing enabled=1 or enabled=0 to
+# /metrics/enabled with an 'Authorization: Bearer <token>' header; without a
+# token the endpoint does not exist
+METRICS_ENABLED = False
+METRICS_TOGGLE_TOKEN = None
+
+# Cache of /upload results keyed by a hash of the image bytes
+RESULT_CACHE_SIZE = 1024
+RESULT_CACHE_TTL = 600
@@ -0,0 +1,68 @@
+#!/usr/bin/python3
+"""
+Folds the rows of the faces table into per-identity templates
+
+Rows are read in Face.id order. Rows whose info has a 'name' join the
+identity of that name; the others join the identity whose templates they
+match, or start a new one. Every batch is folded and its rows deleted in
+one transaction, so an interrupted run simply continues when started again.
+
+Usage:
+    python3 consolidate.py [--database-url URL] [--batch-size 1000] [--threshold 25.0]
+        [--max-exemplars 8] [--min-distance 5.0]
+"""
+
+import argparse
+import time
+
+from app.database_operations import DatabaseManager, database_url
+from app.face_gallery import DEFAULT_MATCH_THRESHOLD, FaceGallery
+from app.identity_templates import (DEFAULT_MAX_EXEMPLARS, DEFAULT_MIN_EXEMPLAR_DISTANCE,
+                                    IdentityEnroller)
+
+DEFAULT_BATCH_SIZE = 1000
+
+
+def name_of(info):
+    """Returns the name recorded in a face's info, if any"""
+    return info.get('name') if isinstance(info, dict) else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fold stored faces into identity templates.')
+    parser.add_argument('--database-url', default=database_url,
+                        help='SQLAlchemy URL of the face database')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                        help='faces folded and deleted per transaction')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_MATCH_THRESHOLD,
+                        help='maximum distance for an unnamed face to join an identity')
+    parser.add_argument('--max-exemplars', type=int, default=DEFAULT_MAX_EXEMPLARS)
+    parser.add_argument('--min-distance', type=float, default=DEFAULT_MIN_EXEMPLAR_DISTANCE,
+                        help='minimum distance between the exemplars of an identity')
+    args = parser.parse_args()
+
+    database_manager = DatabaseManager(args.database_url)
+    gallery = FaceGallery.from_identities(database_manager, attach=True, threshold=args.threshold)
+    enroller = IdentityEnroller(gallery, database_manager, args.max_exemplars, args.min_distance)
+    print(f"{len(database_manager.get_identities())} identities before consolidation")
+
+    folded = 0
+    last_id = 0
+    started = time.perf_counter()
+    while True:
+        face_ids, encodings, infos, next_id = database_manager.get_encodings_since(
+            last_id, limit=args.batch_size)
+        if next_id == last_id:
+            break
+        last_id = next_id
+        enroller.enroll(encodings, [name_of(info) for info in infos], consumed_face_ids=face_ids)
+        folded += len(face_ids)
+        print(f"{folded} faces folded ({folded / (time.perf_counter() - started):.0f} faces/s)")
+
+    identities = database_manager.get_identities()
+    rows = sum(len(identity.rows()) for identity in identities)
+    print(f"{folded} faces folded into {len(identities)} identities ({rows} template rows)")
+
+
+if __name__ == '__main__':
+    main()
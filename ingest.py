@@ -0,0 +1,227 @@
+#!/usr/bin/python3
+"""
+Enrolls training images from the command line using all CPU cores
+
+Directories are walked recursively and processed in batches. Every
+processed file is recorded by content hash in a checkpoint manifest, so an
+interrupted run picks up where it stopped when started again with the same
+checkpoint, without inserting any face twice.
+
+Usage:
+    python3 ingest.py images/training_dataset [more files or directories] [--workers N]
+        [--checkpoint ingest_checkpoint.jsonl] [--batch-size 256]
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import time
+import uuid
+from itertools import islice
+
+from app.database_operations import DatabaseManager, DEFAULT_CHUNK_SIZE, database_url
+from app.ingestion import FileReport, IngestionEngine, summarize
+
+shape_predictor_path = "data/shape_predictor_68_face_landmarks.dat"
+cascade_path = "data/haarcascade_frontalface_default.xml"
+ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg'}
+DEFAULT_CHECKPOINT = 'ingest_checkpoint.jsonl'
+DEFAULT_BATCH_SIZE = 256
+# Face IDs are derived from the file hash so that re-enrolling a file
+# produces the same IDs, which are then skipped
+FACE_ID_NAMESPACE = uuid.UUID('6f1c0a3e-5b0e-4f5e-9a57-2c1f4f6f8e10')
+
+
+def collect_images(paths):
+    """
+    Expands files and directory trees into the image files to ingest.
+
+    Args:
+        paths (list): Image files or directories containing them.
+
+    Yields:
+        str: Paths of the image files, in a stable sorted order.
+    """
+    for path in paths:
+        if not os.path.isdir(path):
+            yield path
+            continue
+        for root, dirs, names in os.walk(path):
+            dirs.sort()
+            for name in sorted(names):
+                if name.rsplit('.', 1)[-1].lower() in ALLOWED_EXTENSIONS:
+                    yield os.path.join(root, name)
+
+
+def file_digest(data):
+    """Returns the content hash that identifies a file in the checkpoint"""
+    return hashlib.blake2b(data, digest_size=20).hexdigest()
+
+
+def face_ids_for(digest, count):
+    """Returns the deterministic face IDs of the faces found in a file"""
+    return [str(uuid.uuid5(FACE_ID_NAMESPACE, f"{digest}:{index}")) for index in range(count)]
+
+
+def batched(iterable, size):
+    """Yields lists of up to `size` items"""
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+class Checkpoint:
+    """
+    Append-only manifest with one JSON line per processed file. Lines are
+    flushed to disk after every batch, once the batch's faces are committed.
+    """
+
+    def __init__(self, path):
+        """
+        Opens the manifest, loading the files recorded by earlier runs.
+
+        Args:
+            path (str): Path of the manifest file.
+        """
+        self.path = path
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path) as file:
+                for line in file:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # Last line of a run killed mid-write
+                        continue
+                    self.entries[entry['digest']] = entry
+        self._file = open(path, 'a')
+
+    def is_done(self, digest, retry_failed=False):
+        """Returns True if the file was processed by an earlier batch"""
+        entry = self.entries.get(digest)
+        return entry is not None and not (retry_failed and entry['error'])
+
+    def record(self, entries):
+        """
+        Appends processed files and forces them to disk.
+
+        Args:
+            entries (list): Dicts with the path, digest, faces and error of each file.
+        """
+        for entry in entries:
+            self.entries[entry['digest']] = entry
+            self._file.write(json.dumps(entry) + '\n')
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+
+def ingest_batch(paths, engine, database_manager, checkpoint, retry_failed=False,
+                 chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Enrolls one batch of files and records it in the checkpoint.
+
+    Args:
+        paths (list): Image files of the batch.
+        engine (IngestionEngine): Detects and encodes the faces.
+        database_manager (DatabaseManager): Where the faces are stored.
+        checkpoint (Checkpoint): The manifest of processed files.
+        retry_failed (bool): Process again files that failed in an earlier run.
+        chunk_size (int): Rows written per transaction.
+
+    Returns:
+        tuple: (FileReports of the processed files, number of skipped files)
+    """
+    sources, digests, reports = [], [], []
+    seen = set()
+    skipped = 0
+    for path in paths:
+        try:
+            with open(path, 'rb') as file:
+                data = file.read()
+        except OSError as error:
+            reports.append(FileReport(path, 0, [], str(error), 0.0, 0.0))
+            continue
+        digest = file_digest(data)
+        if digest in seen or checkpoint.is_done(digest, retry_failed):
+            skipped += 1
+            continue
+        seen.add(digest)
+        sources.append((path, data))
+        digests.append(digest)
+
+    processed = engine.ingest(sources) if sources else []
+    rows = []
+    for digest, report in zip(digests, processed):
+        rows.extend(zip(face_ids_for(digest, len(report.encodings)), report.encodings))
+    # Faces committed by a run that stopped before its checkpoint write
+    existing = database_manager.get_existing_face_ids(face_id for face_id, _ in rows)
+    database_manager.add_faces((row for row in rows if row[0] not in existing),
+                               chunk_size=chunk_size)
+    checkpoint.record([{'path': report.name, 'digest': digest, 'faces': report.faces,
+                        'error': report.error} for digest, report in zip(digests, processed)])
+    return reports + processed, skipped
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Enroll training images into the face database.')
+    parser.add_argument('paths', nargs='+', help='image files or directories')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='worker processes (default: number of CPUs)')
+    parser.add_argument('--database-url', default=database_url,
+                        help='SQLAlchemy URL of the face database')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+                        help='rows written per transaction')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                        help='files encoded and checkpointed together')
+    parser.add_argument('--checkpoint', default=DEFAULT_CHECKPOINT,
+                        help='manifest of processed files, used to resume')
+    parser.add_argument('--retry-failed', action='store_true',
+                        help='process again files that failed or had no face')
+    parser.add_argument('--reuse-landmarks', action='store_true',
+                        help='encode from the alignment landmarks, see REUSE_LANDMARKS')
+    parser.add_argument('--verbose', action='store_true', help='print every file')
+    args = parser.parse_args()
+
+    engine = IngestionEngine(shape_predictor_path, 'haar', {'cascade_path': cascade_path},
+                             workers=args.workers, reuse_landmarks=args.reuse_landmarks)
+    database_manager = DatabaseManager(args.database_url)
+    checkpoint = Checkpoint(args.checkpoint)
+    totals = {'files': 0, 'failed': 0, 'faces': 0}
+    skipped = 0
+
+    started = time.perf_counter()
+    try:
+        for batch in batched(collect_images(args.paths), args.batch_size):
+            reports, batch_skipped = ingest_batch(batch, engine, database_manager, checkpoint,
+                                                  args.retry_failed, args.chunk_size)
+            skipped += batch_skipped
+            for key, value in summarize(reports).items():
+                totals[key] += value
+            for report in reports:
+                if args.verbose or report.error:
+                    status = report.error or f"{report.faces} faces"
+                    print(f"{report.name}: {status} "
+                          f"({report.decode_seconds + report.process_seconds:.3f}s)")
+            elapsed = time.perf_counter() - started
+            print(f"{totals['files']} files, {totals['faces']} faces, {skipped} already done "
+                  f"({totals['files'] / elapsed:.1f} images/s)")
+    except KeyboardInterrupt:
+        print(f"Interrupted; run the same command again to resume from {args.checkpoint}")
+    finally:
+        engine.close()
+        checkpoint.close()
+    elapsed = time.perf_counter() - started
+
+    print(f"{totals['faces']} faces from {totals['files'] - totals['failed']}/{totals['files']} "
+          f"files in {elapsed:.1f}s, {skipped} files skipped as already enrolled")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,17 +1,25 @@
 #!/usr/bin/python3
 
-import cv2
+import concurrent.futures
 import os
 import secrets
 import uuid
 
 from app.face_alignment import FaceAligner
-from app.face_detection import FaceDetector
+from app.face_detection import DetectorPool
 from app.face_encoding import FaceEncoder
-from app.face_recognition import FacialRecognizer
+from app.face_gallery import FaceGallery
+from app.identity_templates import IdentityEnroller
 from app.feature_extraction import FeatureExtractor
+from app.image_io import BackgroundWriter, decode_image
+from app.ingestion import IngestionEngine
+from app.match_batcher import MatchBatcher
+from app.pipeline import FacePipeline
+from app.result_cache import ResultCache
+from app.training_jobs import TrainingJobManager
 from app.database_operations import DatabaseManager
-from flask import request, redirect, url_for, Flask, render_template, flash
+from app import metrics, model_registry
+from flask import request, redirect, url_for, Flask, render_template, flash, jsonify, Response
 from werkzeug.utils import secure_filename
 
 
@@ -21,21 +29,165 @@ secret_key = secrets.token_hex(16)
 
 app = Flask(__name__)
 
-# Initialize the face recognition system
+training_dataset_folder = "images/training_dataset"
+app.config['TRAINING_DATASET_FOLDER'] = training_dataset_folder
+app.config.from_pyfile('config.py')
+
+metrics.set_enabled(app.config['METRICS_ENABLED'])
+
+# Initialize the face recognition system; models are shared through the
+# model registry and loaded once per process
+if app.config['WARM_UP_MODELS']:
+    model_registry.warm_up(shape_predictor_path)
 feature_extractor = FeatureExtractor(shape_predictor_path)
 face_aligner = FaceAligner(shape_predictor_path)
 face_encoder = FaceEncoder(feature_extractor)
-database_manager = DatabaseManager(database_url)
 
-training_dataset_folder = "images/training_dataset"
-app.config['TRAINING_DATASET_FOLDER'] = training_dataset_folder
-app.config.from_pyfile('config.py')
+
+def detector_options(config):
+    """Returns the constructor arguments of the configured detector backend"""
+    options = {'min_size': config['DETECTION_MIN_SIZE'], 'max_side': config['DETECTION_MAX_SIDE']}
+    backend = config['DETECTOR_BACKEND']
+    if backend == 'haar':
+        options.update(cascade_path=config['CASCADE_PATH'],
+                       scale_factor=config['DETECTION_SCALE_FACTOR'],
+                       min_neighbors=config['DETECTION_MIN_NEIGHBORS'],
+                       refine=config['DETECTION_REFINE'])
+    elif backend == 'hog':
+        options.update(upsample=config['HOG_UPSAMPLE'])
+    elif backend == 'dnn':
+        options.update(model_path=config['DNN_MODEL_PATH'],
+                       config_path=config['DNN_CONFIG_PATH'],
+                       confidence=config['DNN_CONFIDENCE'])
+    return options
+
+
+face_detectors = DetectorPool(app.config['DETECTOR_BACKEND'], size=app.config['DETECTOR_POOL_SIZE'],
+                              **detector_options(app.config))
+face_pipeline = FacePipeline(face_detectors, face_aligner, feature_extractor,
+                             reuse_landmarks=app.config['REUSE_LANDMARKS'])
+ingestion_engine = IngestionEngine(
+    shape_predictor_path,
+    face_detectors.backend,
+    detector_options=face_detectors.detector_options,
+    workers=app.config['INGESTION_WORKERS'],
+    reuse_landmarks=app.config['REUSE_LANDMARKS'])
+# Forks the ingestion workers now: training jobs would otherwise fork them
+# from a threaded server on their first multi-file upload
+ingestion_engine.start()
+database_manager = DatabaseManager(
+    database_url,
+    encoding_dtype=app.config['ENCODING_DTYPE'],
+    pool_size=app.config['DB_POOL_SIZE'],
+    max_overflow=app.config['DB_MAX_OVERFLOW'],
+    pool_pre_ping=app.config['DB_POOL_PRE_PING'],
+    pool_recycle=app.config['DB_POOL_RECYCLE'])
+if app.config['IDENTITY_TEMPLATES']:
+    face_gallery = FaceGallery.from_identities(
+        database_manager,
+        attach=True,
+        threshold=app.config['MATCH_THRESHOLD'],
+        top_k=app.config['MATCH_TOP_K'])
+elif app.config['GALLERY_SNAPSHOT_PATH'] and os.path.exists(app.config['GALLERY_SNAPSHOT_PATH']):
+    face_gallery = FaceGallery.from_snapshot(
+        app.config['GALLERY_SNAPSHOT_PATH'],
+        database_manager,
+        attach=True,
+        threshold=app.config['MATCH_THRESHOLD'],
+        top_k=app.config['MATCH_TOP_K'])
+else:
+    face_gallery = FaceGallery.from_database_manager(
+        database_manager,
+        attach=True,
+        threshold=app.config['MATCH_THRESHOLD'],
+        top_k=app.config['MATCH_TOP_K'])
+if app.config['GALLERY_QUANTIZATION']:
+    face_gallery.quantize(app.config['GALLERY_QUANTIZATION'], rerank=app.config['GALLERY_RERANK'])
+if app.config['GALLERY_SHARDS']:
+    # Forks the shard workers, before any thread of the application is started
+    face_gallery.shard(workers=app.config['GALLERY_SHARDS'],
+                       min_rows=app.config['GALLERY_SHARD_MIN_ROWS'])
+if app.config['ANN_INDEX']:
+    face_gallery.build_index(nlist=app.config['ANN_NLIST'], nprobe=app.config['ANN_NPROBE'],
+                             min_rows=app.config['ANN_MIN_ROWS'])
+upload_writer = BackgroundWriter(app.config['PERSIST_QUEUE_SIZE'])
+identity_enroller = None
+if app.config['IDENTITY_TEMPLATES']:
+    identity_enroller = IdentityEnroller(
+        face_gallery,
+        database_manager,
+        max_exemplars=app.config['IDENTITY_MAX_EXEMPLARS'],
+        min_distance=app.config['IDENTITY_MIN_EXEMPLAR_DISTANCE'],
+        id_factory=lambda: generate_unique_id())
+result_cache = ResultCache(app.config['RESULT_CACHE_SIZE'], app.config['RESULT_CACHE_TTL'])
+result_cache.attach(database_manager)
+training_jobs = TrainingJobManager(
+    ingestion_engine,
+    database_manager,
+    workers=app.config['TRAINING_JOB_WORKERS'],
+    batch_size=app.config['TRAINING_JOB_BATCH_SIZE'],
+    chunk_size=app.config['DB_INSERT_CHUNK_SIZE'],
+    max_jobs=app.config['TRAINING_JOBS_KEPT'],
+    # generate_unique_id is defined at the bottom of this module
+    id_factory=lambda: generate_unique_id(),
+    enroll=identity_enroller.enroll if identity_enroller is not None else None,
+    # persist_training_file is defined with the routes below
+    persist=(lambda name, data: persist_training_file(name, data))
+    if app.config['PERSIST_UPLOADS'] else None)
+match_batcher = MatchBatcher(
+    face_gallery,
+    max_batch_size=app.config['MATCH_BATCH_SIZE'],
+    max_wait=app.config['MATCH_BATCH_WAIT'])
+
+@app.teardown_appcontext
+def remove_database_session(exception=None):
+    # Return this request's connection to the pool
+    database_manager.remove_session()
+
 
 @app.route('/')
 def home():
     return render_template('index.html')
 
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    # Prometheus scrape target; empty histograms while collection is off
+    return Response(metrics.REGISTRY.render(), mimetype=metrics.CONTENT_TYPE)
+
+@app.route('/metrics/enabled', methods=['POST'])
+def set_metrics_enabled():
+    # Switch collection on or off without restarting, e.g. enabled=1 or enabled=0;
+    # only for clients holding METRICS_TOGGLE_TOKEN
+    token = app.config['METRICS_TOGGLE_TOKEN']
+    if not token:
+        return Response('Not found\n', status=404, mimetype='text/plain')
+    if not secrets.compare_digest(request.headers.get('Authorization', ''), 'Bearer ' + token):
+        return Response('Forbidden\n', status=403, mimetype='text/plain')
+    enabled = request.values.get('enabled', '').lower() in ('1', 'true', 'on', 'yes')
+    metrics.set_enabled(enabled)
+    return Response('enabled\n' if enabled else 'disabled\n', mimetype='text/plain')
+
+def persist_upload(filename, data):
+    # The original is written in the background when PERSIST_UPLOADS is set
+    if app.config['PERSIST_UPLOADS']:
+        upload_writer.submit(os.path.join(app.config['UPLOAD_FOLDER'], secure_filename(filename)), data)
+
+def persist_training_file(filename, data):
+    # Training jobs wait for room in the write queue rather than lose originals
+    return upload_writer.submit(os.path.join(app.config['TRAINING_DATASET_FOLDER'], filename), data,
+                                timeout=app.config['PERSIST_TRAINING_TIMEOUT'])
+
+def enroll_encodings(encodings):
+    # Folds the faces into identity templates, or adds a faces row for each
+    if identity_enroller is not None:
+        identity_enroller.enroll(encodings)
+    else:
+        database_manager.add_faces(
+            ((generate_unique_id(), encoding) for encoding in encodings),
+            chunk_size=app.config['DB_INSERT_CHUNK_SIZE'])
+
 @app.route('/upload', methods=['POST'])
+@metrics.timed(metrics.REQUEST_SECONDS, endpoint='upload')
 def upload():
     # Check if a file was submitted
     if 'file' not in request.files:
@@ -51,51 +203,58 @@ def upload():
 
     # Perform face recognition on the uploaded image
     if file and allowed_file(file.filename):
-        filename = secure_filename(file.filename)
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(file_path)
-        
-        # Load the image using OpenCV
-        image = cv2.imread(file_path)
-
-        # Detect faces in the image
-        cascade_path = "data/haarcascade_frontalface_default.xml"
-        face_detector = FaceDetector(cascade_path)
-        faces = face_detector.detect_faces(image)
-
-        if len(faces) == 0:
-            flash('No faces detected')
+        data = file.read()
+
+        # Repeated uploads of the same bytes are answered from the cache
+        # without decoding, detection or a duplicate database insert
+        cache_key = result_cache.key(data)
+        cached = result_cache.get(cache_key)
+        if cached is not None:
+            if not cached.encodings:
+                flash('No faces detected')
+                return redirect(url_for('home'))
+            recognized_faces = cached.recognized_faces
+            if recognized_faces is None:
+                # The gallery changed since the result was cached
+                recognized_faces = face_gallery.recognize(cached.encodings)
+            if not cached.enrolled:
+                # The image was only seen by /api/recognize so far
+                persist_upload(file.filename, data)
+                enroll_encodings(cached.encodings)
+            if recognized_faces is not cached.recognized_faces or not cached.enrolled:
+                result_cache.put(cache_key, cached.boxes, cached.encodings, recognized_faces,
+                                 enrolled=True)
+            return render_template('results.html', recognized_faces=recognized_faces)
+
+        # Decode the image in memory; the original is saved in the background
+        image = decode_image(data)
+
+        if image is None:
+            flash('Invalid image')
             return redirect(url_for('home'))
 
-        # Align faces
-        aligned_faces = []
-        for face in faces:
-            aligned_face = face_aligner.align_face(image, face)
-            if aligned_face is not None:
-                aligned_faces.append(aligned_face)
+        persist_upload(file.filename, data)
 
-        if not aligned_faces:
-            flash('No faces aligned')
-            return redirect(url_for('home'))
+        # Detect, align and encode every face in one pass
+        face_results = face_pipeline.process(image)
+        face_boxes = [result.box for result in face_results]
+        face_encodings = [result.encoding for result in face_results]
 
-        # Encode faces
-        face_encodings = []
-        for aligned_face in aligned_faces:
-            encoding = face_encoder.encode_face(aligned_face)
-            face_encodings.append(encoding)
+        if not face_encodings:
+            result_cache.put(cache_key, [], [], [])
+            flash('No faces detected')
+            return redirect(url_for('home'))
 
         # Recognize faces
-        recognized_faces = FacialRecognizer.recognize_faces(image, face_encodings)
+        recognized_faces = face_gallery.recognize(face_encodings)
 
         if not recognized_faces:
             flash('No faces recognized')
             return redirect(url_for('home'))
 
         # Update face recognition model or database with the training data
-        for encoding in face_encodings:
-            # Update your face recognition model or database with the encoding
-            database_manager.add_face(face_id=generate_unique_id(), face_image=encoding)
-
+        enroll_encodings(face_encodings)
+        result_cache.put(cache_key, face_boxes, face_encodings, recognized_faces, enrolled=True)
 
         return render_template('results.html', recognized_faces=recognized_faces)
 
@@ -103,11 +262,67 @@ def upload():
     return redirect(url_for('home'))
 
 ...
+@app.route('/api/recognize', methods=['POST'])
+@metrics.timed(metrics.REQUEST_SECONDS, endpoint='api_recognize')
+def api_recognize():
+    # Recognition only: unlike /upload, the faces are not added to the database
+    files = request.files.getlist('images') or request.files.getlist('files[]')
+    if not files:
+        return jsonify({'error': 'No images uploaded.'}), 400
+    if len(files) > app.config['API_MAX_IMAGES']:
+        return jsonify({'error': f"At most {app.config['API_MAX_IMAGES']} images per request."}), 413
+
+    images = []
+    pending = []
+    enrolled = {}
+    for file in files:
+        result = {'filename': file.filename, 'faces': []}
+        images.append(result)
+        data = file.read()
+        cache_key = result_cache.key(data)
+        cached = result_cache.get(cache_key)
+        if cached is not None and cached.recognized_faces is not None:
+            result['faces'] = [{'box': [int(v) for v in box], 'name': name}
+                               for box, name in zip(cached.boxes, cached.recognized_faces)]
+            continue
+        if cached is not None:
+            boxes, encodings = cached.boxes, cached.encodings
+            enrolled[cache_key] = cached.enrolled
+        else:
+            image = decode_image(data)
+            if image is None:
+                result['error'] = 'Invalid image'
+                continue
+            face_results = face_pipeline.process(image)
+            boxes = [face_result.box for face_result in face_results]
+            encodings = [face_result.encoding for face_result in face_results]
+        pending.append((result, cache_key, boxes, encodings))
+
+    # Every face of the request is matched in one submission, batched
+    # together with the faces of concurrent requests
+    try:
+        names = match_batcher.recognize(
+            [encoding for _, _, _, encodings in pending for encoding in encodings],
+            timeout=app.config['MATCH_BATCH_TIMEOUT'])
+    except concurrent.futures.TimeoutError:
+        return jsonify({'error': 'Matching timed out, try again later.'}), 503
+    start = 0
+    for result, cache_key, boxes, encodings in pending:
+        recognized_faces = names[start:start + len(encodings)]
+        start += len(encodings)
+        result['faces'] = [{'box': [int(v) for v in box], 'name': name}
+                           for box, name in zip(boxes, recognized_faces)]
+        # Keeps the enrolled flag of an entry stored by /upload
+        result_cache.put(cache_key, boxes, encodings, recognized_faces,
+                         enrolled=enrolled.get(cache_key, False))
+    return jsonify({'images': images})
+
 @app.route('/upload_training', methods=['GET'])
 def upload_training():
     return render_template('upload.html')
 
 @app.route('/process_training', methods=['POST'])
+@metrics.timed(metrics.REQUEST_SECONDS, endpoint='process_training')
 def process_training():
     # Check if files were submitted
     if 'files[]' not in request.files:
@@ -116,58 +331,30 @@ def process_training():
 
     files = request.files.getlist('files[]')
 
-    # Process each file
-    for file in files:
-        # Check if the file is empty
-        if file.filename == '':
-            flash('No selected file')
-            return redirect(url_for('upload_training'))
-
-        # Save the file to the training dataset directory
-        filename = secure_filename(file.filename)
-        file_path = os.path.join(app.config['TRAINING_DATASET_FOLDER'], filename)
-        file.save(file_path)
-        
-        # Load the image using OpenCV
-        image = cv2.imread(file_path)
-
-        # Detect faces in the image
-        cascade_path = "data/haarcascade_frontalface_default.xml"
-        face_detector = FaceDetector(cascade_path)
-        faces = face_detector.detect_faces(image)
-
-        if len(faces) == 0:
-            flash('No faces detected')
-            return redirect(url_for('home'))
-
-        
-        # Perform face alignment
-        aligned_faces = []
-        for face in faces:
-            aligned_face = face_aligner.align_face(image, face)
-            if aligned_face is not None:
-                aligned_faces.append(aligned_face)
-
-        if not aligned_faces:
-            flash('No faces aligned')
-            return redirect(url_for('upload_training'))
-
-        # Encode faces
-        face_encodings = []
-        for aligned_face in aligned_faces:
-            encoding = face_encoder.encode_face(aligned_face)
-            face_encodings.append(encoding)
-
-        # Update face recognition model or database with the training data
-        for encoding in face_encodings:
-            # Update your face recognition model or database with the encoding
-            database_manager.add_face(face_id=generate_unique_id(), face_image=encoding)
-
-        # Perform any additional processing, such as face alignment, encoding, etc.
-        # Update your face recognition model or database with the training data
+    # Check for empty files
+    if any(file.filename == '' for file in files):
+        flash('No selected file')
+        return redirect(url_for('upload_training'))
 
-    flash('Training dataset uploaded successfully')
+    # Read the files into memory; the training job saves them to the
+    # training dataset directory
+    sources = [(secure_filename(file.filename), file.read()) for file in files]
+
+    # Detecting, aligning, encoding and storing the faces happens in a
+    # background job; the client polls its status instead of waiting
+    job_id = training_jobs.submit(sources)
+    status_url = url_for('training_job_status', job_id=job_id)
+    if request.accept_mimetypes.best == 'application/json':
+        return jsonify({'job_id': job_id, 'status_url': status_url}), 202, {'Location': status_url}
+    flash(f"Training job {job_id} queued for {len(sources)} files; progress at {status_url}")
     return redirect(url_for('home'))
+
+@app.route('/training_jobs/<job_id>', methods=['GET'])
+def training_job_status(job_id):
+    status = training_jobs.get(job_id)
+    if status is None:
+        return jsonify({'error': 'Unknown training job.'}), 404
+    return jsonify(status)
 ...
 
 def allowed_file(filename):
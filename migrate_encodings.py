@@ -0,0 +1,32 @@
+#!/usr/bin/python3
+"""
+Converts face encodings stored with the former PickleType column to the
+compact binary encoding format, in place
+
+Usage:
+    python3 migrate_encodings.py [--database-url URL] [--dtype float32|float16]
+"""
+
+import argparse
+
+from app.database_operations import DatabaseManager, DEFAULT_CHUNK_SIZE, database_url
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Convert pickled face encodings to the binary encoding format.')
+    parser.add_argument('--database-url', default=database_url,
+                        help='SQLAlchemy URL of the face database')
+    parser.add_argument('--dtype', choices=['float32', 'float16'], default='float32',
+                        help='precision used for the converted encodings')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+                        help='rows rewritten per transaction')
+    args = parser.parse_args()
+
+    database_manager = DatabaseManager(args.database_url, encoding_dtype=args.dtype)
+    converted = database_manager.migrate_encodings(chunk_size=args.chunk_size)
+    print(f"Converted {converted} encodings")
+
+
+if __name__ == '__main__':
+    main()
@@ -20,6 +20,11 @@ user_interface = UserInterface(shape_predictor_path, database_manager)
 app.config.from_pyfile('config.py')
 
 
+@app.teardown_appcontext
+def remove_database_session(exception=None):
+    database_manager.remove_session()
+
+
 @app.route('/')
 def index():
     return render_template('index.html')
@@ -33,10 +38,9 @@ def upload():
     image_file = request.files['image']
     recognized_faces = user_interface.recognize_faces(image_file)
 
-    rendered_template = render_template('results.html', recognized_faces=recognized_faces)
-    # json_response = jsonify({'recognized_faces': recognized_faces})
-
-    return rendered_template, 200, {'Content-Type': 'text/html'}, #json_response
+    if request.accept_mimetypes.best == 'application/json':
+        return jsonify({'recognized_faces': recognized_faces})
+    return render_template('results.html', recognized_faces=recognized_faces)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,40 @@
+#!/usr/bin/python3
+"""
+Exports the face gallery to a memory-mapped snapshot file
+
+Web workers started with GALLERY_SNAPSHOT_PATH map this file instead of
+loading the whole faces table, then query only the rows changed since the
+export. Re-run it periodically (e.g. from cron) to keep the catch-up small.
+
+Usage:
+    python3 snapshot.py [--output data/gallery.snapshot] [--database-url URL] [--headroom 0.1]
+"""
+
+import argparse
+import os
+import time
+
+from app.database_operations import DatabaseManager, database_url
+from app.gallery_snapshot import DEFAULT_HEADROOM, export_snapshot
+
+DEFAULT_SNAPSHOT = 'data/gallery.snapshot'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export the face gallery to a snapshot file.')
+    parser.add_argument('--output', default=DEFAULT_SNAPSHOT, help='snapshot file to write')
+    parser.add_argument('--database-url', default=database_url,
+                        help='SQLAlchemy URL of the face database')
+    parser.add_argument('--headroom', type=float, default=DEFAULT_HEADROOM,
+                        help='share of extra rows reserved for faces added after the export')
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    snapshot = export_snapshot(DatabaseManager(args.database_url), args.output, args.headroom)
+    print(f"Wrote {snapshot.size} faces up to row {snapshot.last_row_id} to {args.output} "
+          f"({os.path.getsize(args.output) / 2 ** 20:.1f} MB) "
+          f"in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,26 @@
+import numpy as np
+from sqlalchemy import select
+
+from app.database_operations import DatabaseManager, Face
+
+
+def stored_dtype(database_manager, face_id):
+    with database_manager.engine.connect() as connection:
+        # The column type decodes the blob, keeping the stored precision
+        return connection.execute(
+            select(Face.__table__.c.face_image).where(Face.face_id == face_id)).scalar_one().dtype
+
+
+def test_each_manager_writes_its_own_precision(tmp_path):
+    half = DatabaseManager('sqlite:///%s' % (tmp_path / 'half.db'), encoding_dtype='float16')
+    full = DatabaseManager('sqlite:///%s' % (tmp_path / 'full.db'))
+    encoding = np.linspace(0.0, 1.0, 8, dtype=np.float32)
+
+    half.add_face('a', encoding)
+    full.add_face('a', encoding)
+    half.add_faces([('b', encoding)])
+    full.add_faces([('b', encoding)])
+
+    assert [stored_dtype(half, face_id) for face_id in 'ab'] == [np.float16, np.float16]
+    assert [stored_dtype(full, face_id) for face_id in 'ab'] == [np.float32, np.float32]
+    np.testing.assert_array_equal(full.get_all_encodings()[1][0], encoding)
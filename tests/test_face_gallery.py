@@ -0,0 +1,127 @@
+import numpy as np
+import pytest
+
+from app.face_gallery import FaceGallery
+
+
+def make_gallery(size=10, compaction_ratio=0.9):
+    gallery = FaceGallery(threshold=0.5, top_k=1, compaction_ratio=compaction_ratio)
+    # Rows far enough apart that every row only matches itself
+    encodings = np.arange(size, dtype=np.float32)[:, None] * np.ones((1, 4), dtype=np.float32)
+    gallery.add_matrix(['face-%d' % row for row in range(size)], encodings,
+                       [{'name': 'person-%d' % row} for row in range(size)])
+    return gallery, encodings
+
+
+def test_search_matches_each_row():
+    gallery, encodings = make_gallery()
+    _, indices = gallery.search(encodings)
+    assert indices[:, 0].tolist() == list(range(10))
+    assert gallery.recognize(list(encodings[:2])) == ['person-0', 'person-1']
+
+
+def test_removed_faces_no_longer_match():
+    gallery, encodings = make_gallery()
+    gallery.remove_faces(['face-2', 'face-5'])
+
+    assert len(gallery) == 8
+    assert 'face-2' not in gallery
+    _, indices = gallery.search(encodings[[2, 5, 6]])
+    assert indices[:, 0].tolist() == [-1, -1, 6]
+
+
+def test_adding_a_face_again_replaces_its_row():
+    gallery, encodings = make_gallery()
+    gallery.add_face('face-3', encodings[8] + 100.0, {'name': 'moved'})
+
+    _, indices = gallery.search(encodings[3])
+    assert indices[0, 0] == -1
+    assert gallery.recognize([encodings[8] + 100.0]) == ['moved']
+
+
+def test_compaction_drops_tombstones_and_renumbers_rows():
+    gallery, encodings = make_gallery()
+    gallery.remove_faces(['face-0', 'face-4'])
+    gallery.compact()
+
+    assert gallery.ids.tolist() == ['face-%d' % row for row in (1, 2, 3, 5, 6, 7, 8, 9)]
+    _, indices = gallery.search(encodings[[1, 5, 9]])
+    assert [gallery.get_face_id(index) for index in indices[:, 0]] == ['face-1', 'face-5', 'face-9']
+
+
+def test_compaction_starts_once_the_ratio_is_reached():
+    gallery, _ = make_gallery(compaction_ratio=0.25)
+    gallery.remove_faces(['face-0', 'face-1'])
+    assert len(gallery.ids) == 10
+    gallery.remove_face('face-2')
+    assert len(gallery.ids) == 7
+
+
+def test_empty_gallery_returns_one_row_per_query():
+    gallery = FaceGallery(top_k=2)
+    distances, indices = gallery.search(np.zeros((3, 4), dtype=np.float32))
+    assert indices.shape == (3, 2)
+    assert np.all(indices == -1)
+    assert np.all(np.isinf(distances))
+    assert gallery.recognize([]) == []
+
+
+def test_emptied_gallery_returns_one_row_per_query():
+    gallery, encodings = make_gallery(size=3)
+    gallery.remove_faces(['face-0', 'face-1', 'face-2'])
+    _, indices = gallery.search(encodings)
+    assert indices.tolist() == [[-1], [-1], [-1]]
+    assert gallery.recognize(list(encodings)) == ['Unknown'] * 3
+
+
+def test_quantized_gallery_matches_like_the_exact_one():
+    gallery, encodings = make_gallery()
+    gallery.quantize('int8', rerank=4)
+    _, indices = gallery.search(encodings)
+    assert indices[:, 0].tolist() == list(range(10))
+
+
+def test_index_requested_on_an_empty_gallery_is_trained_once_it_fills():
+    gallery = FaceGallery(threshold=0.5)
+    index = gallery.build_index(nprobe=2, min_rows=100)
+    assert not index.is_trained
+
+    encodings = np.random.default_rng(0).normal(size=(150, 4)).astype(np.float32)
+    gallery.add_matrix(['face-%d' % row for row in range(50)], encodings[:50])
+    assert not index.is_trained
+    gallery.add_matrix(['face-%d' % row for row in range(50, 150)], encodings[50:])
+
+    assert index.is_trained
+    assert sum(len(rows) for rows in index._lists) == 150
+    assert 0.0 <= gallery.index_recall(k=5) <= 1.0
+
+
+def test_index_recall_without_an_index_is_an_error():
+    gallery, _ = make_gallery()
+    with pytest.raises(ValueError):
+        gallery.index_recall()
+
+
+def test_find_match_returns_the_closest_row_within_the_threshold():
+    gallery, encodings = make_gallery()
+    assert gallery.find_match(encodings[4] + 0.1) == 4
+    assert gallery.find_match(encodings[4] + 0.4) is None
+
+
+def test_search_returns_sorted_candidates():
+    gallery, encodings = make_gallery()
+    distances, indices = gallery.search(encodings[5] + 0.1, k=3, threshold=10.0)
+    assert indices[0].tolist() == [5, 6, 4]
+    assert np.all(np.diff(distances[0]) >= 0)
+
+
+def test_update_face_changes_the_name():
+    gallery, encodings = make_gallery()
+    gallery.update_face('face-1', {'name': 'renamed'})
+    assert gallery.recognize([encodings[1]]) == ['renamed']
+
+
+def test_encodings_of_another_dimension_are_rejected():
+    gallery, _ = make_gallery()
+    with pytest.raises(ValueError):
+        gallery.search(np.zeros(5, dtype=np.float32))
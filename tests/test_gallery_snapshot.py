@@ -0,0 +1,112 @@
+import struct
+
+import numpy as np
+import pytest
+
+from app.database_operations import DatabaseManager
+from app.face_gallery import FaceGallery
+from app.gallery_snapshot import FORMAT_VERSION, GallerySnapshot, export_snapshot, write_snapshot
+
+
+@pytest.fixture
+def database_manager(tmp_path):
+    return DatabaseManager('sqlite:///%s' % (tmp_path / 'faces.db'))
+
+
+def encoding(value):
+    return np.full(4, value, dtype=np.float32)
+
+
+def test_snapshot_round_trip(tmp_path):
+    path = str(tmp_path / 'gallery.snapshot')
+    encodings = np.stack([encoding(1.0), encoding(2.0), encoding(3.0)])
+    write_snapshot(path, ['a', 'b', 'c'], encodings, [{'name': 'A'}, None, {'name': 'C'}],
+                   last_row_id=7, headroom=1.0)
+
+    snapshot = GallerySnapshot(path)
+
+    assert snapshot.size == 3
+    assert snapshot.capacity == 6
+    assert snapshot.last_row_id == 7
+    assert snapshot.face_ids() == ['a', 'b', 'c']
+    np.testing.assert_array_equal(snapshot.vectors()[:3], encodings)
+    np.testing.assert_allclose(snapshot.sq_norms()[:3], [4.0, 16.0, 36.0])
+    assert snapshot.infos() == [{'name': 'A'}, None, {'name': 'C'}]
+    assert snapshot.info(2) == {'name': 'C'}
+
+
+def test_empty_snapshot(tmp_path):
+    path = str(tmp_path / 'gallery.snapshot')
+    write_snapshot(path, [], np.empty((0, 0), dtype=np.float32), [], last_row_id=0)
+
+    snapshot = GallerySnapshot(path)
+
+    assert snapshot.size == 0
+    assert snapshot.face_ids() == []
+    assert snapshot.infos() == []
+
+
+def test_other_files_are_rejected(tmp_path):
+    path = tmp_path / 'gallery.snapshot'
+    path.write_bytes(b'not a snapshot at all')
+    with pytest.raises(ValueError):
+        GallerySnapshot(str(path))
+
+
+def test_gallery_catches_up_with_the_database(tmp_path, database_manager):
+    database_manager.add_faces([('a', encoding(1.0), {'name': 'A'}),
+                                ('b', encoding(2.0), {'name': 'B'}),
+                                ('c', encoding(3.0), {'name': 'C'})])
+    path = str(tmp_path / 'gallery.snapshot')
+    export_snapshot(database_manager, path)
+    database_manager.remove_face('b')
+    database_manager.add_faces([('d', encoding(4.0), {'name': 'D'})])
+
+    gallery = FaceGallery.from_snapshot(path, database_manager, threshold=0.5)
+
+    assert sorted(face_id for face_id in gallery.ids if face_id in gallery) == ['a', 'c', 'd']
+    queries = [encoding(1.0), encoding(2.0), encoding(4.0)]
+    assert gallery.recognize(queries) == ['A', 'Unknown', 'D']
+
+
+def test_other_format_versions_are_rejected(tmp_path):
+    path = str(tmp_path / 'gallery.snapshot')
+    write_snapshot(path, ['a'], np.stack([encoding(1.0)]), [None], last_row_id=1)
+    with open(path, 'r+b') as file:
+        file.seek(4)
+        file.write(struct.pack('<H', FORMAT_VERSION + 1))
+    with pytest.raises(ValueError):
+        GallerySnapshot(path)
+
+
+def test_face_ids_with_nul_characters_are_rejected(tmp_path):
+    with pytest.raises(ValueError):
+        write_snapshot(str(tmp_path / 'gallery.snapshot'), ['a\0b'],
+                       np.stack([encoding(1.0)]), [None], last_row_id=1)
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_rewriting_a_snapshot_leaves_open_mappings_intact(tmp_path):
+    path = str(tmp_path / 'gallery.snapshot')
+    write_snapshot(path, ['a'], np.stack([encoding(1.0)]), [None], last_row_id=1)
+    vectors = GallerySnapshot(path).vectors()
+
+    write_snapshot(path, ['b'], np.stack([encoding(9.0)]), [None], last_row_id=2)
+
+    assert vectors[0].tolist() == [1.0] * 4
+    assert GallerySnapshot(path).face_ids() == ['b']
+
+
+def test_rows_added_to_a_mapped_gallery_do_not_touch_the_file(tmp_path):
+    path = str(tmp_path / 'gallery.snapshot')
+    write_snapshot(path, ['a', 'b'], np.stack([encoding(1.0), encoding(2.0)]),
+                   [None, None], last_row_id=2, headroom=1.0)
+    gallery = FaceGallery.from_snapshot(path, threshold=0.5)
+
+    gallery.add_face('c', encoding(3.0), {'name': 'C'})
+    gallery.remove_face('a')
+
+    assert gallery.recognize([encoding(1.0), encoding(3.0)]) == ['Unknown', 'C']
+    snapshot = GallerySnapshot(path)
+    assert snapshot.face_ids() == ['a', 'b']
+    assert not snapshot.vectors()[2].any()
@@ -0,0 +1,114 @@
+import itertools
+
+import numpy as np
+import pytest
+from sqlalchemy import create_engine
+
+from app.database_operations import DatabaseManager, Identity
+from app.face_gallery import FaceGallery
+from app.identity_templates import IdentityEnroller
+
+
+@pytest.fixture
+def database_url(tmp_path):
+    return 'sqlite:///%s' % (tmp_path / 'faces.db')
+
+
+@pytest.fixture
+def database_manager(database_url):
+    return DatabaseManager(database_url)
+
+
+@pytest.fixture
+def enroller(database_manager):
+    gallery = FaceGallery.from_identities(database_manager, attach=True, threshold=1.0)
+    numbers = itertools.count(1)
+    return IdentityEnroller(gallery, database_manager, max_exemplars=3, min_distance=0.1,
+                            id_factory=lambda: 'person-%d' % next(numbers))
+
+
+def encoding(value):
+    return np.full(4, value, dtype=np.float32)
+
+
+def identities(database_manager):
+    return {template.identity_id: template for template in database_manager.get_identities()}
+
+
+def test_unmatched_encodings_start_identities_and_matches_join_them(enroller, database_manager):
+    assert enroller.enroll([encoding(0.0), encoding(10.0)]) == ['person-1', 'person-2']
+    assert enroller.enroll([encoding(0.2)]) == ['person-1']
+
+    stored = identities(database_manager)
+    assert stored['person-1'].count == 2
+    np.testing.assert_allclose(stored['person-1'].centroid, encoding(0.1))
+    assert stored['person-2'].count == 1
+    recognized = enroller.face_gallery.recognize([encoding(0.1), encoding(10.0)])
+    assert recognized == ['person-1', 'person-2']
+
+
+def test_one_new_person_in_a_batch_starts_one_identity(enroller, database_manager):
+    assert enroller.enroll([encoding(5.0), encoding(5.1), encoding(5.2)]) == ['person-1'] * 3
+    assert identities(database_manager)['person-1'].count == 3
+
+
+def test_named_encodings_join_the_identity_of_that_name(enroller, database_manager):
+    first = enroller.enroll([encoding(0.0)], names=['alice'])
+    # Named encodings are not matched, even when they look like someone else
+    second = enroller.enroll([encoding(20.0), encoding(0.0)], names=['alice', None])
+
+    assert second == first + first
+    stored = identities(database_manager)
+    assert list(stored) == first
+    assert stored[first[0]].name == 'alice'
+    assert stored[first[0]].count == 3
+
+
+def test_template_rows_are_replaced_in_the_gallery(enroller):
+    for value in (0.0, 0.5, 0.9):
+        enroller.enroll([encoding(value)])
+    gallery = enroller.face_gallery
+
+    # The centroid plus three exemplars
+    assert len(gallery) == 4
+    assert {gallery.get_info(row)['identity_id'] for row in range(len(gallery.ids))
+            if gallery.get_face_id(row) in gallery} == {'person-1'}
+
+
+def test_consumed_faces_are_deleted_with_the_fold(database_manager):
+    database_manager.add_faces([('a', encoding(1.0)), ('b', encoding(2.0)), ('c', encoding(3.0))])
+    events = []
+    database_manager.add_listener(lambda event, faces: events.append((event, faces)))
+
+    database_manager.fold_encodings(
+        [('person', None, encoding(1.0)), ('person', None, encoding(2.0))], 3, 0.1,
+        consumed_face_ids=['a', 'b'])
+
+    assert database_manager.get_face_ids() == {'c'}
+    assert events[0] == ('remove', [('a', None, None), ('b', None, None)])
+    assert events[1][0] == 'identity'
+    assert identities(database_manager)['person'].count == 2
+
+
+def test_an_identity_created_concurrently_is_folded_into(database_url, database_manager, monkeypatch):
+    other_writer = create_engine(database_url)
+    create_identity = DatabaseManager._create_identity
+
+    def create_after_another_writer(session, identity_id, name):
+        # Another process creates the identity after ours locked the existing ones
+        with other_writer.begin() as connection:
+            connection.execute(Identity.__table__.insert().values(
+                identity_id='theirs', name=name, encoding_count=0))
+        return create_identity(session, identity_id, name)
+
+    monkeypatch.setattr(DatabaseManager, '_create_identity',
+                        staticmethod(create_after_another_writer))
+
+    assigned = database_manager.fold_encodings(
+        [(None, 'alice', encoding(1.0)), (None, 'alice', encoding(3.0))], 3, 0.1)
+
+    assert assigned == ['theirs', 'theirs']
+    stored = identities(database_manager)
+    assert list(stored) == ['theirs']
+    assert stored['theirs'].count == 2
+    other_writer.dispose()
@@ -0,0 +1,43 @@
+import numpy as np
+
+from app.identity_templates import IdentityTemplate, add_exemplar
+
+
+def test_add_exemplar_appends_below_the_cap():
+    exemplars = np.array([[0.0, 0.0]], dtype=np.float32)
+    updated = add_exemplar(exemplars, np.array([3.0, 0.0], dtype=np.float32),
+                           max_exemplars=3, min_distance=1.0)
+    assert updated.tolist() == [[0.0, 0.0], [3.0, 0.0]]
+
+
+def test_add_exemplar_skips_encodings_close_to_an_exemplar():
+    exemplars = np.array([[0.0, 0.0]], dtype=np.float32)
+    updated = add_exemplar(exemplars, np.array([0.5, 0.0], dtype=np.float32),
+                           max_exemplars=3, min_distance=1.0)
+    assert updated is exemplars
+
+
+def test_add_exemplar_replaces_the_closer_member_of_the_closest_pair():
+    exemplars = np.array([[0.0, 0.0], [1.0, 0.0], [10.0, 0.0]], dtype=np.float32)
+    updated = add_exemplar(exemplars, np.array([0.0, 10.0], dtype=np.float32),
+                           max_exemplars=3, min_distance=0.5)
+    assert updated.tolist() == [[0.0, 10.0], [1.0, 0.0], [10.0, 0.0]]
+    # The input matrix is left untouched
+    assert exemplars[0].tolist() == [0.0, 0.0]
+
+
+def test_add_exemplar_keeps_a_full_set_that_is_more_diverse():
+    exemplars = np.array([[0.0, 0.0], [1.0, 0.0], [10.0, 0.0]], dtype=np.float32)
+    # Farther than min_distance from every exemplar, but closer than the closest pair
+    updated = add_exemplar(exemplars, np.array([0.5, 0.6], dtype=np.float32),
+                           max_exemplars=3, min_distance=0.5)
+    assert updated is exemplars
+
+
+def test_template_centroid_is_the_running_mean():
+    template = IdentityTemplate('person')
+    for encoding in ([0.0, 0.0], [2.0, 0.0], [4.0, 6.0]):
+        template.add(np.array(encoding), max_exemplars=2, min_distance=0.1)
+    assert template.count == 3
+    np.testing.assert_allclose(template.centroid, [2.0, 2.0])
+    assert template.rows().shape == (3, 2)
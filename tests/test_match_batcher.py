@@ -0,0 +1,60 @@
+import concurrent.futures
+import threading
+
+import numpy as np
+import pytest
+
+from app.face_gallery import FaceGallery
+from app.match_batcher import MatchBatcher
+
+
+def make_gallery():
+    gallery = FaceGallery(threshold=0.5)
+    gallery.add_matrix(['a', 'b'], np.array([[0.0, 0.0], [5.0, 5.0]], dtype=np.float32),
+                       [{'name': 'alice'}, {'name': 'bob'}])
+    return gallery
+
+
+def test_concurrent_callers_get_their_own_names():
+    batcher = MatchBatcher(make_gallery(), max_batch_size=8, max_wait=0.05)
+    results = {}
+
+    def recognize(key, encodings):
+        results[key] = batcher.recognize(encodings)
+
+    threads = [threading.Thread(target=recognize, args=(0, [np.zeros(2)])),
+               threading.Thread(target=recognize, args=(1, [np.full(2, 5.0), np.full(2, 9.0)]))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    batcher.close()
+
+    assert results == {0: ['alice'], 1: ['bob', 'Unknown']}
+
+
+def test_matching_errors_reach_the_callers():
+    gallery = make_gallery()
+    batcher = MatchBatcher(gallery)
+    with pytest.raises(ValueError):
+        batcher.recognize([np.zeros(3)])
+    assert batcher.recognize([np.zeros(2)]) == ['alice']
+    batcher.close()
+
+
+def test_a_dead_batching_thread_is_replaced(monkeypatch):
+    gallery = make_gallery()
+    batcher = MatchBatcher(gallery, max_wait=0.0)
+    recognize = gallery.recognize
+
+    def crash(encodings):
+        monkeypatch.setattr(gallery, 'recognize', recognize)
+        raise SystemExit
+
+    monkeypatch.setattr(gallery, 'recognize', crash)
+    with pytest.raises(concurrent.futures.TimeoutError):
+        batcher.recognize([np.zeros(2)], timeout=0.5)
+    batcher._thread.join(1.0)
+
+    assert batcher.recognize([np.zeros(2)], timeout=5.0) == ['alice']
+    batcher.close()
@@ -0,0 +1,74 @@
+import numpy as np
+import pytest
+
+from app.face_gallery import FaceGallery
+from app.quantization import DecodedRows, ScalarQuantizer
+
+
+@pytest.mark.parametrize('kind', ['int8', 'float16'])
+def test_squared_distances_match_the_decoded_rows(kind):
+    rng = np.random.default_rng(0)
+    vectors = rng.normal(size=(300, 16)).astype(np.float32)
+    queries = rng.normal(size=(5, 16)).astype(np.float32)
+    quantizer = ScalarQuantizer(kind)
+    quantizer.train(vectors)
+    codes = quantizer.encode(vectors)
+    decoded = quantizer.decode(codes)
+    sq_norms = np.einsum('ij,ij->i', decoded, decoded)
+
+    # Blocks smaller than the gallery exercise the blocked scan
+    distances = quantizer.squared_distances(queries, codes, sq_norms, block_rows=64)
+
+    expected = ((queries[:, None, :] - decoded[None, :, :]) ** 2).sum(axis=2)
+    np.testing.assert_allclose(distances, expected, rtol=1e-4, atol=1e-3)
+
+
+def test_int8_codes_stay_close_to_the_encodings():
+    rng = np.random.default_rng(1)
+    vectors = rng.normal(size=(100, 8)).astype(np.float32)
+    quantizer = ScalarQuantizer('int8')
+    quantizer.train(vectors)
+    codes = quantizer.encode(vectors)
+    assert codes.dtype == np.uint8
+    # Half a quantization step at most
+    assert np.all(np.abs(quantizer.decode(codes) - vectors) <= quantizer.scale / 2 + 1e-6)
+    np.testing.assert_array_equal(DecodedRows(codes, quantizer)[[3, 7]], quantizer.decode(codes[[3, 7]]))
+
+
+def test_unknown_kind_is_rejected():
+    with pytest.raises(ValueError):
+        ScalarQuantizer('int4')
+
+
+def test_int8_clips_values_outside_the_trained_range():
+    quantizer = ScalarQuantizer('int8', margin=0.0)
+    quantizer.train(np.array([[0.0], [1.0]], dtype=np.float32))
+    codes = quantizer.encode(np.array([[-5.0], [0.0], [1.0], [5.0]], dtype=np.float32))
+    assert codes[:, 0].tolist() == [0, 0, 255, 255]
+
+
+@pytest.mark.parametrize('kind, ratio', [('int8', 4), ('float16', 2)])
+def test_quantized_gallery_matches_and_saves_memory(kind, ratio):
+    rng = np.random.default_rng(2)
+    encodings = rng.normal(size=(200, 32)).astype(np.float32)
+    gallery = FaceGallery(threshold=1.0)
+    gallery.add_matrix(['face-%d' % row for row in range(200)], encodings)
+
+    gallery.quantize(kind)
+
+    _, indices = gallery.search(encodings)
+    assert indices[:, 0].tolist() == list(range(200))
+    # The codes, plus the float32 squared norms
+    assert gallery.encoding_bytes() == encodings.nbytes // ratio + 200 * 4
+
+
+def test_rows_added_after_quantizing_are_encoded():
+    rng = np.random.default_rng(3)
+    encodings = rng.normal(size=(20, 8)).astype(np.float32)
+    gallery = FaceGallery(threshold=1.0)
+    gallery.quantize('int8')
+    gallery.add_matrix(['face-%d' % row for row in range(20)], encodings)
+
+    assert gallery.quantizer.is_trained
+    _, indices = gallery.search(encodings)
+    assert indices[:, 0].tolist() == list(range(20))
@@ -0,0 +1,114 @@
+import os
+import signal
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+import pytest
+
+from app.face_gallery import FaceGallery
+from app.sharded_search import SharedArrays, merge_top_k
+
+
+def test_merge_top_k_matches_a_global_sort():
+    rng = np.random.default_rng(0)
+    distances = rng.random((4, 30)).astype(np.float32)
+    shards = [(0, 10), (10, 25), (25, 30)]
+    shard_distances, shard_indices = [], []
+    for start, end in shards:
+        order = np.argsort(distances[:, start:end], axis=1)[:, :5]
+        shard_distances.append(np.take_along_axis(distances[:, start:end], order, axis=1))
+        shard_indices.append(order + start)
+
+    merged, indices = merge_top_k(shard_distances, shard_indices, 5)
+
+    expected = np.argsort(distances, axis=1)[:, :5]
+    np.testing.assert_array_equal(indices, expected)
+    np.testing.assert_array_equal(merged, np.take_along_axis(distances, expected, axis=1))
+
+
+def test_merge_top_k_returns_every_candidate_when_k_is_larger():
+    distances = [np.array([[0.5, 2.0]]), np.array([[1.0]])]
+    indices = [np.array([[3, 0]]), np.array([[7]])]
+
+    merged, rows = merge_top_k(distances, indices, 10)
+
+    assert rows.tolist() == [[3, 7, 0]]
+    assert merged.tolist() == [[0.5, 1.0, 2.0]]
+
+
+@pytest.fixture
+def sharded_gallery():
+    rng = np.random.default_rng(1)
+    encodings = rng.normal(size=(300, 8)).astype(np.float32)
+    gallery = FaceGallery(threshold=100.0, top_k=3, compaction_ratio=1.0)
+    gallery.add_matrix(['face-%d' % row for row in range(300)], encodings)
+    gallery.shard(workers=2, min_rows=0)
+    yield gallery, encodings
+    gallery.close()
+
+
+def test_sharded_search_matches_the_in_process_scan(sharded_gallery):
+    gallery, encodings = sharded_gallery
+    gallery.remove_faces(['face-%d' % row for row in range(0, 300, 7)])
+    queries = encodings[:20] + 0.01
+
+    sharded = gallery.search(queries, k=5)
+    gallery.close()
+    exact = gallery.search(queries, k=5)
+
+    np.testing.assert_array_equal(sharded[1], exact[1])
+    np.testing.assert_allclose(sharded[0], exact[0], rtol=1e-5)
+    assert not np.isin(sharded[1], np.arange(0, 300, 7)).any()
+
+
+def test_quantized_rows_are_scanned_by_the_workers(sharded_gallery):
+    gallery, encodings = sharded_gallery
+    gallery.quantize('int8')
+    assert gallery.shards.arrays.owns(gallery._codes)
+
+    _, indices = gallery.search(encodings[:10], k=1)
+
+    assert indices[:, 0].tolist() == list(range(10))
+
+
+def test_search_survives_a_dead_worker(sharded_gallery):
+    gallery, encodings = sharded_gallery
+    for pid in list(gallery.shards._executor._processes):
+        os.kill(pid, signal.SIGKILL)
+    time.sleep(0.2)
+
+    # Scanned in process while the pool is replaced
+    _, indices = gallery.search(encodings[:5], k=1)
+    assert indices[:, 0].tolist() == list(range(5))
+    _, indices = gallery.search(encodings[5:10], k=1)
+    assert indices[:, 0].tolist() == list(range(5, 10))
+
+
+def test_released_segments_are_unlinked():
+    arrays = SharedArrays()
+    array = arrays.empty((4, 2), np.float32)
+    name, shape, dtype = arrays.describe(array)
+    assert arrays.owns(array)
+    assert not arrays.owns(array.copy())
+
+    arrays.release(array)
+
+    assert not arrays.owns(array)
+    with pytest.raises(FileNotFoundError):
+        shared_memory.SharedMemory(name=name)
+    del array
+    arrays.close()
+
+
+def test_growing_a_sharded_gallery_releases_the_old_segments(sharded_gallery):
+    gallery, encodings = sharded_gallery
+    name = gallery.shards.arrays.describe(gallery._vectors)[0]
+
+    gallery.add_matrix(['new-%d' % row for row in range(300)], encodings + 50.0)
+
+    assert gallery.shards.arrays.describe(gallery._vectors)[0] != name
+    with pytest.raises(FileNotFoundError):
+        shared_memory.SharedMemory(name=name)
+    _, indices = gallery.search(encodings[299] + 50.0, k=1)
+    assert gallery.get_face_id(indices[0, 0]) == 'new-299'
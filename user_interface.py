@@ -3,9 +3,7 @@
 # app/user_interface.py
 import cv2
 
-from app.face_detection import FaceDetector
-from app.face_alignment import FaceAligner
-from app.feature_extraction import FeatureExtractor
+from app.face_gallery import FaceGallery
 from app.face_recognition import FacialRecognizer
 
 
@@ -32,9 +30,9 @@ class UserInterface(FacialRecognizer):
         Args:
             database_manager (DatabaseManager): An instance of the DatabaseManager class.
         """
-        """self.database_manager = database_manager"""
-        database = database_manager.get_database()
-        super().__init__(shape_predictor_path, database)
+        self.database_manager = database_manager
+        gallery = FaceGallery.from_database_manager(database_manager, attach=True)
+        super().__init__(shape_predictor_path, gallery)
 
     def add_face(self, face_id, face_image_path, info=None):
         """